@@ -1,16 +1,19 @@
 from flask import Flask
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from app import serialization, database
 
-db = SQLAlchemy()
+db = database.RoutingSQLAlchemy()
 migrate = Migrate()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    database.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
+    database.replica_router.init_app(app)
+    serialization.init_app(app)
 
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
@@ -21,6 +24,29 @@ def create_app(config_class=Config):
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp)
 
+    from app.export import bp as export_bp
+    app.register_blueprint(export_bp)
+
+    from app.search import bp as search_bp
+    app.register_blueprint(search_bp)
+
+    from app.auth.auth import jwks_store, static_keys, token_cache
+    static_keys.init_app(app)
+    jwks_store.init_app(app)
+    token_cache.init_app(app)
+
+    from app.search import index as search_index
+    search_index.init_app(app)
+
+    from app.counters import counters
+    counters.init_app(app)
+
+    from app.main.response_cache import response_cache
+    response_cache.init_app(app)
+
+    from app.metrics import metrics
+    metrics.init_app(app)
+
     return app
 
 from app import models
@@ -0,0 +1,162 @@
+'''
+Async entry point (backend/asgi.py): the routes of create_app, served to
+uvicorn or gunicorn's uvicorn worker on one event loop per process.
+
+Each request runs the Flask app in a greenlet of its own (app.concurrency),
+with its own scoped session, as Werkzeug's context locals are per greenlet.
+The database drivers (DB_ASYNC, app.async_db) and the JWKS fetches wait on
+the event loop, which serves the other requests meanwhile, so a process
+isn't limited to a thread per request in flight. The lifespan startup
+fetches the JWKS before the first request; shutdown closes the pooled
+connections.
+'''
+import sys
+from tempfile import SpooledTemporaryFile
+
+from sqlalchemy.engine.url import make_url
+
+from app import async_db, create_app
+from app.auth.auth import warm_signing_keys
+from app.concurrency import await_only, greenlet_spawn
+from config import Config
+
+# request bodies up to this size stay in memory
+BODY_MEMORY_SIZE = 65536
+
+
+def wsgi_environ(scope, body):
+    "WSGI environ of an ASGI http `scope`, reading the request from the file `body`"
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # the whole body is buffered, so it can be read without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        # repeated headers are joined, as a WSGI server would
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+class ASGIApp(object):
+    "Serves the Flask `app` (created with DB_ASYNC) to an ASGI server, a greenlet per request"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        else:
+            raise ValueError(f'unsupported ASGI scope {scope["type"]!r}')
+
+    def engines(self):
+        db = self.app.extensions['sqlalchemy'].db
+        binds = [None] + sorted(self.app.config.get('SQLALCHEMY_BINDS') or {})
+        return [db.get_engine(self.app, bind=bind) for bind in binds]
+
+    def startup(self):
+        # a failed fetch is logged and retried by the first request
+        with self.app.app_context():
+            warm_signing_keys()
+
+    def shutdown(self):
+        # aiosqlite connections have a thread each, which would keep the process alive
+        for engine in self.engines():
+            engine.dispose()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await greenlet_spawn(self.startup)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await greenlet_spawn(self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        with SpooledTemporaryFile(max_size=BODY_MEMORY_SIZE) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            await greenlet_spawn(self.run, wsgi_environ(scope, body), send)
+
+    def run(self, environ, send):
+        '''
+        Run the request in its greenlet. The response is sent chunk by chunk,
+        so streamed responses (the exports) aren't buffered.
+        '''
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in headers],
+            }
+            return write
+
+        def write(chunk):
+            if not response.get('sent'):
+                response['sent'] = True
+                await_only(send(response['start']))
+            if chunk:
+                await_only(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}))
+
+        chunks = self.app(environ, start_response)
+        try:
+            for chunk in chunks:
+                write(chunk)
+            write(b'')
+        finally:
+            # ends the app context of streamed responses
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        await_only(send({'type': 'http.response.body', 'body': b''}))
+
+
+def create_asgi_app(config_class=Config):
+    "create_app(config_class) with DB_ASYNC, served by ASGIApp"
+    class AsyncConfig(config_class):
+        DB_ASYNC = True
+
+    app = create_app(AsyncConfig)
+    urls = [app.config['SQLALCHEMY_DATABASE_URI']] + list((app.config.get('SQLALCHEMY_BINDS') or {}).values())
+    if any(make_url(url).get_dialect().name == 'postgresql' for url in urls):
+        async_db.green_psycopg2()
+    return ASGIApp(app)
@@ -0,0 +1,216 @@
+'''
+Database drivers of the async entry point (DB_ASYNC, see app.asgi).
+
+SQLite goes through aiosqlite: `aiosqlite_dbapi()` is a DBAPI module for
+create_engine(module=...) whose connections and cursors await aiosqlite's
+coroutines with await_only. Postgres keeps psycopg2, in its green mode:
+`green_psycopg2()` installs a wait callback that waits for the socket on the
+event loop instead of blocking in libpq.
+
+Either way a request waiting for the database lets the event loop serve the
+other requests. Outside a greenlet of app.concurrency, psycopg2 waits with
+select() and aiosqlite connections can only be closed.
+'''
+import asyncio
+import select
+import sqlite3
+
+from app.concurrency import await_only, in_greenlet
+
+try:
+    import aiosqlite
+except ImportError:  # optional dependency
+    aiosqlite = None
+
+try:
+    import psycopg2
+    from psycopg2 import extensions as psycopg2_extensions
+except ImportError:  # optional dependency
+    psycopg2 = None
+
+
+## SQLite
+
+class AsyncSQLiteCursor(object):
+    "DBAPI cursor over an aiosqlite cursor; rows are fetched `arraysize` at a time"
+
+    arraysize = 100
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = None
+        self._rows = []
+        self._exhausted = True
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _run(self, method, *args):
+        if self._cursor is None:
+            self._cursor = await_only(self.connection._connection.cursor())
+        await_only(getattr(self._cursor, method)(*args))
+        self.description = self._cursor.description
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        self._rows = []
+        self._exhausted = self.description is None
+
+    def execute(self, operation, parameters=()):
+        self._run('execute', operation, parameters)
+
+    def executemany(self, operation, seq_of_parameters):
+        self._run('executemany', operation, seq_of_parameters)
+
+    def _fill(self, size):
+        if len(self._rows) < size and not self._exhausted:
+            rows = await_only(self._cursor.fetchmany(max(size - len(self._rows), self.arraysize)))
+            self._exhausted = not rows
+            self._rows.extend(rows)
+
+    def fetchone(self):
+        self._fill(1)
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        self._fill(size)
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows = self._rows
+        if not self._exhausted:
+            rows.extend(await_only(self._cursor.fetchall()))
+            self._exhausted = True
+        self._rows = []
+        return rows
+
+    def close(self):
+        if self._cursor is not None:
+            cursor, self._cursor = self._cursor, None
+            await_only(cursor.close())
+        self._rows = []
+
+    def setinputsizes(self, *args):
+        pass
+
+    def setoutputsize(self, *args):
+        pass
+
+
+class AsyncSQLiteConnection(object):
+    "DBAPI connection over an aiosqlite connection, which runs sqlite3 on a thread of its own"
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    @property
+    def isolation_level(self):
+        return self._connection.isolation_level
+
+    @isolation_level.setter
+    def isolation_level(self, value):
+        # sqlite3 connections may only be used by aiosqlite's thread
+        await_only(self._connection._execute(setattr, self._connection._conn, 'isolation_level', value))
+
+    def cursor(self):
+        return AsyncSQLiteCursor(self)
+
+    def commit(self):
+        await_only(self._connection.commit())
+
+    def rollback(self):
+        await_only(self._connection.rollback())
+
+    def close(self):
+        if in_greenlet():
+            await_only(self._connection.close())
+        else:
+            # disposal outside the event loop: only stop aiosqlite's thread, which isn't a daemon
+            self._connection.stop()
+
+
+class AsyncSQLiteDBAPI(object):
+    "The DBAPI module of the pysqlite dialect, connecting through aiosqlite"
+
+    paramstyle = 'qmark'
+    apilevel = '2.0'
+    threadsafety = 1
+    sqlite_version = sqlite3.sqlite_version
+    sqlite_version_info = sqlite3.sqlite_version_info
+    PARSE_DECLTYPES = sqlite3.PARSE_DECLTYPES
+    PARSE_COLNAMES = sqlite3.PARSE_COLNAMES
+    Binary = sqlite3.Binary
+
+    # aiosqlite raises sqlite3's exceptions
+    Warning = sqlite3.Warning
+    Error = sqlite3.Error
+    InterfaceError = sqlite3.InterfaceError
+    DatabaseError = sqlite3.DatabaseError
+    DataError = sqlite3.DataError
+    OperationalError = sqlite3.OperationalError
+    IntegrityError = sqlite3.IntegrityError
+    InternalError = sqlite3.InternalError
+    ProgrammingError = sqlite3.ProgrammingError
+    NotSupportedError = sqlite3.NotSupportedError
+
+    def connect(self, database, **kwargs):
+        return AsyncSQLiteConnection(await_only(aiosqlite.connect(database, **kwargs)))
+
+
+def aiosqlite_dbapi():
+    "DBAPI module for create_engine(module=...) of sqlite:// URLs"
+    if aiosqlite is None:
+        raise RuntimeError('DB_ASYNC with SQLite needs the aiosqlite package')
+    return AsyncSQLiteDBAPI()
+
+
+## Postgres
+
+async def _ready(fileno, writable):
+    "Wait on the event loop until the socket `fileno` can be read (or written)"
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+    add, remove = (loop.add_writer, loop.remove_writer) if writable else (loop.add_reader, loop.remove_reader)
+    add(fileno, lambda: waiter.done() or waiter.set_result(None))
+    try:
+        await waiter
+    finally:
+        remove(fileno)
+
+
+def wait_for_psycopg2(connection):
+    "psycopg2 wait callback: polls `connection` until its operation completes"
+    interrupted = None
+    while True:
+        try:
+            state = connection.poll()
+        except psycopg2.Error:
+            if interrupted is not None:
+                raise interrupted
+            raise
+        if state == psycopg2_extensions.POLL_OK:
+            if interrupted is not None:
+                raise interrupted
+            return
+        if state not in (psycopg2_extensions.POLL_READ, psycopg2_extensions.POLL_WRITE):
+            raise psycopg2.OperationalError(f'bad state from poll: {state}')
+        writable = state == psycopg2_extensions.POLL_WRITE
+        try:
+            if in_greenlet():
+                await_only(_ready(connection.fileno(), writable))
+            elif writable:
+                select.select([], [connection.fileno()], [])
+            else:
+                select.select([connection.fileno()], [], [])
+        except (KeyboardInterrupt, asyncio.CancelledError) as e:
+            # cancel the query and wait for it to end, so the connection stays usable
+            connection.cancel()
+            interrupted = e
+
+
+def green_psycopg2():
+    "Make every psycopg2 connection of this process wait for Postgres with wait_for_psycopg2"
+    if psycopg2 is None:
+        raise RuntimeError('DB_ASYNC with Postgres needs psycopg2')
+    psycopg2_extensions.set_wait_callback(wait_for_psycopg2)
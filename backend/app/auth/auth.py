@@ -1,13 +1,21 @@
-import json
-from flask import request, _request_ctx_stack
+import time
+from flask import request, g, current_app
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 from app.auth import bp
+from app.auth.jwks import JWKSStore
+from app.auth.static_keys import StaticKeys
+from app.auth.token_cache import TokenCache
+from app.metrics import add_phase
 
-AUTH0_DOMAIN = 'dev-c.eu.auth0.com'
-ALGORITHMS = ['RS256']
-API_AUDIENCE = 'casting-agency'
+# signing keys of the AUTH0_DOMAIN tenant, shared by all requests of this process
+jwks_store = JWKSStore()
+
+# pinned signing keys; when configured, the JWKS is never fetched
+static_keys = StaticKeys()
+
+# payloads of already verified tokens, until they expire
+token_cache = TokenCache()
 
 ## AuthError Exception
 '''
@@ -55,10 +63,45 @@ def get_token_auth_header():
 
 
 
+## Permission requirements
+'''
+Requirements are compiled once, when `requires_auth` is applied, into frozensets
+that are checked against the permission set of the token.
+'''
+class AllOf(object):
+    "Every one of the permissions (or nested requirements) must be granted"
+    def __init__(self, *permissions):
+        self.permissions = frozenset(p for p in permissions if isinstance(p, str))
+        self.requirements = tuple(compile_requirement(p) for p in permissions if not isinstance(p, str))
+
+    def is_met(self, granted):
+        return self.permissions <= granted and all(r.is_met(granted) for r in self.requirements)
+
+
+class AnyOf(object):
+    "At least one of the permissions (or nested requirements) must be granted"
+    def __init__(self, *permissions):
+        self.permissions = frozenset(p for p in permissions if isinstance(p, str))
+        self.requirements = tuple(compile_requirement(p) for p in permissions if not isinstance(p, str))
+
+    def is_met(self, granted):
+        return (not self.permissions.isdisjoint(granted)
+                or any(r.is_met(granted) for r in self.requirements))
+
+
+def compile_requirement(permission):
+    "A single permission or a list/tuple of permissions (all-of), as requirement object"
+    if isinstance(permission, (AllOf, AnyOf)):
+        return permission
+    if isinstance(permission, str):
+        return AllOf(permission)
+    return AllOf(*permission)
+
+
+
 # Check if specific permission is granted
-def check_permissions(payload, permission = ''):
+def check_permissions(payload, permission = '', granted=None):
     "Check if user has permission to perform requested action"
-    # print(payload)
     "is there permission in JWT?"
     if 'permissions' not in payload:
         raise AuthError({
@@ -68,7 +111,9 @@ def check_permissions(payload, permission = ''):
             }, 400)
 
     "is specific permission granted?"
-    if permission not in payload['permissions']:
+    if granted is None:
+        granted = frozenset(payload['permissions'])
+    if not compile_requirement(permission).is_met(granted):
         raise AuthError({
             'success': False,
             'status': 403,
@@ -81,13 +126,52 @@ def check_permissions(payload, permission = ''):
 
 # verify if token is valid
 '''
+    Signing keys are the pinned `static_keys` if configured, else they come
+    from the process-wide `jwks_store`, so the JWKS is only downloaded when
+    the cached key set expires or an unknown `kid` shows up.
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
+def signing_keys(kid):
+    "Key objects a token signed with `kid` may verify against"
+    if static_keys.enabled:
+        return static_keys.candidates(kid)
+    key = jwks_store.get_key(kid)
+    return [key] if key is not None else []
+
+
+def warm_signing_keys():
+    "Fetch the JWKS ahead of the first request; nothing to do with pinned keys"
+    if not static_keys.enabled:
+        jwks_store.warm()
+
+
+def decode_with(token, keys):
+    '''
+    Payload of `token`, checked against the first of `keys` its signature
+    matches; audience, issuer and algorithms come from the app config.
+    '''
+    config = current_app.config
+    for i, key in enumerate(keys):
+        try:
+            # hand over the already parsed key (wrapped in a mapping, which
+            # jose unpacks), so it isn't rebuilt on every request
+            return jwt.decode(
+                token,
+                {'key': key.prepared_key},
+                algorithms=config['ALGORITHMS'],
+                audience=config['API_AUDIENCE'],
+                issuer='https://' + config['AUTH0_DOMAIN'] + '/'
+            )
+        except (jwt.ExpiredSignatureError, jwt.JWTClaimsError):
+            raise
+        except jwt.JWTError:
+            # signed with another one of the keys
+            if i == len(keys) - 1:
+                raise
+
+
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'success': False,
@@ -95,26 +179,10 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    keys = signing_keys(unverified_header['kid'])
+    if keys:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
-
-            return payload
+            return decode_with(token, keys)
 
         except jwt.ExpiredSignatureError:
             raise AuthError({
@@ -143,15 +211,49 @@ def verify_decode_jwt(token):
 
 
 
+# verify token, unless the same token was verified before and hasn't expired
+def verify_decode_jwt_cached(token):
+    "Returns the payload and the frozenset of its granted permissions"
+    cached = token_cache.get(token)
+    if cached is None:
+        started = time.perf_counter()
+        payload = verify_decode_jwt(token)
+        granted = frozenset(payload.get('permissions', ()))
+        token_cache.put(token, payload, granted, time.perf_counter() - started)
+        return payload, granted
+    return cached
+
+
+
+# Check a further permission of the authenticated user inside a view
+def check_request_permissions(permission):
+    return check_permissions(g.current_user, permission, g.permissions)
+
+
+
 # decorator for authentication process
+'''
+    `permission` is a permission string, a list of permissions that are all
+    required, or an AllOf / AnyOf requirement, e.g.
+    @requires_auth(AnyOf('patch:actors', AllOf('delete:actors', 'add:actors')))
+'''
 def requires_auth(permission=''):
+    requirement = compile_requirement(permission)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(payload, permission)
+            started = time.perf_counter()
+            try:
+                token = get_token_auth_header()
+                payload, granted = verify_decode_jwt_cached(token)
+                check_permissions(payload, requirement, granted)
+            finally:
+                add_phase('auth', time.perf_counter() - started)
+            # for views whose options need further permissions
+            g.current_user = payload
+            g.permissions = granted
             return f(*args, **kwargs)
 
         return wrapper
-    return requires_auth_decorator
\ No newline at end of file
+    return requires_auth_decorator
@@ -0,0 +1,299 @@
+import asyncio
+import http.client
+import io
+import json
+import logging
+import re
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from jose import jwk
+
+from app import concurrency
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+def max_age_from_headers(headers):
+    "Return the Cache-Control max-age in seconds, or None if not given"
+    cache_control = headers.get('Cache-Control') if headers else None
+    if not cache_control:
+        return None
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return 0
+    match = MAX_AGE_PATTERN.search(cache_control)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+class JWKSStore(object):
+    '''
+    Process-wide cache for the signing keys of the identity provider.
+
+    Keys are indexed by `kid` and kept for the Cache-Control max-age of the
+    JWKS response (or `JWKS_CACHE_TTL`). Shortly before they expire a single
+    background thread refetches them, an unknown `kid` triggers at most one
+    synchronous refetch, and if the IdP can't be reached the previous keys
+    keep being served.
+
+    Served by the async entry point (app.asgi), the fetches run on the event
+    loop instead: the background refresh is a task, and requests waiting for
+    a refetch let the loop serve the others.
+    '''
+
+    def __init__(self, url=None, ttl=600, min_ttl=30, refresh_ahead=60,
+                 min_refetch_interval=30, timeout=5):
+        self.default_url = url
+        self.url = url
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._next_attempt = 0.0
+        self._generation = 0
+        self._background = False
+        self._lock = threading.Lock()
+        # held across the fetch
+        self._refresh_lock = concurrency.Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        "Configure the store from the app config; drops cached keys if the url changed"
+        url = app.config.get('JWKS_URL') or self.default_url
+        if not url and app.config.get('AUTH0_DOMAIN'):
+            url = 'https://{}/.well-known/jwks.json'.format(app.config['AUTH0_DOMAIN'])
+        self.ttl = app.config.get('JWKS_CACHE_TTL', self.ttl)
+        self.min_ttl = app.config.get('JWKS_CACHE_MIN_TTL', self.min_ttl)
+        self.refresh_ahead = app.config.get('JWKS_REFRESH_AHEAD', self.refresh_ahead)
+        self.min_refetch_interval = app.config.get(
+            'JWKS_MIN_REFETCH_INTERVAL', self.min_refetch_interval)
+        self.timeout = app.config.get('JWKS_FETCH_TIMEOUT', self.timeout)
+        if url != self.url:
+            self.url = url
+            self.clear()
+        metrics.register('jwks', self.samples)
+        app.extensions['jwks'] = self
+
+    def clear(self):
+        "Forget all cached keys, so the next lookup fetches the key set again"
+        with self._lock:
+            self._keys = {}
+            self._expires_at = 0.0
+            self._fetched_at = 0.0
+            self._next_attempt = 0.0
+            self._generation += 1
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.refresh_errors = 0
+        self.stale_serves = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'background_refreshes': self.background_refreshes,
+            'refresh_errors': self.refresh_errors,
+            'stale_serves': self.stale_serves,
+            'keys': len(self._keys),
+            'expires_in': max(self._expires_at - time.time(), 0),
+        }
+
+    def samples(self):
+        "stats() as metrics samples, see app.metrics"
+        stats = self.stats()
+        return [
+            ('jwks_key_lookups_total', (('result', 'hit'),), stats['hits']),
+            ('jwks_key_lookups_total', (('result', 'miss'),), stats['misses']),
+            ('jwks_refreshes_total', (('result', 'ok'),), stats['refreshes']),
+            ('jwks_refreshes_total', (('result', 'error'),), stats['refresh_errors']),
+            ('jwks_background_refreshes_total', (), stats['background_refreshes']),
+            ('jwks_stale_serves_total', (), stats['stale_serves']),
+            ('jwks_keys', (), stats['keys']),
+            ('jwks_expires_in_seconds', (), stats['expires_in']),
+        ]
+
+    def get_key(self, kid):
+        "Return the key object for `kid`, or None if the IdP doesn't know it"
+        with self._lock:
+            keys = self._keys
+            generation = self._generation
+
+        # first use: nothing to serve yet, every caller waits for one fetch
+        if not keys:
+            self._refresh(generation)
+            with self._lock:
+                key = self._keys.get(kid)
+            self._count(key)
+            return key
+
+        key = keys.get(kid)
+        if key is not None:
+            self.hits += 1
+            if time.time() >= self._expires_at:
+                self.stale_serves += 1
+            self._maybe_refresh_in_background()
+            return key
+
+        # unknown kid: the IdP may have rotated its keys
+        self.misses += 1
+        if time.time() - self._fetched_at >= self.min_refetch_interval:
+            self._refresh(generation)
+            with self._lock:
+                key = self._keys.get(kid)
+        return key
+
+    def warm(self):
+        "Fetch the key set now if none is cached, so the first requests don't wait for it"
+        with self._lock:
+            if self._keys:
+                return
+            generation = self._generation
+        self._refresh(generation)
+
+    def _count(self, key):
+        if key is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def _maybe_refresh_in_background(self):
+        now = time.time()
+        with self._lock:
+            if (self._background
+                    or now < self._expires_at - self.refresh_ahead
+                    or now < self._next_attempt):
+                return
+            self._background = True
+            generation = self._generation
+
+        concurrency.start_background(self._background_refresh, generation)
+
+    def _background_refresh(self, generation):
+        try:
+            self.background_refreshes += 1
+            self._refresh(generation)
+        finally:
+            with self._lock:
+                self._background = False
+
+    def _refresh(self, generation):
+        '''
+        Fetch the key set unless another thread did so while we waited for the
+        refresh lock (single-flight). Fetch errors keep the old keys.
+        '''
+        with self._refresh_lock:
+            if generation != self._generation or time.time() < self._next_attempt:
+                return
+            started = time.perf_counter()
+            try:
+                jwks, max_age = self.fetch()
+                keys = self.parse(jwks)
+            except Exception:
+                metrics.observe('jwks_fetch_duration_seconds', (('result', 'error'),),
+                                time.perf_counter() - started)
+                self.refresh_errors += 1
+                logger.warning('Unable to refresh JWKS from %s', self.url, exc_info=True)
+                now = time.time()
+                with self._lock:
+                    self._fetched_at = now
+                    self._next_attempt = now + self.min_refetch_interval
+                return
+
+            metrics.observe('jwks_fetch_duration_seconds', (('result', 'ok'),), time.perf_counter() - started)
+            if max_age is None:
+                max_age = self.ttl
+            now = time.time()
+            with self._lock:
+                self._keys = keys
+                self._fetched_at = now
+                self._next_attempt = now
+                self._expires_at = now + max(max_age, self.min_ttl)
+                self._generation += 1
+            self.refreshes += 1
+
+    def fetch(self):
+        "Download the key set; returns the parsed JSON and the Cache-Control max-age"
+        if concurrency.in_greenlet():
+            return concurrency.await_only(self.fetch_async())
+        return self.fetch_blocking()
+
+    def fetch_blocking(self):
+        "fetch() with urllib, on the calling thread"
+        response = urlopen(self.url, timeout=self.timeout)
+        try:
+            jwks = json.loads(response.read())
+            max_age = max_age_from_headers(response.headers)
+        finally:
+            response.close()
+        return jwks, max_age
+
+    async def fetch_async(self):
+        "fetch() on the event loop; other than http(s) urls (file://) are read on a thread"
+        url = urlsplit(self.url)
+        if url.scheme not in ('http', 'https'):
+            return await asyncio.get_running_loop().run_in_executor(None, self.fetch_blocking)
+        status, headers, body = await asyncio.wait_for(http_get(url), self.timeout)
+        if status != 200:
+            raise OSError(f'JWKS request to {self.url} returned HTTP {status}')
+        return json.loads(body), max_age_from_headers(headers)
+
+    @staticmethod
+    def parse(jwks):
+        "Build a `kid` -> key object index of the signing keys in a key set"
+        keys = {}
+        for key in jwks['keys']:
+            if 'kid' not in key or key.get('use', 'sig') != 'sig':
+                continue
+            keys[key['kid']] = jwk.construct(key, key.get('alg', 'RS256'))
+        return keys
+
+
+async def http_get(url):
+    "GET the urlsplit() `url` over asyncio streams; returns the status, headers and body"
+    secure = url.scheme == 'https'
+    reader, writer = await asyncio.open_connection(
+        url.hostname, url.port or (443 if secure else 80),
+        ssl=ssl.create_default_context() if secure else None)
+    try:
+        target = (url.path or '/') + ('?' + url.query if url.query else '')
+        writer.write('GET {} HTTP/1.1\r\nHost: {}\r\nAccept: application/json\r\nConnection: close\r\n\r\n'
+                     .format(target, url.netloc).encode('latin-1'))
+        await writer.drain()
+        head = await reader.readuntil(b'\r\n\r\n')
+        status_line, _, header_lines = head.partition(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = http.client.parse_headers(io.BytesIO(header_lines))
+        if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif headers.get('Content-Length'):
+            body = await reader.readexactly(int(headers['Content-Length']))
+        else:
+            # the server closes the connection after the body
+            body = await reader.read()
+        return status, headers, body
+    finally:
+        writer.close()
@@ -0,0 +1,78 @@
+import json
+import re
+
+from jose import jwk
+
+PEM_BLOCK = re.compile(r'-----BEGIN ([A-Z ]+)-----.+?-----END \1-----', re.DOTALL)
+
+
+class StaticKeys(object):
+    '''
+    Pinned signing keys, from AUTH_PUBLIC_KEYS (the keys themselves) or
+    AUTH_PUBLIC_KEYS_FILE (a path). With either set, tokens are verified
+    against these keys only and the JWKS is never fetched.
+
+    The keys are a JWKS or a list of JWKs, a JSON object of `kid` -> PEM, or
+    PEM public keys / certificates. They are parsed into key objects when
+    the app is created, and a malformed key fails the start. PEM keys carry
+    no `kid`, so a token whose `kid` isn't pinned is tried against each of them.
+    '''
+
+    def __init__(self):
+        self.keys = {}
+        self.unnamed = []
+
+    @property
+    def enabled(self):
+        return bool(self.keys or self.unnamed)
+
+    def init_app(self, app):
+        text = app.config.get('AUTH_PUBLIC_KEYS')
+        path = app.config.get('AUTH_PUBLIC_KEYS_FILE')
+        if not text and path:
+            with open(path) as keys_file:
+                text = keys_file.read()
+        self.keys, self.unnamed = {}, []
+        if text:
+            try:
+                self.keys, self.unnamed = parse_keys(text, app.config.get('ALGORITHMS', ['RS256'])[0])
+            except Exception as e:
+                raise RuntimeError(f'invalid AUTH_PUBLIC_KEYS: {e}') from e
+            if not self.enabled:
+                raise RuntimeError('AUTH_PUBLIC_KEYS holds no signing key')
+        app.extensions['static_keys'] = self
+
+    def candidates(self, kid):
+        "Keys a token signed with `kid` may verify against"
+        key = self.keys.get(kid)
+        return [key] if key is not None else self.unnamed
+
+
+def parse_keys(text, algorithm):
+    "`kid` -> key object, and the list of keys without a `kid`"
+    text = text.strip()
+    keys, unnamed = {}, []
+    if text.startswith('-----'):
+        blocks = [match.group(0) for match in PEM_BLOCK.finditer(text)]
+        if not blocks:
+            raise ValueError('no PEM block found')
+        return keys, [jwk.construct(pem, algorithm) for pem in blocks]
+
+    data = json.loads(text)
+    if isinstance(data, dict) and 'keys' in data:
+        data = data['keys']
+    elif isinstance(data, dict) and 'kty' in data:
+        data = [data]
+    elif isinstance(data, dict):
+        # kid -> PEM
+        return {kid: jwk.construct(pem, algorithm) for kid, pem in data.items()}, unnamed
+
+    for key in data:
+        if key.get('use', 'sig') != 'sig':
+            continue
+        key_object = jwk.construct(key, key.get('alg', algorithm))
+        if 'kid' in key:
+            keys[key['kid']] = key_object
+        else:
+            unnamed.append(key_object)
+    return keys, unnamed
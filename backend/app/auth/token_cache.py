@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import metrics
+
+
+class TokenCache(object):
+    '''
+    Bounded LRU cache of verified JWT payloads, keyed by the SHA-256 of the token.
+    Each entry also keeps the frozenset of the token's permissions, so it is
+    built once per token rather than once per request.
+
+    An entry is only valid until the `exp` claim of its token, so a cached
+    token never outlives the signature check it replaces. Tokens without
+    `exp` are not cached.
+    '''
+
+    def __init__(self, maxsize=1024, enabled=True):
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('AUTH_TOKEN_CACHE_ENABLED', self.enabled)
+        self.maxsize = app.config.get('AUTH_TOKEN_CACHE_SIZE', self.maxsize)
+        self.clear()
+        metrics.register('token_cache', self.samples)
+        app.extensions['token_cache'] = self
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.verifications = 0
+        self.verify_seconds = 0.0
+
+    def stats(self):
+        "Counters; `saved_seconds` estimates the verification time hits didn't spend"
+        average = self.verify_seconds / self.verifications if self.verifications else 0.0
+        return {
+            'enabled': self.enabled,
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'verifications': self.verifications,
+            'verify_seconds': self.verify_seconds,
+            'saved_seconds': self.hits * average,
+        }
+
+    def samples(self):
+        "stats() as metrics samples, see app.metrics"
+        stats = self.stats()
+        return [
+            ('auth_token_cache_lookups_total', (('result', 'hit'),), stats['hits']),
+            ('auth_token_cache_lookups_total', (('result', 'miss'),), stats['misses']),
+            ('auth_token_cache_removals_total', (('reason', 'eviction'),), stats['evictions']),
+            ('auth_token_cache_removals_total', (('reason', 'expiration'),), stats['expirations']),
+            ('auth_token_cache_entries', (), stats['size']),
+            ('auth_token_verifications_total', (), stats['verifications']),
+            ('auth_token_verify_seconds_total', (), stats['verify_seconds']),
+            ('auth_token_cache_saved_seconds', (), stats['saved_seconds']),
+        ]
+
+    @staticmethod
+    def key(token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        "Return the cached (payload, permissions) of `token`, or None"
+        if not self.enabled:
+            return None
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, granted, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload, granted
+
+    def put(self, token, payload, granted, verify_seconds=0.0):
+        "Remember a freshly verified payload; `verify_seconds` is what the check cost"
+        self.verifications += 1
+        self.verify_seconds += verify_seconds
+        if not self.enabled or self.maxsize <= 0:
+            return
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)):
+            return
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (payload, granted, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
@@ -0,0 +1,210 @@
+'''
+Running the synchronous app on an asyncio event loop (see app.asgi).
+
+greenlet_spawn runs a function in a greenlet of its own. When the function
+reaches I/O, await_only hands the awaitable to the event loop, which goes on
+with other requests until it completes, then switches back to the greenlet.
+The views, the session and the drivers keep their blocking interfaces; only
+the drivers (app.async_db) and the JWKS fetch call await_only. This is how
+SQLAlchemy 1.4 runs its sync Session on asyncio drivers.
+
+Outside such a greenlet (the sync servers, the CLI, tests) everything here
+behaves like its threading counterpart.
+'''
+import asyncio
+import sys
+import threading
+from collections import deque
+
+from sqlalchemy.util.queue import Empty, Full
+
+try:
+    import greenlet
+except ImportError:  # optional dependency
+    greenlet = None
+
+if greenlet is not None:
+    class _LoopGreenlet(greenlet.greenlet):
+        "Runs a function for the event loop; `driver` is the greenlet awaiting for it"
+
+        def __init__(self, fn, driver):
+            super().__init__(fn, driver)
+            self.driver = driver
+
+
+def in_greenlet():
+    "True inside a function run by greenlet_spawn, where await_only may be called"
+    return greenlet is not None and isinstance(greenlet.getcurrent(), _LoopGreenlet)
+
+
+def await_only(awaitable):
+    "Wait for `awaitable` on the event loop, which runs other tasks meanwhile; returns its result"
+    if not in_greenlet():
+        raise RuntimeError('await_only() called outside of greenlet_spawn()')
+    # the driver awaits it and switches back with the result, or throws its exception in here
+    return greenlet.getcurrent().driver.switch(awaitable)
+
+
+async def greenlet_spawn(fn, *args, **kwargs):
+    "Run `fn(*args, **kwargs)` in a new greenlet, awaiting what it passes to await_only"
+    if greenlet is None:
+        raise RuntimeError('async serving needs the greenlet package')
+    context = _LoopGreenlet(fn, greenlet.getcurrent())
+    result = context.switch(*args, **kwargs)
+    while not context.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = context.throw(*sys.exc_info())
+        else:
+            result = context.switch(value)
+    return result
+
+
+# tasks of start_background, referenced until they finish
+_background_tasks = set()
+
+
+def start_background(fn, *args):
+    "Run `fn(*args)` without waiting for it: as a task of the event loop in a greenlet, else on a thread"
+    if in_greenlet():
+        task = asyncio.get_running_loop().create_task(greenlet_spawn(fn, *args))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    else:
+        threading.Thread(target=fn, args=args, daemon=True).start()
+
+
+class Lock(object):
+    '''
+    threading.Lock for locks held across I/O. A greenlet that has to wait
+    for it waits on the event loop: blocking the loop's thread would also
+    stop the greenlet holding the lock, which never gets to release it.
+    Released, it goes to the longest waiting greenlet.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        if not in_greenlet():
+            return self._lock.acquire(True, timeout)
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append((loop, waiter))
+        # released before the waiter was queued: nobody would hand it over
+        if self._lock.acquire(False):
+            self._waiters.remove((loop, waiter))
+            return True
+        try:
+            await_only(waiter)
+        except BaseException:
+            if (loop, waiter) in self._waiters:
+                self._waiters.remove((loop, waiter))
+            elif waiter.done() and not waiter.cancelled():
+                # cancelled after the lock was handed over
+                self.release()
+            raise
+        return True
+
+    def release(self):
+        while self._waiters:
+            loop, waiter = self._waiters.popleft()
+            if not waiter.done():
+                # stays locked, for the waiter
+                loop.call_soon_threadsafe(self._hand_over, waiter)
+                return
+        self._lock.release()
+
+    def _hand_over(self, waiter):
+        if waiter.done():
+            # cancelled since
+            self.release()
+        else:
+            waiter.set_result(None)
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AsyncQueue(object):
+    '''
+    The connection queue of QueuePool (sqlalchemy.util.queue.Queue), for
+    pools used by greenlets: a get() that has to wait for a connection
+    waits on the event loop. Outside a greenlet it never waits.
+
+    A returned connection goes to the longest waiting get(), so requests
+    arriving meanwhile can't take it over and starve the waiters.
+    '''
+
+    def __init__(self, maxsize=0, use_lifo=False):
+        self.maxsize = maxsize
+        self.use_lifo = use_lifo
+        self._items = deque()
+        self._waiters = deque()
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return 0 < self.maxsize <= len(self._items)
+
+    def put(self, item, block=True, timeout=None):
+        # QueuePool returns connections without waiting, and closes them when full
+        while self._waiters:
+            loop, waiter = self._waiters.popleft()
+            if not waiter.done():
+                loop.call_soon_threadsafe(self._hand_over, waiter, item)
+                return
+        if self.full():
+            raise Full()
+        self._items.append(item)
+
+    def _hand_over(self, waiter, item):
+        if waiter.done():
+            # timed out or cancelled since
+            self.put(item)
+        else:
+            waiter.set_result(item)
+
+    def get(self, block=True, timeout=None):
+        if self._items:
+            return self._items.pop() if self.use_lifo else self._items.popleft()
+        if not block or not in_greenlet() or (timeout is not None and timeout <= 0):
+            raise Empty()
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append((loop, waiter))
+        expiry = loop.call_later(timeout, _expire, waiter) if timeout is not None else None
+        try:
+            return await_only(waiter)
+        except BaseException:
+            if (loop, waiter) in self._waiters:
+                self._waiters.remove((loop, waiter))
+            elif waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # cancelled after the connection was handed over
+                self.put(waiter.result())
+            raise
+        finally:
+            if expiry is not None:
+                expiry.cancel()
+
+
+def _expire(waiter):
+    if not waiter.done():
+        waiter.set_exception(Empty())
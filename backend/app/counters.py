@@ -0,0 +1,224 @@
+'''
+Row counts of the actor and movie tables, without a COUNT per request.
+
+Inserts and deletes of the ORM are tallied per session by the after_flush
+event and applied to the store when the transaction commits (bulk inserts,
+which bypass the unit of work, report theirs with add_pending). The store is
+in-process, or Redis to share the counts between processes.
+
+Writes the events don't see (other processes with the in-process store, raw
+SQL) make the counts drift, so each count is reconciled against the real
+COUNT every COUNTER_RECONCILE_INTERVAL seconds. Drift is logged and
+summarized by report() and on /metrics; `flask counters reconcile` checks
+the shared store.
+'''
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, func
+
+from app import db
+from app.metrics import metrics
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+COUNTED_TABLES = ('actor', 'movie')
+
+
+class MemoryStore(object):
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, table):
+        return self._values.get(table)
+
+    def set(self, table, value):
+        with self._lock:
+            self._values[table] = value
+
+    def add(self, table, delta):
+        "Unknown counts stay unknown, so the next read counts"
+        with self._lock:
+            if table in self._values:
+                self._values[table] += delta
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class RedisStore(object):
+
+    # INCRBY only if the count is known, atomically
+    ADD = "if redis.call('exists', KEYS[1]) == 1 then return redis.call('incrby', KEYS[1], ARGV[1]) end"
+
+    def __init__(self, url, prefix='casting:count:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._add = self.client.register_script(self.ADD)
+
+    def get(self, table):
+        value = self.client.get(self.prefix + table)
+        return int(value) if value is not None else None
+
+    def set(self, table, value):
+        self.client.set(self.prefix + table, value)
+
+    def add(self, table, delta):
+        self._add(keys=[self.prefix + table], args=[delta])
+
+    def clear(self):
+        self.client.delete(*(self.prefix + table for table in COUNTED_TABLES))
+
+
+def get_store(name, redis_url=None):
+    "Store for COUNTER_BACKEND: 'memory' or 'redis' (COUNTER_REDIS_URL)"
+    if name == 'memory':
+        return MemoryStore()
+    if name == 'redis':
+        if redis is None or not redis_url:
+            raise RuntimeError('counter backend redis needs the redis package and COUNTER_REDIS_URL')
+        return RedisStore(redis_url)
+    raise RuntimeError(f'counter backend {name!r} is not available')
+
+
+class TableCounters(object):
+
+    def __init__(self, reconcile_interval=300):
+        self.store = MemoryStore()
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._reconciled_at = {}
+        self.reset_stats()
+
+    def init_app(self, app):
+        self.reconcile_interval = app.config.get('COUNTER_RECONCILE_INTERVAL', self.reconcile_interval)
+        self.store = get_store(app.config.get('COUNTER_BACKEND', 'memory'), app.config.get('COUNTER_REDIS_URL'))
+        self.store.clear()
+        self._reconciled_at.clear()
+        self.listen(db.session)
+        app.cli.add_command(counters_cli)
+        metrics.register('counters', self.samples)
+        app.extensions['counters'] = self
+
+    def reset_stats(self):
+        self.hits = 0
+        self.reconciliations = 0
+        self._drift = {table: {'last': None, 'max_abs': 0, 'total_abs': 0, 'samples': 0}
+                       for table in COUNTED_TABLES}
+
+    def listen(self, session):
+        if event.contains(session, 'after_flush', self._flushed):
+            return
+        event.listen(session, 'after_flush', self._flushed)
+        event.listen(session, 'after_commit', self._committed)
+        event.listen(session, 'after_transaction_end', self._transaction_ended)
+
+    @staticmethod
+    def add_pending(session, table, delta):
+        "Count rows written outside the unit of work; applied when `session` commits"
+        if table in COUNTED_TABLES:
+            session.info.setdefault('counter_deltas', Counter())[table] += delta
+
+    def _flushed(self, session, flush_context):
+        for objects, sign in ((session.new, 1), (session.deleted, -1)):
+            for obj in objects:
+                self.add_pending(session, getattr(obj, '__tablename__', None), sign)
+
+    def _committed(self, session):
+        deltas = session.info.pop('counter_deltas', None)
+        for table, delta in (deltas or {}).items():
+            if delta:
+                self.store.add(table, delta)
+
+    def _transaction_ended(self, session, transaction):
+        # rolled back or closed without commit
+        if transaction.parent is None:
+            session.info.pop('counter_deltas', None)
+
+    def total(self, model):
+        "Row count of `model`'s table; a real COUNT when unknown or due for reconciliation"
+        table = model.__tablename__
+        value = self.store.get(table)
+        if value is None or time.time() - self._reconciled_at.get(table, 0) >= self.reconcile_interval:
+            return self.reconcile(model, value)
+        self.hits += 1
+        return value
+
+    def reconcile(self, model, cached=None):
+        "Replace the count of `model`'s table by its COUNT, recording the drift of `cached`"
+        table = model.__tablename__
+        actual = db.session.query(func.count(model.id)).scalar()
+        self.store.set(table, actual)
+        with self._lock:
+            self._reconciled_at[table] = time.time()
+            self.reconciliations += 1
+            if cached is not None:
+                drift = self._drift[table]
+                drift['last'] = cached - actual
+                drift['max_abs'] = max(drift['max_abs'], abs(cached - actual))
+                drift['total_abs'] += abs(cached - actual)
+                drift['samples'] += 1
+        if cached is not None and cached != actual:
+            current_app.logger.warning('%s count drifted by %d (cached %d, actual %d)',
+                                       table, cached - actual, cached, actual)
+        return actual
+
+    def report(self):
+        "Per table: current count, and drift (cached - actual) seen by the reconciliations"
+        now = time.time()
+        tables = {}
+        for table in COUNTED_TABLES:
+            drift = self._drift[table]
+            reconciled_at = self._reconciled_at.get(table)
+            tables[table] = {
+                'count': self.store.get(table),
+                'last_drift': drift['last'],
+                'max_abs_drift': drift['max_abs'],
+                'mean_abs_drift': drift['total_abs'] / drift['samples'] if drift['samples'] else 0.0,
+                'drift_samples': drift['samples'],
+                'seconds_since_reconcile': now - reconciled_at if reconciled_at else None,
+            }
+        return {'hits': self.hits, 'reconciliations': self.reconciliations, 'tables': tables}
+
+    def samples(self):
+        "Drift of report() as metrics samples (without the counts, which may be shared), see app.metrics"
+        samples = [('table_count_hits_total', (), self.hits),
+                   ('table_count_reconciliations_total', (), self.reconciliations)]
+        with self._lock:
+            for table in COUNTED_TABLES:
+                drift = self._drift[table]
+                if not drift['samples']:
+                    continue
+                labels = (('table', table),)
+                samples.extend([
+                    ('table_count_last_drift', labels, drift['last']),
+                    ('table_count_max_abs_drift', labels, drift['max_abs']),
+                    ('table_count_mean_abs_drift', labels, drift['total_abs'] / drift['samples']),
+                ])
+        return samples
+
+
+counters = TableCounters()
+
+counters_cli = AppGroup('counters', help='Cached row counts of the actor and movie tables.')
+
+
+@counters_cli.command('reconcile')
+def reconcile_command():
+    "Compare the cached counts with COUNT and correct them"
+    from app.models import Actor, Movie
+    for model in (Actor, Movie):
+        cached = counters.store.get(model.__tablename__)
+        actual = counters.reconcile(model, cached)
+        click.echo('{:<6} cached {}  actual {}'.format(model.__tablename__, cached, actual))
+
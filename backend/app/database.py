@@ -0,0 +1,339 @@
+'''
+Engine options built from the DB_* settings, connection pool metrics, and
+routing of read-only requests to replicas.
+
+Pools are per process, so DB_POOL_SIZE + DB_MAX_OVERFLOW is the connection
+budget of one gunicorn worker. With DB_PGBOUNCER the app doesn't pool at all
+and leaves that to PgBouncer (in transaction mode). With DB_ASYNC (the async
+entry point, app.asgi) the drivers of app.async_db wait for the database on
+the event loop, and so do requests waiting for a pooled connection.
+'''
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.expression import SelectBase
+
+from app import async_db
+from app.concurrency import AsyncQueue, Lock
+from app.metrics import metrics
+
+
+class PoolStats(object):
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+class TimedQueuePool(QueuePool):
+    "QueuePool that records how long checkouts wait for a connection"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        # engine.dispose() replaces the pool; the counters carry over
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class AsyncFirstConnect(object):
+    '''
+    Pool mixin for DB_ASYNC: the first connection of the pool is made alone.
+    SQLAlchemy sets up the dialect on it under a thread lock, which the other
+    requests of the event loop's thread would block on.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._first_connect = Lock()
+        self._connected = False
+
+    def _create_connection(self):
+        if self._connected:
+            return super()._create_connection()
+        with self._first_connect:
+            connection = super()._create_connection()
+            self._connected = True
+            return connection
+
+
+class AsyncQueuePool(AsyncFirstConnect, TimedQueuePool):
+    "TimedQueuePool whose checkouts wait for a connection on the event loop (DB_ASYNC)"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = AsyncQueue(self._pool.maxsize, self._pool.use_lifo)
+
+
+class AsyncNullPool(AsyncFirstConnect, NullPool):
+    "NullPool for DB_ASYNC with DB_PGBOUNCER"
+
+
+def engine_options(config):
+    "SQLALCHEMY_ENGINE_OPTIONS for the database and DB_* settings of `config`"
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    # the dialect's name, so Heroku's postgres:// URLs are postgresql too
+    backend = url.get_dialect().name
+    if backend == 'sqlite':
+        if not config.get('DB_ASYNC'):
+            # SQLAlchemy picks the pool for SQLite, it can't be sized
+            return {}
+        if url.database in (None, '', ':memory:'):
+            # Flask-SQLAlchemy shares one connection of an in-memory database between all requests
+            raise RuntimeError('DB_ASYNC needs a SQLite database file')
+        return {
+            'module': async_db.aiosqlite_dbapi(),
+            'poolclass': AsyncQueuePool,
+            'pool_size': config.get('DB_POOL_SIZE', 5),
+            'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+            'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        }
+
+    if config.get('DB_PGBOUNCER'):
+        # PgBouncer owns the pool; connection startup options aren't passed
+        # through by it, so set statement_timeout on the database role instead
+        return {'poolclass': AsyncNullPool if config.get('DB_ASYNC') else NullPool}
+
+    options = {
+        'poolclass': AsyncQueuePool if config.get('DB_ASYNC') else TimedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+    statement_timeout = config.get('DB_STATEMENT_TIMEOUT', 0)
+    if statement_timeout and backend == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+def init_app(app):
+    "Call before db.init_app; explicit SQLALCHEMY_ENGINE_OPTIONS take precedence"
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    metrics.register('db_pool', lambda: pool_samples(app))
+
+
+def pool_stats(engine):
+    "Pool state and checkout metrics of this process"
+    pool = engine.pool
+    stats = {'pid': os.getpid(), 'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    timed = getattr(pool, 'stats', None)
+    if timed is not None:
+        stats.update({
+            'checkouts': timed.checkouts,
+            'checkout_timeouts': timed.timeouts,
+            'checkout_wait_seconds': timed.wait_seconds,
+            'checkout_max_wait_seconds': timed.max_wait_seconds,
+        })
+    return stats
+
+
+## pool_stats key -> metric, see app.metrics
+POOL_METRICS = {
+    'size': 'db_pool_size',
+    'checked_out': 'db_pool_checked_out',
+    'overflow': 'db_pool_overflow',
+    'checkouts': 'db_pool_checkouts_total',
+    'checkout_timeouts': 'db_pool_checkout_timeouts_total',
+    'checkout_wait_seconds': 'db_pool_checkout_wait_seconds_total',
+    'checkout_max_wait_seconds': 'db_pool_checkout_max_wait_seconds',
+}
+
+
+def pool_samples(app):
+    "Metrics of the pools of the primary and the replicas, by bind"
+    db = app.extensions['sqlalchemy'].db
+    binds = [None] + sorted(app.config.get('SQLALCHEMY_BINDS') or {})
+    samples = []
+    for bind in binds:
+        stats = pool_stats(db.get_engine(app, bind=bind))
+        labels = (('bind', bind or 'primary'),)
+        samples.extend((name, labels, stats[key]) for key, name in POOL_METRICS.items() if key in stats)
+    return samples
+
+
+## Read replicas: the SQLALCHEMY_BINDS named replica_*, used by handlers decorated with replica_reads
+
+class ReplicaRouter(object):
+    '''
+    Picks the replica engine of a read: round_robin, or least_latency (the
+    lowest moving average of statement times). A replica that can't be
+    connected to is skipped, and probed again after REPLICA_RETRY_INTERVAL
+    seconds; without a healthy replica, reads go to the primary.
+    '''
+
+    def __init__(self, selection='round_robin', retry_interval=30):
+        self.engines = []
+        self.selection = selection
+        self.retry_interval = retry_interval
+        self._turn = itertools.count()
+        self._latency = {}
+        self._health = {}
+
+    def init_app(self, app):
+        self.selection = app.config.get('REPLICA_SELECTION', self.selection)
+        if self.selection not in ('round_robin', 'least_latency'):
+            raise RuntimeError(f'replica selection {self.selection!r} is not available')
+        self.retry_interval = app.config.get('REPLICA_RETRY_INTERVAL', self.retry_interval)
+        db = app.extensions['sqlalchemy'].db
+        keys = sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith('replica'))
+        self.engines = [db.get_engine(app, bind=key) for key in keys]
+        self._turn = itertools.count()
+        self._latency.clear()
+        self._health.clear()
+        for engine in self.engines:
+            self.listen(engine)
+        app.extensions['replica_router'] = self
+
+    def listen(self, engine):
+        if event.contains(engine, 'before_cursor_execute', self._started):
+            return
+        event.listen(engine, 'before_cursor_execute', self._started)
+        event.listen(engine, 'after_cursor_execute', self._finished)
+        event.listen(engine, 'handle_error', self._failed)
+
+    def _started(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['replica_statement_started'] = time.perf_counter()
+
+    def _finished(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('replica_statement_started', None)
+        if started is not None:
+            seconds = time.perf_counter() - started
+            previous = self._latency.get(conn.engine)
+            self._latency[conn.engine] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def _failed(self, context):
+        if context.is_disconnect or context.connection is None:
+            self._health[context.engine] = (False, time.time())
+
+    def probe(self, engine):
+        try:
+            engine.connect().close()
+            healthy = True
+        except Exception:
+            healthy = False
+        self._health[engine] = (healthy, time.time())
+        return healthy
+
+    def healthy(self, engine):
+        state = self._health.get(engine)
+        if state is None or (not state[0] and time.time() - state[1] >= self.retry_interval):
+            return self.probe(engine)
+        return state[0]
+
+    def choose(self):
+        "A healthy replica engine, or None"
+        if not self.engines:
+            return None
+        if self.selection == 'least_latency':
+            candidates = sorted(self.engines, key=lambda engine: self._latency.get(engine, 0.0))
+        else:
+            start = next(self._turn) % len(self.engines)
+            candidates = self.engines[start:] + self.engines[:start]
+        for engine in candidates:
+            if self.healthy(engine):
+                return engine
+        return None
+
+
+replica_router = ReplicaRouter()
+
+
+def replica_reads(f):
+    '''
+    Mark a route handler as read-only: its SELECTs go to one replica, picked
+    for the request. Once the request writes, the rest of it reads from the
+    primary.
+    '''
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.replica_reads = True
+        g.replica = None
+        g.wrote_primary = False
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.replica_reads = False
+    return wrapper
+
+
+@contextmanager
+def primary_reads():
+    '''
+    Within the block, the reads of a replica_reads handler go to the primary:
+    for what outlives the request, like cache entries stored under the
+    current table versions, which a lagging replica could predate.
+    '''
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('primary_reads', False)
+    g.primary_reads = True
+    try:
+        yield
+    finally:
+        g.primary_reads = previous
+
+
+class RoutingSession(SignallingSession):
+    "Sends the SELECTs of replica_reads handlers to a replica, everything else to the primary"
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context() and g.get('replica_reads') and not g.get('primary_reads'):
+            if self._flushing or (clause is not None and not isinstance(clause, SelectBase)):
+                g.wrote_primary = True
+            elif not g.wrote_primary:
+                if g.replica is None:
+                    # False: no healthy replica, this request reads from the primary
+                    g.replica = replica_router.choose() or False
+                if g.replica:
+                    return g.replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
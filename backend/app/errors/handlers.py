@@ -28,6 +28,22 @@ def forbidden(error):
         'description': "Unauthenticated. Identity not verified"
     }), 401
 
+@bp.app_errorhandler(409)
+def conflict(error):
+    return jsonify({
+        'success': False,
+        'status': 409,
+        'description': "Conflict with the current state of the resource"
+    }), 409
+
+@bp.app_errorhandler(412)
+def precondition_failed(error):
+    return jsonify({
+        'success': False,
+        'status': 412,
+        'description': "Precondition Failed. The resource has changed"
+    }), 412
+
 @bp.app_errorhandler(422)
 def unprocessable(error):
     return jsonify({
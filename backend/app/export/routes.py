@@ -0,0 +1,105 @@
+import csv
+import io
+from flask import Response, abort, current_app, request, stream_with_context
+
+from app.export import bp
+from app.models import db, Actor, Movie
+from app.helpers import string_from_date
+from app.auth.auth import requires_auth
+from app.serialization import dumps
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+# (field, column, conversion to a JSON/CSV value) of the exported tables
+ACTOR_FIELDS = (
+    ('id', Actor.id, None),
+    ('name', Actor.name, None),
+    ('birthdate', Actor.birthdate, string_from_date),
+    ('gender', Actor.gender, lambda gender: gender.name),
+)
+
+MOVIE_FIELDS = (
+    ('id', Movie.id, None),
+    ('title', Movie.title, None),
+    ('release_date', Movie.release_date, string_from_date),
+)
+
+
+def export_rows(query, fields):
+    '''
+    Rows of `query` as dicts of plain values. yield_per streams them from a
+    server-side cursor, batch by batch, so memory use doesn't depend on the
+    size of the table.
+    '''
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    names = [name for name, _, _ in fields]
+    conversions = [(i, convert) for i, (_, _, convert) in enumerate(fields) if convert]
+    for row in query.yield_per(batch_size):
+        values = list(row)
+        for i, convert in conversions:
+            values[i] = convert(values[i])
+        yield dict(zip(names, values))
+
+
+def ndjson_lines(rows, names):
+    for row in rows:
+        yield dumps(row).decode('utf-8')
+
+
+def csv_lines(rows, names):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for row in rows:
+        writer.writerow([row[name] for name in names])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def batched(lines, size):
+    "Join lines into chunks, so the server doesn't write (and flush) every line on its own"
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def export(name, fields, order_by):
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        abort(422)
+
+    query = db.session.query(*[column for _, column, _ in fields]).order_by(order_by)
+    names = [field for field, _, _ in fields]
+    lines = ndjson_lines if export_format == 'ndjson' else csv_lines
+    batch_size = current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+    body = batched(lines(export_rows(query, fields), names), batch_size)
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': 'attachment; filename={}.{}'.format(name, export_format)}
+    )
+
+
+## Stream all actors as NDJSON (default) or CSV: ?format=ndjson|csv
+@bp.route('/export/actors')
+@requires_auth('get:actors')
+def export_actors():
+    return export('actors', ACTOR_FIELDS, Actor.id)
+
+
+## Stream all movies as NDJSON (default) or CSV: ?format=ndjson|csv
+@bp.route('/export/movies')
+@requires_auth('get:movies')
+def export_movies():
+    return export('movies', MOVIE_FIELDS, Movie.id)
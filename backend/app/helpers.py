@@ -7,3 +7,15 @@ def date_from_string(date_string):
 def string_from_date(date):
     DATE_FORMAT = '%Y-%m-%d'
     return date.strftime(DATE_FORMAT)
+
+def supports_returning(dialect):
+    "INSERT/UPDATE ... RETURNING is only compiled for Postgres by our SQLAlchemy version"
+    return dialect.name == 'postgresql'
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+def http_date_from_date(date):
+    "The date as Flask's jsonify renders it, e.g. 'Fri, 30 Dec 2005 00:00:00 GMT'"
+    return '%s, %02d %s %04d 00:00:00 GMT' % (
+        WEEKDAYS[date.weekday()], date.day, MONTHS[date.month - 1], date.year)
@@ -0,0 +1,164 @@
+from flask import current_app
+
+from app.models import db, Actor, Movie, MovieCast, Gender
+from app.helpers import date_from_string, supports_returning
+from app.counters import counters
+
+
+class ItemError(Exception):
+    "A bulk item that can't be inserted; the message is reported back per item"
+
+
+## Validation: item of the request body -> row mapping, or ItemError
+
+def required_string(item, key):
+    value = item.get(key)
+    if not isinstance(value, str) or not value.strip():
+        raise ItemError(f'{key} is required')
+    return value
+
+
+def required_date(item, key):
+    try:
+        return date_from_string(item[key]).date()
+    except (KeyError, TypeError, ValueError):
+        raise ItemError(f'{key} must be a date formatted YYYY-MM-DD')
+
+
+def required_id(item, key):
+    value = item.get(key)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ItemError(f'{key} must be an integer')
+    return value
+
+
+def actor_mapping(item):
+    mapping = {
+        'name': required_string(item, 'name'),
+        'birthdate': required_date(item, 'birthdate'),
+    }
+    gender = item.get('gender')
+    if gender not in Gender.__members__:
+        raise ItemError('gender must be one of ' + ', '.join(Gender.__members__))
+    mapping['gender'] = Gender[gender]
+    return mapping
+
+
+def movie_mapping(item):
+    return {
+        'title': required_string(item, 'title'),
+        'release_date': required_date(item, 'release_date'),
+    }
+
+
+def contract_mapping(item):
+    return {
+        'actor_id': required_id(item, 'actor_id'),
+        'movie_id': required_id(item, 'movie_id'),
+    }
+
+
+def check_contracts(mappings):
+    '''
+    Set-based checks of a chunk of contracts: one query each for the existing
+    actors, movies and bookings of the chunk. Returns {position: error}.
+    '''
+    actor_ids = {m['actor_id'] for m in mappings.values()}
+    movie_ids = {m['movie_id'] for m in mappings.values()}
+    actors = {row.id for row in db.session.query(Actor.id).filter(Actor.id.in_(actor_ids))}
+    movies = {row.id for row in db.session.query(Movie.id).filter(Movie.id.in_(movie_ids))}
+    booked = {
+        (row.actor_id, row.movie_id)
+        for row in db.session.query(MovieCast.actor_id, MovieCast.movie_id)
+        .filter(MovieCast.actor_id.in_(actor_ids), MovieCast.movie_id.in_(movie_ids))
+    }
+
+    errors = {}
+    for position, mapping in mappings.items():
+        pair = (mapping['actor_id'], mapping['movie_id'])
+        if mapping['actor_id'] not in actors:
+            errors[position] = 'actor not found'
+        elif mapping['movie_id'] not in movies:
+            errors[position] = 'movie not found'
+        elif pair in booked:
+            errors[position] = 'actor is already booked for this movie'
+        else:
+            booked.add(pair)
+    return errors
+
+
+def insert_rows(model, rows):
+    '''
+    Insert `rows` in one transaction and return their ids. Postgres gets a single
+    multi-row INSERT ... RETURNING; other databases fall back to
+    bulk_insert_mappings, which fetches each id.
+    '''
+    if supports_returning(db.engine.dialect):
+        table = model.__table__
+        result = db.session.execute(table.insert().values(rows).returning(table.c.id))
+        ids = [row.id for row in result]
+    else:
+        rows = [dict(row) for row in rows]
+        db.session.bulk_insert_mappings(model, rows, return_defaults=True)
+        ids = [row['id'] for row in rows]
+    # neither path goes through the unit of work the counters listen to
+    counters.add_pending(db.session, model.__tablename__, len(ids))
+    db.session.commit()
+    return ids
+
+
+def bulk_create(model, items, to_mapping, atomic=False, check=None):
+    '''
+    Validate and insert `items` in chunks of BULK_CHUNK_SIZE, one transaction
+    per chunk. With `atomic`, a chunk with any invalid item isn't inserted at
+    all; otherwise the valid items are. `check` runs set-based checks over
+    the valid mappings of a chunk.
+
+    Returns the inserted ({'index', 'id'}) and rejected ({'index', 'description'}) items.
+    '''
+    chunk_size = current_app.config.get('BULK_CHUNK_SIZE', 1000)
+    added, errors = [], []
+
+    for start in range(0, len(items), chunk_size):
+        mappings, chunk_errors = {}, {}
+        for index in range(start, min(start + chunk_size, len(items))):
+            item = items[index]
+            try:
+                if not isinstance(item, dict):
+                    raise ItemError('item must be an object')
+                mappings[index] = to_mapping(item)
+            except ItemError as e:
+                chunk_errors[index] = str(e)
+
+        if check and mappings:
+            chunk_errors.update(check(mappings))
+            for index in chunk_errors:
+                mappings.pop(index, None)
+
+        if atomic and chunk_errors:
+            for index in mappings:
+                chunk_errors[index] = 'not inserted, another item of its chunk is invalid'
+            mappings = {}
+
+        if mappings:
+            try:
+                ids = insert_rows(model, list(mappings.values()))
+                added.extend({'index': index, 'id': id} for index, id in zip(mappings, ids))
+            except Exception:
+                db.session.rollback()
+                if atomic:
+                    for index in mappings:
+                        chunk_errors[index] = 'not inserted, the chunk failed in the database'
+                else:
+                    # find the offending rows by inserting one at a time
+                    for index, mapping in mappings.items():
+                        try:
+                            added.append({'index': index, 'id': insert_rows(model, [mapping])[0]})
+                        except Exception:
+                            db.session.rollback()
+                            chunk_errors[index] = 'rejected by the database'
+
+        errors.extend({'index': index, 'description': description}
+                      for index, description in sorted(chunk_errors.items()))
+
+    return added, errors
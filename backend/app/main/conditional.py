@@ -0,0 +1,60 @@
+'''
+Validators of single actors and movies, for conditional requests. They are
+derived from the version column, so checking them doesn't need the
+resource to be formatted.
+'''
+import datetime
+from flask import abort, current_app, request
+
+from app.serialization import json_response
+
+
+def actor_etag(actor, today):
+    "An actor's age changes with the date, so the date is part of its ETag"
+    return 'actor-{}-{}-{}'.format(actor.id, actor.version, today.strftime('%Y%m%d'))
+
+
+def movie_etag(movie):
+    return 'movie-{}-{}'.format(movie.id, movie.version)
+
+
+def actor_last_modified(actor, today):
+    return max(actor.updated_at, datetime.datetime.combine(today, datetime.time()))
+
+
+def conditional_response(etag, last_modified, build):
+    '''
+    304 without a body if If-None-Match has `etag`, else the JSON of build().
+    Both carry ETag and Last-Modified.
+    '''
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = json_response(build())
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def if_match_versions(prefix, suffix=''):
+    '''
+    Versions named by the If-Match header, from its ETags of the form
+    prefix + version + suffix, so the UPDATE itself checks them. None if any
+    version does (no If-Match, or *); an empty list if none can.
+    '''
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = []
+    for etag in request.if_match.as_set():
+        version = etag[len(prefix):len(etag) - len(suffix)]
+        if etag.startswith(prefix) and etag.endswith(suffix) and version.isdigit():
+            versions.append(int(version))
+    return versions
+
+
+def actor_if_match_versions(actor_id, today):
+    return if_match_versions('actor-{}-'.format(actor_id), '-' + today.strftime('%Y%m%d'))
+
+
+def movie_if_match_versions(movie_id):
+    return if_match_versions('movie-{}-'.format(movie_id))
@@ -0,0 +1,126 @@
+from flask import request, abort
+from sqlalchemy import func
+
+from app.models import Actor, Movie, Gender, age_bounds
+from app.helpers import date_from_string
+
+## ?sort= keys -> (keyset, descending); the keyset ends with the primary key so it is unique
+ACTOR_SORTS = {
+    'name': ((Actor.name, Actor.id), False),
+    '-name': ((Actor.name, Actor.id), True),
+    'birthdate': ((Actor.birthdate, Actor.id), False),
+    '-birthdate': ((Actor.birthdate, Actor.id), True),
+    # the youngest are born last
+    'age': ((Actor.birthdate, Actor.id), True),
+    '-age': ((Actor.birthdate, Actor.id), False),
+}
+
+MOVIE_SORTS = {
+    'title': ((Movie.title, Movie.id), False),
+    '-title': ((Movie.title, Movie.id), True),
+    'release_date': ((Movie.release_date, Movie.id), False),
+    '-release_date': ((Movie.release_date, Movie.id), True),
+}
+
+ACTOR_FILTER_ARGS = ('name', 'name_contains', 'gender', 'birthdate_from', 'birthdate_to', 'min_age', 'max_age')
+MOVIE_FILTER_ARGS = ('title', 'title_contains', 'release_date_from', 'release_date_to')
+
+
+def filtered(names):
+    "Whether any of the filter query parameters `names` is given"
+    return any(name in request.args for name in names)
+
+
+def int_arg(name):
+    "Non-negative integer query parameter; None if not given, 422 if malformed"
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit():
+        abort(422)
+    return int(value)
+
+
+def date_arg(name):
+    "YYYY-MM-DD query parameter; None if not given, 422 if malformed"
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return date_from_string(value).date()
+    except ValueError:
+        abort(422)
+
+
+def like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def sort_args(sorts, default):
+    "Keyset and direction of ?sort=; 422 for an unknown key"
+    sort = request.args.get('sort', default)
+    if sort not in sorts:
+        abort(422)
+    return sorts[sort]
+
+
+def order_by_keyset(query, keyset, descending):
+    "Both directions run on the same index: ascending, or scanned backwards"
+    if descending:
+        return query.order_by(*(column.desc() for column in keyset))
+    return query.order_by(*keyset)
+
+
+def filter_text(query, column, prefix_arg, contains_arg):
+    '''
+    Case-insensitive name/title filters. On Postgres the prefix match is served
+    by a lower(column) text_pattern_ops index and the substring match by a
+    trigram index (migration c4d8e1f2a3b5).
+    '''
+    prefix = request.args.get(prefix_arg)
+    if prefix:
+        query = query.filter(func.lower(column).like(like_escape(prefix.lower()) + '%', escape='\\'))
+    contains = request.args.get(contains_arg)
+    if contains:
+        query = query.filter(column.ilike('%' + like_escape(contains) + '%', escape='\\'))
+    return query
+
+
+def filter_date_range(query, column, from_arg, to_arg):
+    "Inclusive date range; a plain range condition on the column's index"
+    earliest = date_arg(from_arg)
+    if earliest is not None:
+        query = query.filter(column >= earliest)
+    latest = date_arg(to_arg)
+    if latest is not None:
+        query = query.filter(column <= latest)
+    return query
+
+
+def filter_actors(actors, today):
+    '''
+    ?name= (prefix), ?name_contains=, ?gender=, ?birthdate_from=&birthdate_to=
+    and ?min_age=&max_age= (inclusive). Ages become a birthdate range, so every
+    filter is a condition the database can evaluate on an index.
+    '''
+    actors = filter_text(actors, Actor.name, 'name', 'name_contains')
+
+    gender = request.args.get('gender')
+    if gender is not None:
+        if gender not in Gender.__members__:
+            abort(422)
+        actors = actors.filter(Actor.gender == Gender[gender])
+
+    actors = filter_date_range(actors, Actor.birthdate, 'birthdate_from', 'birthdate_to')
+    earliest, latest = age_bounds(int_arg('min_age'), int_arg('max_age'), today)
+    if latest is not None:
+        actors = actors.filter(Actor.birthdate <= latest)
+    if earliest is not None:
+        actors = actors.filter(Actor.birthdate > earliest)
+    return actors
+
+
+def filter_movies(movies):
+    "?title= (prefix), ?title_contains= and ?release_date_from=&release_date_to= (inclusive)"
+    movies = filter_text(movies, Movie.title, 'title', 'title_contains')
+    return filter_date_range(movies, Movie.release_date, 'release_date_from', 'release_date_to')
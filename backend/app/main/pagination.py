@@ -0,0 +1,150 @@
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from flask import current_app, abort
+from sqlalchemy import tuple_, Date
+
+PAGINATE_LIMIT_DEFAULT = 7
+
+# (sql, params) -> (count, expires_at), least recently used first
+_count_cache = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+
+def page_args(request):
+    "page and limit query parameters; None if they can't address a page"
+    page = request.args.get('page', 1, type=int)
+    limit = request.args.get('limit', PAGINATE_LIMIT_DEFAULT, type=int)
+    if page < 1 or limit < 1:
+        return None, None
+    return page, limit
+
+
+def format_element(element):
+    return element.format()
+
+
+def paginate(request, query, format=format_element):
+    '''
+    Formatted elements of the requested page; LIMIT/OFFSET are applied by the
+    database, so only the rows of the page are loaded.
+    '''
+    page, limit = page_args(request)
+    if page is None:
+        return []
+    selection = query.limit(limit).offset((page - 1) * limit).all()
+    return [format(element) for element in selection]
+
+
+def encode_cursor(values):
+    "Opaque, url safe cursor for the sort key values of the last row of a page"
+    values = [value.isoformat() if isinstance(value, date) else value for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    "Sort key values of a cursor; raises ValueError if it wasn't made by encode_cursor"
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('invalid cursor')
+    return values
+
+
+def cursor_value(column, value):
+    "`value` of a cursor as a value of `column`; dates are parsed back. ValueError if it doesn't fit"
+    if isinstance(column.type, Date):
+        if not isinstance(value, str):
+            raise ValueError('invalid cursor')
+        return date.fromisoformat(value)
+    python_type = column.type.python_type
+    # bool is an int to isinstance, and no sort column is a bool
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        raise ValueError('invalid cursor')
+    return value
+
+
+def cursor_values(cursor, keyset):
+    "Decoded cursor, checked against the types of the `keyset` columns so it never reaches the database"
+    values = decode_cursor(cursor, len(keyset))
+    try:
+        return [cursor_value(column, value) for column, value in zip(keyset, values)]
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor')
+
+
+def paginate_keyset(request, query, keyset, format=format_element, descending=False):
+    '''
+    Keyset pagination: `keyset` are the columns `query` is ordered by (ending
+    with the primary key), all ascending or all `descending`. The page starts
+    right after the row encoded in the `cursor` query parameter, so its cost
+    doesn't depend on how deep it is.
+    Returns the formatted elements and the cursor of the next page (or None).
+    '''
+    _, limit = page_args(request)
+    if limit is None:
+        return [], None
+
+    cursor = request.args.get('cursor', '')
+    if cursor:
+        try:
+            values = cursor_values(cursor, keyset)
+        except ValueError:
+            abort(422)
+        if descending:
+            query = query.filter(tuple_(*keyset) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*keyset) > tuple_(*values))
+
+    # one extra row tells whether there is a next page
+    selection = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(selection) > limit:
+        selection = selection[:limit]
+        last = selection[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in keyset])
+    return [format(element) for element in selection], next_cursor
+
+
+def count(query):
+    '''
+    Total number of rows matched by `query`. With PAGINATE_COUNT_CACHE_TTL set,
+    the result of the COUNT is reused for that many seconds. Filters make the
+    keys unbounded, so only PAGINATE_COUNT_CACHE_SIZE results are kept.
+    '''
+    query = query.order_by(None)
+    ttl = current_app.config.get('PAGINATE_COUNT_CACHE_TTL', 0)
+    if not ttl:
+        return query.count()
+
+    statement = query.statement.compile()
+    key = (str(statement), tuple(sorted(statement.params.items())))
+    now = time.time()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+        if cached is not None:
+            if cached[1] > now:
+                _count_cache.move_to_end(key)
+                return cached[0]
+            del _count_cache[key]
+
+    total = query.count()
+    maxsize = current_app.config.get('PAGINATE_COUNT_CACHE_SIZE', 1024)
+    with _count_cache_lock:
+        _count_cache[key] = (total, now + ttl)
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > maxsize:
+            _count_cache.popitem(last=False)
+    return total
+
+
+def clear_count_cache():
+    with _count_cache_lock:
+        _count_cache.clear()
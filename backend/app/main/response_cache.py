@@ -0,0 +1,194 @@
+'''
+Read-through cache of list responses, keyed by endpoint, normalized query
+arguments and the versions of the tables the response is built from.
+
+Every committed write to a table bumps its version (see app.table_writes),
+which changes the keys of the responses that depend on it, so stale entries
+are never read again and just age out. Responses carry a strong ETag of their
+body; a matching If-None-Match gets a 304 without a body.
+
+Backends: an in-process LRU (the default), or Redis to share entries and
+versions between processes. With the in-process backend, writes of other
+processes are only seen when an entry expires (RESPONSE_CACHE_TTL).
+'''
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, request
+
+from app import db, table_writes
+from app.database import primary_reads
+from app.main.pagination import PAGINATE_LIMIT_DEFAULT
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+## Query arguments with a default are keyed as if given, so /actors and /actors?page=1 share an entry
+ARG_DEFAULTS = {'page': '1', 'limit': str(PAGINATE_LIMIT_DEFAULT)}
+
+
+class LRUBackend(object):
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def versions(self, tables):
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def bump(self, tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+
+class RedisBackend(object):
+
+    def __init__(self, url, prefix='casting:response:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b'\n')
+        return body, etag.decode('ascii')
+
+    def set(self, key, value, ttl):
+        body, etag = value
+        self.client.set(self.prefix + key, etag.encode('ascii') + b'\n' + body, ex=ttl)
+
+    def versions(self, tables):
+        values = self.client.mget([self.prefix + 'version:' + table for table in tables])
+        return tuple(int(value or 0) for value in values)
+
+    def bump(self, tables):
+        pipeline = self.client.pipeline()
+        for table in tables:
+            pipeline.incr(self.prefix + 'version:' + table)
+        pipeline.execute()
+
+
+def get_backend(name, maxsize=512, redis_url=None):
+    "Backend for RESPONSE_CACHE_BACKEND: 'memory', 'redis' (RESPONSE_CACHE_REDIS_URL) or 'none'"
+    if name == 'none':
+        return None
+    if name == 'memory':
+        return LRUBackend(maxsize)
+    if name == 'redis':
+        if redis is None or not redis_url:
+            raise RuntimeError('response cache backend redis needs the redis package and RESPONSE_CACHE_REDIS_URL')
+        return RedisBackend(redis_url)
+    raise RuntimeError(f'response cache backend {name!r} is not available')
+
+
+class ResponseCache(object):
+
+    def __init__(self, ttl=60):
+        self.backend = None
+        self.ttl = ttl
+        self.reset_stats()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.backend = get_backend(app.config.get('RESPONSE_CACHE_BACKEND', 'memory'),
+                                   app.config.get('RESPONSE_CACHE_SIZE', 512),
+                                   app.config.get('RESPONSE_CACHE_REDIS_URL'))
+        table_writes.listen(db.get_engine(app))
+        table_writes.subscribe(self.invalidate)
+        app.extensions['response_cache'] = self
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def invalidate(self, tables):
+        if self.backend is not None:
+            self.backend.bump(tables)
+
+    def key(self, tables):
+        args = dict(ARG_DEFAULTS)
+        args.update((name, ','.join(values)) for name, values in request.args.lists())
+        # ages in actor responses change with the date
+        raw = '{}?{}|{}|{}'.format(request.endpoint, urlencode(sorted(args.items())),
+                                   datetime.date.today().isoformat(),
+                                   ','.join(map(str, self.backend.versions(tables))))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def respond(self, body, etag, status=200):
+        if request.if_none_match.contains(etag):
+            self.not_modified += 1
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, status=status, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(tables):
+    '''
+    Serve a GET view from the response cache. `tables` are the names of the
+    tables the response is built from, or a function of the request that
+    returns them. Only 200 responses are cached. Goes below requires_auth, so
+    the token is checked on every request. The function runs on every request
+    too, before the lookup, so permissions that depend on the query
+    parameters are checked there: they aren't part of the key. On a miss the
+    view reads from the primary, even with replica_reads.
+    '''
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            names = tables() if callable(tables) else tables
+            if response_cache.backend is None:
+                return f(*args, **kwargs)
+            key = response_cache.key(names)
+            cached = response_cache.backend.get(key)
+            if cached is not None:
+                response_cache.hits += 1
+                return response_cache.respond(*cached)
+
+            response_cache.misses += 1
+            # the entry is stored under the versions read above, which a replica may not have caught up to
+            with primary_reads():
+                response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            response_cache.backend.set(key, (body, etag), response_cache.ttl)
+            return response_cache.respond(body, etag)
+        return wrapper
+    return decorator
@@ -1,20 +1,103 @@
-from flask import jsonify, abort, request
+from flask import jsonify, abort, request, current_app
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 import datetime
+from functools import partial
 
 from app.main import bp
-from app.models import db, Actor, Movie, MovieCast
+from app.models import (db, Actor, Movie, MovieCast, ACTOR_COLUMNS, MOVIE_COLUMNS, format_actor_row, format_movie_row,
+                        update_row, update_failure)
 from app.helpers import string_from_date, date_from_string
-from app.auth.auth import requires_auth
-PAGINATE_LIMIT_DEFAULT = 7
+from app.serialization import json_response
+from app.auth.auth import requires_auth, check_request_permissions, AllOf
+from app.database import replica_reads
+from app.main.pagination import paginate, paginate_keyset, count
+from app.main.filters import (filter_actors, filter_movies, filtered, sort_args, order_by_keyset,
+                              ACTOR_SORTS, MOVIE_SORTS, ACTOR_FILTER_ARGS, MOVIE_FILTER_ARGS)
+from app.counters import counters
+from app.main.response_cache import cached_response
+from app.main.conditional import (actor_etag, movie_etag, actor_last_modified, conditional_response,
+                                  actor_if_match_versions, movie_if_match_versions)
+from app.main.bulk import (bulk_create, actor_mapping, movie_mapping, contract_mapping, check_contracts,
+                           required_id)
+
+
+def bulk_items(key):
+    "JSON array of the bulk request body (or its `key` member); 422 if missing or too long"
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get(key)
+    if not isinstance(body, list) or not body:
+        abort(422)
+    if len(body) > current_app.config.get('BULK_MAX_ITEMS', 50000):
+        abort(422)
+    return body
+
+
+def bulk_atomic():
+    "?atomic=true: chunks are inserted all-or-nothing"
+    return request.args.get('atomic', 'false').lower() in ('1', 'true', 'yes')
+
+
+def bulk_response(key, added, errors):
+    return jsonify({
+        'success': not errors,
+        'added_' + key: added,
+        'total_added': len(added),
+        'errors': errors
+    })
+
+
+def includes():
+    "Related records to embed, from ?include=movies or ?include=cast"
+    return set(filter(None, request.args.get('include', '').split(',')))
+
 
-def paginate(request, selection):
-  offset = request.args.get('page', 1, type=int)
-  limit = request.args.get('limit', PAGINATE_LIMIT_DEFAULT, type=int)
-  start_index = (offset - 1) * limit
-  end_index = start_index + limit
+def actor_list_tables():
+    '''
+    Tables GET /actors is built from. ?include=movies also needs get:movies,
+    checked here because cached_response calls this before the cache lookup.
+    '''
+    if 'movies' in includes():
+        check_request_permissions('get:movies')
+        return ('actor', 'movie_cast', 'movie')
+    return ('actor',)
 
-  formatted_elements = [element.format() for element in selection[start_index:end_index]]
-  return formatted_elements
+
+def movie_list_tables():
+    "Tables GET /movies is built from; ?include=cast also needs get:actors (see actor_list_tables)"
+    if 'cast' in includes():
+        check_request_permissions('get:actors')
+        return ('movie', 'movie_cast', 'actor')
+    return ('movie',)
+
+
+def invalid_update(model, row_id, versions):
+    '''
+    Status of a PATCH without valid values, in the order the checks had when
+    the row was loaded first: 404 if it doesn't exist, 412 if If-Match names
+    another version (`versions`), else 422
+    '''
+    version = db.session.query(model.version).filter(model.id == row_id).scalar()
+    if version is None:
+        return 404
+    if versions is not None and version not in versions:
+        return 412
+    return 422
+
+
+def format_actor_with_movies(actor, today=None):
+    formatted_actor = actor.format(today)
+    movies = sorted((contract.mov for contract in actor.movies), key=lambda m: (m.release_date, m.id))
+    formatted_actor['movies'] = [movie.format() for movie in movies]
+    return formatted_actor
+
+
+def format_movie_with_cast(movie, today=None):
+    formatted_movie = movie.format()
+    cast = sorted((contract.ac for contract in movie.cast), key=lambda a: (a.name, a.id))
+    formatted_movie['cast'] = [actor.format(today) for actor in cast]
+    return formatted_movie
 
 
 @bp.route('/')
@@ -65,21 +148,95 @@ def add_actor():
         'added_actor': formatted_actor,
     })
 
+## Add many actors: JSON array of actor objects, ?atomic=true for all-or-nothing chunks
+@bp.route('/actors/bulk', methods=['POST'])
+@requires_auth('add:actors')
+def add_actors_bulk():
+    added, errors = bulk_create(Actor, bulk_items('actors'), actor_mapping, atomic=bulk_atomic())
+    return bulk_response('actors', added, errors)
+
 ## Get Actors paginated
+## ?page=&limit= (offset) or ?cursor=&limit= (keyset; start with an empty cursor)
+## ?include=movies embeds the movies of each actor (needs get:movies)
+## ?name= (prefix), ?name_contains=, ?gender=, ?birthdate_from=&birthdate_to=,
+## ?min_age=&max_age= filter (ranges are inclusive)
+## ?sort=name|birthdate|age, prefixed with - for descending order
 @bp.route('/actors')
 @requires_auth('get:actors')
+@cached_response(actor_list_tables)
+@replica_reads
 def get_all_actors():
-    actors = Actor.query.order_by(Actor.name).all()
-    formatted_actors_page = paginate(request, actors)
+    # ages of the whole page are computed against one date
+    today = datetime.date.today()
+    keyset, descending = sort_args(ACTOR_SORTS, 'name')
+    if 'movies' in includes():
+        # the movies of the whole page come with one extra query
+        actors = Actor.query.options(selectinload(Actor.movies).joinedload(MovieCast.mov))
+        format_actor = partial(format_actor_with_movies, today=today)
+    else:
+        # plain column tuples, no ORM objects
+        actors = db.session.query(*ACTOR_COLUMNS)
+        format_actor = partial(format_actor_row, today=today)
+    actors = order_by_keyset(filter_actors(actors, today), keyset, descending)
+
+    if 'cursor' in request.args:
+        formatted_actors_page, next_cursor = paginate_keyset(
+            request, actors, keyset, format_actor, descending)
+    else:
+        formatted_actors_page = paginate(request, actors, format_actor)
 
     # handle page number out of range
     if not formatted_actors_page:
         abort(404)
 
-    return jsonify({
+    response = {
         'success': True,
         'actors': formatted_actors_page,
-        'total_actors': len(actors)
+        'total_actors': count(actors) if filtered(ACTOR_FILTER_ARGS) else counters.total(Actor)
+    }
+    if 'cursor' in request.args:
+        response['next_cursor'] = next_cursor
+    return json_response(response)
+
+
+## Get one Actor; answers If-None-Match with 304
+@bp.route('/actors/<int:actor_id>')
+@requires_auth('get:actors')
+@replica_reads
+def get_actor(actor_id):
+    actor = db.session.query(*ACTOR_COLUMNS, Actor.version, Actor.updated_at) \
+        .filter(Actor.id == actor_id).first()
+    if actor is None:
+        abort(404)
+
+    today = datetime.date.today()
+    return conditional_response(actor_etag(actor, today), actor_last_modified(actor, today), lambda: {
+        'success': True,
+        'actor': format_actor_row(actor, today)
+    })
+
+
+## Get the movies an Actor is booked for, paginated
+@bp.route('/actors/<int:actor_id>/movies')
+@requires_auth(AllOf('get:actors', 'get:movies'))
+@cached_response(('actor', 'movie_cast', 'movie'))
+@replica_reads
+def get_actor_movies(actor_id):
+    actor = Actor.query.get_or_404(actor_id)
+    movies = db.session.query(*MOVIE_COLUMNS).join(MovieCast, MovieCast.movie_id == Movie.id) \
+        .filter(MovieCast.actor_id == actor_id) \
+        .order_by(Movie.release_date, Movie.id)
+    formatted_movies_page = paginate(request, movies, format_movie_row)
+
+    # handle page number out of range (an actor without movies has an empty first page)
+    if not formatted_movies_page and request.args.get('page', 1, type=int) != 1:
+        abort(404)
+
+    return json_response({
+        'success': True,
+        'actor': actor.format(),
+        'movies': formatted_movies_page,
+        'total_movies': count(movies)
     })
 
 
@@ -103,15 +260,16 @@ def delete_actor(actor_id):
     return jsonify({
         'success': True,
         'deleted_actor': formatted_actor,
-        'total_actors': Actor.query.count()
+        'total_actors': counters.total(Actor)
     })
 
 
-## Update Actor Info
+## Update Actor Info; with If-Match, only if the actor still has that ETag (else 412)
 @bp.route('/actors/<int:actor_id>', methods=['PATCH'])
 @requires_auth('patch:actors')
 def update_actor(actor_id):
-    actor = Actor.query.get_or_404(actor_id)
+    today = datetime.date.today()
+    versions = actor_if_match_versions(actor_id, today)
 
     # access request data
     try:
@@ -120,34 +278,41 @@ def update_actor(actor_id):
         birthdate_string = body.get('birthdate', None)
         gender = body.get('gender', None)
     except:
-        abort(422)
+        abort(invalid_update(Actor, actor_id, versions))
 
     # update values; if none is given abort 422
-    if any([name, birthdate_string, gender]):
-        if name:
-            actor.name = name
-        if gender:
-            actor.gender = gender
-        if birthdate_string:
-            actor.birthdate = date_from_string(birthdate_string)  
-    else:
-        abort(422)
-
+    values = {}
+    if name:
+        values['name'] = name
+    if gender:
+        values['gender'] = gender
+    if birthdate_string:
+        values['birthdate'] = date_from_string(birthdate_string)
+    if not values:
+        abort(invalid_update(Actor, actor_id, versions))
+
+    # one UPDATE ... RETURNING, which also checks If-Match
     try:
-        db.session.commit()
+        row = update_row(Actor, actor_id, values, versions)
+        if row is not None:
+            db.session.commit()
     except:
         db.session.rollback()
         abort(500)
-    finally:
-        db.session.close()
 
-    actor = Actor.query.get(actor_id)
-    formatted_actor = actor.format()
+    # 404 if the actor doesn't exist, 412 if it has another version than If-Match
+    if row is None:
+        status = update_failure(Actor, actor_id, versions)
+        db.session.close()
+        abort(status)
+    db.session.close()
 
-    return jsonify({
+    response = jsonify({
         'success': True,
-        'updated_actor': formatted_actor
+        'updated_actor': format_actor_row(row, today)
     })
+    response.set_etag(actor_etag(row, today))
+    return response
 
 ########## Movie Endpoints
 
@@ -181,21 +346,89 @@ def add_movie():
         'added_movie': formatted_movie,
     })
 
+## Add many movies: JSON array of movie objects, ?atomic=true for all-or-nothing chunks
+@bp.route('/movies/bulk', methods=['POST'])
+@requires_auth('add:movies')
+def add_movies_bulk():
+    added, errors = bulk_create(Movie, bulk_items('movies'), movie_mapping, atomic=bulk_atomic())
+    return bulk_response('movies', added, errors)
+
 ## Get Movies paginated
+## ?page=&limit= (offset) or ?cursor=&limit= (keyset; start with an empty cursor)
+## ?include=cast embeds the cast of each movie (needs get:actors)
+## ?title= (prefix), ?title_contains=, ?release_date_from=&release_date_to= filter (inclusive)
+## ?sort=title|release_date, prefixed with - for descending order
 @bp.route('/movies')
 @requires_auth('get:movies')
+@cached_response(movie_list_tables)
+@replica_reads
 def get_all_movies():
-    movies = Movie.query.order_by(Movie.title).all()
-    formatted_movies_page = paginate(request, movies)
+    keyset, descending = sort_args(MOVIE_SORTS, 'title')
+    if 'cast' in includes():
+        # the cast of the whole page comes with one extra query
+        movies = Movie.query.options(selectinload(Movie.cast).joinedload(MovieCast.ac))
+        format_movie = partial(format_movie_with_cast, today=datetime.date.today())
+    else:
+        # plain column tuples, no ORM objects
+        movies = db.session.query(*MOVIE_COLUMNS)
+        format_movie = format_movie_row
+    movies = order_by_keyset(filter_movies(movies), keyset, descending)
+
+    if 'cursor' in request.args:
+        formatted_movies_page, next_cursor = paginate_keyset(
+            request, movies, keyset, format_movie, descending)
+    else:
+        formatted_movies_page = paginate(request, movies, format_movie)
 
     # handle page number out of range
     if not formatted_movies_page:
       abort(404)
 
-    return jsonify({
+    response = {
         'success': True,
         'movies': formatted_movies_page,
-        'total_movies': len(movies)
+        'total_movies': count(movies) if filtered(MOVIE_FILTER_ARGS) else counters.total(Movie)
+    }
+    if 'cursor' in request.args:
+        response['next_cursor'] = next_cursor
+    return json_response(response)
+
+## Get one Movie; answers If-None-Match with 304
+@bp.route('/movies/<int:movie_id>')
+@requires_auth('get:movies')
+@replica_reads
+def get_movie(movie_id):
+    movie = db.session.query(*MOVIE_COLUMNS, Movie.version, Movie.updated_at) \
+        .filter(Movie.id == movie_id).first()
+    if movie is None:
+        abort(404)
+
+    return conditional_response(movie_etag(movie), movie.updated_at, lambda: {
+        'success': True,
+        'movie': format_movie_row(movie)
+    })
+
+## Get the cast of a Movie, paginated
+@bp.route('/movies/<int:movie_id>/cast')
+@requires_auth(AllOf('get:movies', 'get:actors'))
+@cached_response(('movie', 'movie_cast', 'actor'))
+@replica_reads
+def get_movie_cast(movie_id):
+    movie = Movie.query.get_or_404(movie_id)
+    cast = db.session.query(*ACTOR_COLUMNS).join(MovieCast, MovieCast.actor_id == Actor.id) \
+        .filter(MovieCast.movie_id == movie_id) \
+        .order_by(Actor.name, Actor.id)
+    formatted_cast_page = paginate(request, cast, partial(format_actor_row, today=datetime.date.today()))
+
+    # handle page number out of range (a movie without cast has an empty first page)
+    if not formatted_cast_page and request.args.get('page', 1, type=int) != 1:
+        abort(404)
+
+    return json_response({
+        'success': True,
+        'movie': movie.format(),
+        'cast': formatted_cast_page,
+        'total_cast': count(cast)
     })
 
 ## Delete Movie
@@ -217,14 +450,14 @@ def movie(movie_id):
     return jsonify({
         'success': True,
         'deleted_movie': formatted_movie,
-        'total_movies': Movie.query.count()
+        'total_movies': counters.total(Movie)
     })
 
-## Update Movie Info
+## Update Movie Info; with If-Match, only if the movie still has that ETag (else 412)
 @bp.route('/movies/<int:movie_id>', methods=['PATCH'])
 @requires_auth('patch:movies')
 def update_movie(movie_id):
-    movie = Movie.query.get_or_404(movie_id)
+    versions = movie_if_match_versions(movie_id)
 
     # access request data
     try:
@@ -232,31 +465,39 @@ def update_movie(movie_id):
         title = body.get('title', None)
         release_date_string = body.get('release_date', None)
     except:
-        abort(422)
+        abort(invalid_update(Movie, movie_id, versions))
 
     # update values; if none is specified abort 422
-    if any([title, release_date_string]):
-        if title:
-            movie.title = title
-        if release_date_string:
-            movie.release_date = date_from_string(release_date_string)
-    else:
-        abort(422)
-
-    formatted_movie = movie.format()
-
+    values = {}
+    if title:
+        values['title'] = title
+    if release_date_string:
+        values['release_date'] = date_from_string(release_date_string)
+    if not values:
+        abort(invalid_update(Movie, movie_id, versions))
+
+    # one UPDATE ... RETURNING, which also checks If-Match
     try:
-        db.session.commit()
+        row = update_row(Movie, movie_id, values, versions)
+        if row is not None:
+            db.session.commit()
     except:
         db.session.rollback()
         abort(500)
-    finally:
+
+    # 404 if the movie doesn't exist, 412 if it has another version than If-Match
+    if row is None:
+        status = update_failure(Movie, movie_id, versions)
         db.session.close()
+        abort(status)
+    db.session.close()
 
-    return jsonify({
+    response = jsonify({
         'success': True,
-        'updated_movie': formatted_movie
+        'updated_movie': format_movie_row(row)
     })
+    response.set_etag(movie_etag(row))
+    return response
 
 ########## Booking Endpoints
 
@@ -268,28 +509,45 @@ def add_contract():
     #access request data
     try:
         body = request.get_json()
-        movie_id = body['movie_id']
-        actor_id = body['actor_id']
+        movie_id = required_id(body, 'movie_id')
+        actor_id = required_id(body, 'actor_id')
     except:
         abort(422)
 
-    # 404, if movie or actor doesn't exist
-    movie = Movie.query.get_or_404(movie_id)
-    actor = Actor.query.get_or_404(actor_id)
-
-    # add contract
-    contract = MovieCast(actor_id=actor_id, movie_id=movie_id)
+    # one statement checks that movie and actor exist, and that the actor isn't booked yet
     try:
-        db.session.add(contract)
-        db.session.commit()
-        formatted_contract = contract.format()
+        contract_id = MovieCast.book(actor_id, movie_id)
+        if contract_id is not None:
+            db.session.commit()
+    except IntegrityError:
+        # actor or movie deleted concurrently
+        db.session.rollback()
+        contract_id = None
     except:
         db.session.rollback()
         abort(500)
-    finally:
+
+    # 404, if movie or actor doesn't exist; 409 if already booked
+    if contract_id is None:
+        status = MovieCast.booking_failure(actor_id, movie_id)
         db.session.close()
+        abort(status)
+    db.session.close()
 
     return jsonify({
         'success': True,
-        'added_contract': formatted_contract,
-    })
\ No newline at end of file
+        'added_contract': {
+            'id': contract_id,
+            'actor_id': actor_id,
+            'movie_id': movie_id
+        },
+    })
+
+
+## book many Actors: JSON array of contract objects, ?atomic=true for all-or-nothing chunks
+@bp.route('/contracts/bulk', methods=['POST'])
+@requires_auth('add:contracts')
+def add_contracts_bulk():
+    added, errors = bulk_create(MovieCast, bulk_items('contracts'), contract_mapping,
+                                atomic=bulk_atomic(), check=check_contracts)
+    return bulk_response('contracts', added, errors)
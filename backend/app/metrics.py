@@ -0,0 +1,327 @@
+'''
+Request metrics in the Prometheus text format, at /metrics.
+
+Per endpoint: a latency histogram, responses by status, histograms of the
+time a request spends in auth (requires_auth), database statements and
+JSON encoding, and of its statement count. Also the duration of JWKS
+fetches, and the state of each process (connection pool...), labelled with
+its pid: components register a collector of theirs, which is read on every
+flush and scrape.
+
+Each process keeps its metrics in memory. With METRICS_DIR set (gunicorn
+workers), it also writes them to a file of its own there, at most every
+METRICS_FLUSH_INTERVAL seconds, and /metrics sums the files of all the
+processes, so whichever worker answers the scrape reports the totals.
+Files of exited workers are kept, their counts are part of the totals; a
+new process with the pid of an old one continues from its file. Empty the
+directory when the whole server restarts.
+'''
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Latency of the requests.', LATENCY_BUCKETS),
+    'http_requests_total': ('counter', 'Responses by status.', None),
+    'http_request_phase_seconds': (
+        'histogram', 'Time of a request spent in auth, database statements and JSON encoding.', LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', 'Database statements per request.', QUERY_BUCKETS),
+    'jwks_fetch_duration_seconds': ('histogram', 'Duration of the JWKS fetches, by result.', LATENCY_BUCKETS),
+    # per process, from the collectors
+    'db_pool_size': ('gauge', 'Connections the pool keeps open.', None),
+    'db_pool_checked_out': ('gauge', 'Connections in use.', None),
+    'db_pool_overflow': ('gauge', 'Connections open beyond the pool size.', None),
+    'db_pool_checkouts_total': ('counter', 'Connection checkouts.', None),
+    'db_pool_checkout_timeouts_total': ('counter', 'Checkouts that timed out waiting for a connection.', None),
+    'db_pool_checkout_wait_seconds_total': ('counter', 'Time checkouts waited for a connection.', None),
+    'db_pool_checkout_max_wait_seconds': ('gauge', 'Longest wait of a checkout.', None),
+    'auth_token_cache_lookups_total': ('counter', 'Lookups of verified tokens, by result.', None),
+    'auth_token_cache_removals_total': ('counter', 'Cached tokens removed, by reason.', None),
+    'auth_token_cache_entries': ('gauge', 'Verified tokens in the cache.', None),
+    'auth_token_verifications_total': ('counter', 'Signature verifications of tokens.', None),
+    'auth_token_verify_seconds_total': ('counter', 'Time spent verifying token signatures.', None),
+    'auth_token_cache_saved_seconds': ('gauge', 'Estimated verification time saved by cache hits.', None),
+    'jwks_key_lookups_total': ('counter', 'Signing key lookups by kid, by result.', None),
+    'jwks_refreshes_total': ('counter', 'Key set refreshes, by result.', None),
+    'jwks_background_refreshes_total': ('counter', 'Refreshes started ahead of expiry.', None),
+    'jwks_stale_serves_total': ('counter', 'Keys served after their expiry.', None),
+    'jwks_keys': ('gauge', 'Signing keys in the cached key set.', None),
+    'jwks_expires_in_seconds': ('gauge', 'Time until the cached key set expires.', None),
+    'table_count_hits_total': ('counter', 'Table totals served by the counters.', None),
+    'table_count_reconciliations_total': ('counter', 'COUNTs run to check or load the counters.', None),
+    'table_count_last_drift': ('gauge', 'Cached minus actual count at the last reconciliation.', None),
+    'table_count_max_abs_drift': ('gauge', 'Largest absolute drift found by a reconciliation.', None),
+    'table_count_mean_abs_drift': ('gauge', 'Mean absolute drift found by the reconciliations.', None),
+}
+
+PHASES = ('auth', 'db', 'serialization')
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # one flush at a time, so the interval is kept across threads
+        self._flush_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._values = {}
+        self._flushed_at = 0.0
+        self._collectors = {}
+        self.enabled = True
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        if not self.enabled:
+            return
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', self.flush_interval)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.reset()
+
+        app.before_request(self._started)
+        app.after_request(self._finished)
+        app.json_encoder = TimedJSONEncoder
+        if not event.contains(Engine, 'before_cursor_execute', _before_statement):
+            event.listen(Engine, 'before_cursor_execute', _before_statement)
+            event.listen(Engine, 'after_cursor_execute', _after_statement)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        app.extensions['metrics'] = self
+
+    def reset(self):
+        "Start over, from this process's file if there is one"
+        with self._lock:
+            self._pid = os.getpid()
+            self._values = {}
+            self._flushed_at = 0.0
+            path = self._path()
+            if path and os.path.exists(path):
+                self._values = self._read(path)
+
+    def _path(self):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, 'metrics-{}.json'.format(self._pid))
+
+    ## Recording
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        "Histogram: cumulative bucket counts, then the sum and the count"
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def register(self, name, collector):
+        '''
+        Report the state of this process: `collector()` returns the
+        (metric name, labels, value) samples of its current state. Replaces
+        the collector registered under `name` before.
+        '''
+        self._collectors[name] = collector
+
+    def _collect_process(self):
+        "Run the collectors, storing their samples with this process's pid"
+        pid = ('pid', str(self._pid))
+        samples = []
+        for name, collector in list(self._collectors.items()):
+            try:
+                samples.extend(collector())
+            except Exception:
+                logger.warning('Metrics collector %s failed', name, exc_info=True)
+        with self._lock:
+            for metric, labels, value in samples:
+                self._values[(metric, (pid,) + labels)] = value
+
+    def _started(self):
+        if os.getpid() != self._pid:
+            # forked worker: the values are the parent's
+            self.reset()
+        g.metrics = dict.fromkeys(PHASES, 0.0)
+        g.metrics['queries'] = 0
+        g.metrics['started'] = time.perf_counter()
+
+    def _finished(self, response):
+        phases = g.pop('metrics', None)
+        if phases is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        self.observe('http_request_duration_seconds', (('endpoint', endpoint), ('method', request.method)),
+                     time.perf_counter() - phases['started'])
+        self.inc('http_requests_total', (('endpoint', endpoint), ('method', request.method),
+                                         ('status', str(response.status_code))))
+        for phase in PHASES:
+            self.observe('http_request_phase_seconds', (('endpoint', endpoint), ('phase', phase)), phases[phase])
+        self.observe('http_request_db_queries', (('endpoint', endpoint),), phases['queries'])
+        self.maybe_flush()
+        return response
+
+    ## Processes
+
+    def maybe_flush(self):
+        "Flush if the interval has passed; an I/O error is logged, never raised into the request"
+        if not self.directory or time.time() - self._flushed_at < self.flush_interval:
+            return
+        with self._flush_lock:
+            # another thread may have flushed while this one waited
+            if time.time() - self._flushed_at < self.flush_interval:
+                return
+            try:
+                self._write()
+            except OSError:
+                logger.warning('Unable to write the metrics to %s', self.directory, exc_info=True)
+
+    def flush(self):
+        with self._flush_lock:
+            self._write()
+
+    def _write(self):
+        "Write this process's values to its file (atomically, so a scrape never reads half of it)"
+        self._collect_process()
+        with self._lock:
+            values = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+            self._flushed_at = time.time()
+        path = self._path()
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, prefix='.metrics-', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'w') as metrics_file:
+                json.dump(values, metrics_file)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as metrics_file:
+                values = json.load(metrics_file)
+        except (OSError, ValueError):
+            return {}
+        return {(name, tuple(tuple(label) for label in labels)): value for name, labels, value in values}
+
+    def collect(self):
+        "Values of all processes (with METRICS_DIR), else of this one"
+        if not self.directory:
+            self._collect_process()
+            with self._lock:
+                return {key: list(value) if isinstance(value, list) else value
+                        for key, value in self._values.items()}
+        self.flush()
+        totals = {}
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            for key, value in self._read(os.path.join(self.directory, filename)).items():
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    totals[key] = [a + b for a, b in zip(total, value)]
+                else:
+                    totals[key] = total + value
+        return totals
+
+    ## Exposition
+
+    def render(self):
+        "Prometheus text format, version 0.0.4"
+        by_name = {}
+        for (name, labels), value in self.collect().items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_name.get(name, ())):
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {value[-1]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {value[-2]}')
+                lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return self.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in labels) + '}'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def add_phase(phase, seconds):
+    "Add `seconds` to the `phase` time of the current request"
+    if has_request_context():
+        phases = g.get('metrics')
+        if phases is not None:
+            phases[phase] += seconds
+
+
+## Database statements, of any engine
+
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('metrics_started')
+    if not stack:
+        return
+    started = stack.pop()
+    if has_request_context():
+        phases = g.get('metrics')
+        if phases is not None:
+            phases['db'] += time.perf_counter() - started
+            phases['queries'] += 1
+
+
+class TimedJSONEncoder(JSONEncoder):
+    "jsonify's encoder, timed as the serialization phase"
+
+    def encode(self, o):
+        started = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            add_phase('serialization', time.perf_counter() - started)
+
+
+metrics = Metrics()
@@ -1,38 +1,85 @@
 from enum import Enum
-from datetime import date
+from datetime import date, datetime
+from sqlalchemy import select, exists, event, DDL
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app import db
-from app.helpers import string_from_date
+from app.helpers import string_from_date, supports_returning
 
-def calculate_age(born):
-    today = date.today()
+def calculate_age(born, today=None):
+    "Pass `today` when formatting many rows, so it is looked up once"
+    if today is None:
+        today = date.today()
     return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
 
+def years_before(day, years):
+    "The same day `years` earlier (Feb 29 becomes Feb 28 in non-leap years)"
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+def age_bounds(min_age=None, max_age=None, today=None):
+    '''
+    Birthdate range of the actors aged between min_age and max_age (inclusive),
+    so an age filter is a range condition the birthdate index can serve.
+    Returns (earliest, latest) birthdate; earliest is exclusive, None is unbounded.
+    '''
+    if today is None:
+        today = date.today()
+    latest = years_before(today, min_age) if min_age is not None else None
+    earliest = years_before(today, max_age + 1) if max_age is not None else None
+    return earliest, latest
+
 class Gender(Enum):
     female = 1
     male = 2
     other = 3
 
 class Actor(db.Model):
+  # serve the orderings of the actor list, with or without gender, birthdate and age filters
+  __table_args__ = (
+    db.Index('ix_actor_name_id', 'name', 'id'),
+    db.Index('ix_actor_birthdate_id', 'birthdate', 'id'),
+    db.Index('ix_actor_gender_name_id', 'gender', 'name', 'id'),
+  )
+
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(), nullable=False)
   birthdate = db.Column(db.Date, nullable=False)
   gender = db.Column(db.Enum(Gender), nullable=False)
   movies = db.relationship('MovieCast', backref='ac')
+  # bumped by every ORM update, which only applies if the row still has the version it was read with
+  version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                         server_default=db.func.now())
 
-  def format(self):
+  __mapper_args__ = {'version_id_col': version}
+
+  def format(self, today=None):
     return {
       'id': self.id,
       'name': self.name,
-      'age': calculate_age(self.birthdate),
+      'age': calculate_age(self.birthdate, today),
       'gender': self.gender.name
     }
 
 
 class Movie(db.Model):
+  # serve the orderings of the movie list, with or without release date filters
+  __table_args__ = (
+    db.Index('ix_movie_title_id', 'title', 'id'),
+    db.Index('ix_movie_release_date_id', 'release_date', 'id'),
+  )
+
   id = db.Column(db.Integer, primary_key=True)
   title = db.Column(db.String(), nullable=False)
   release_date = db.Column(db.Date, nullable=False)
   cast = db.relationship('MovieCast', backref='mov')
+  version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                         server_default=db.func.now())
+
+  __mapper_args__ = {'version_id_col': version}
 
   def format(self):
     return {
@@ -42,8 +89,77 @@ class Movie(db.Model):
     }
 
 
+## Postgres only: prefix (text_pattern_ops) and substring (trigram) indexes for the
+## name and title filters. create_all gets them here, databases from migration c4d8e1f2a3b5
+event.listen(db.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+for table, column in ((Actor.__table__, 'name'), (Movie.__table__, 'title')):
+  event.listen(table, 'after_create', DDL(
+    f'CREATE INDEX ix_{table.name}_{column}_lower_pattern ON {table.name} (lower({column}) text_pattern_ops)'
+  ).execute_if(dialect='postgresql'))
+  event.listen(table, 'after_create', DDL(
+    f'CREATE INDEX ix_{table.name}_{column}_trgm ON {table.name} USING gin ({column} gin_trgm_ops)'
+  ).execute_if(dialect='postgresql'))
+
+
+## Columns for list queries that skip the ORM; format_*_row(row) gives the same dict as format()
+ACTOR_COLUMNS = (Actor.id, Actor.name, Actor.birthdate, Actor.gender)
+MOVIE_COLUMNS = (Movie.id, Movie.title, Movie.release_date)
+
+def format_actor_row(row, today=None):
+  return {
+    'id': row.id,
+    'name': row.name,
+    'age': calculate_age(row.birthdate, today),
+    'gender': row.gender.name
+  }
+
+def format_movie_row(row):
+  return {
+    'id': row.id,
+    'title': row.title,
+    'release_date': row.release_date
+  }
+
+def update_row(model, row_id, values, versions=None):
+  '''
+  Update the row `row_id` of an Actor or Movie with a single UPDATE ... RETURNING,
+  bumping its version (updated_at is set by the column's onupdate), and return
+  the updated row with all its columns. With `versions`, only a row still at one
+  of them is updated. Returns None if no row was updated, without telling
+  whether it doesn't exist or has another version. Without RETURNING (SQLite)
+  the row is selected after the UPDATE. Doesn't commit.
+  '''
+  table = model.__table__
+  if versions is not None and not versions:
+    return None
+  condition = table.c.id == row_id
+  if versions is not None:
+    condition &= table.c.version.in_(versions)
+  statement = table.update().where(condition).values(version=table.c.version + 1, **values)
+
+  if supports_returning(db.session.get_bind().dialect):
+    return db.session.execute(statement.returning(*table.c)).first()
+  if db.session.execute(statement).rowcount != 1:
+    return None
+  return db.session.execute(select(table.c).where(table.c.id == row_id)).first()
+
+def update_failure(model, row_id, versions):
+  "Why `update_row` updated nothing: 404 if the row doesn't exist, else 412 (another version than `versions`)"
+  if versions is None or not db.session.query(exists().where(model.id == row_id)).scalar():
+    return 404
+  return 412
+
+
 ## Junction Table for many-to-many relationship between Actors and Movies
 class MovieCast(db.Model):
+  # an actor is booked once per movie; the unique index also covers lookups by actor_id
+  __table_args__ = (
+    db.Index('uq_movie_cast_actor_id_movie_id', 'actor_id', 'movie_id', unique=True),
+    db.Index('ix_movie_cast_movie_id', 'movie_id'),
+  )
+
   id = db.Column(db.Integer, primary_key=True)
   actor_id = db.Column(db.Integer, db.ForeignKey('actor.id'), nullable=False)
   movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), nullable=False)
@@ -54,3 +170,37 @@ class MovieCast(db.Model):
       'actor_id': self.actor_id,
       'movie_id': self.movie_id
     }
+
+  @classmethod
+  def book(cls, actor_id, movie_id):
+    '''
+    Book an actor for a movie with a single INSERT ... SELECT, which only
+    inserts if both exist and (through the unique index) the actor isn't
+    booked for the movie yet. Returns the id of the new contract, or None if
+    nothing was inserted. Doesn't commit.
+    '''
+    table = cls.__table__
+    existing = select([Actor.id, Movie.id]).where(Actor.id == actor_id).where(Movie.id == movie_id)
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+      statement = pg_insert(table).from_select(['actor_id', 'movie_id'], existing) \
+        .on_conflict_do_nothing(index_elements=['actor_id', 'movie_id']) \
+        .returning(table.c.id)
+      return db.session.execute(statement).scalar()
+
+    statement = table.insert().from_select(['actor_id', 'movie_id'], existing) \
+      .prefix_with('OR IGNORE', dialect='sqlite')
+    result = db.session.execute(statement)
+    return result.lastrowid if result.rowcount == 1 else None
+
+  @classmethod
+  def booking_failure(cls, actor_id, movie_id):
+    "Why `book` inserted nothing: 404 if actor or movie don't exist, else 409 (already booked)"
+    actor_exists, movie_exists = db.session.query(
+      exists().where(Actor.id == actor_id),
+      exists().where(Movie.id == movie_id)
+    ).one()
+    if not (actor_exists and movie_exists):
+      return 404
+    return 409
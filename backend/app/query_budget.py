@@ -0,0 +1,103 @@
+'''
+Statement counting for tests: how many statements a block sends to the
+database, which of them are the same statement run again with other
+parameters (the N+1 pattern: a lazy load or a lookup inside a loop), and
+which SELECTs read a whole table (no WHERE, no LIMIT).
+
+    with QueryCounter() as queries:
+        client.get('/actors')
+    queries.count, queries.repeated(), queries.unbounded()
+
+    with query_budget(2):            # or @query_budget(2) on a function
+        client.get('/actors')
+'''
+import re
+from contextlib import ContextDecorator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# a parenthesized list of bind parameters, e.g. an expanded IN (?, ?, ?)
+PARAMETER_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))+\s*\)')
+WHITESPACE = re.compile(r'\s+')
+TABLE_SELECT = re.compile(r'^SELECT\b.*\bFROM\b', re.IGNORECASE | re.DOTALL)
+FILTERED = re.compile(r'\b(WHERE|LIMIT)\b', re.IGNORECASE)
+AGGREGATE_ONLY = re.compile(r'^SELECT\s+count\(', re.IGNORECASE)
+
+
+def normalize(statement):
+    "The statement's shape: whitespace collapsed, parameter lists of any length alike"
+    return PARAMETER_LIST.sub('(?)', WHITESPACE.sub(' ', statement).strip())
+
+
+class QueryCounter(object):
+    "Records the statements executed on `engine` (any engine by default) while active"
+
+    def __init__(self, engine=None):
+        self.target = engine if engine is not None else Engine
+        self.statements = []
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.target, 'before_cursor_execute', self._executed)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.target, 'before_cursor_execute', self._executed)
+        return False
+
+    def _executed(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters, executemany))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def repeated(self, times=2):
+        "{statement: runs} of the statements run at least `times` times with different parameters"
+        parameters = {}
+        for statement, params, executemany in self.statements:
+            if not executemany:
+                parameters.setdefault(normalize(statement), set()).add(repr(params))
+        return {statement: len(runs) for statement, runs in parameters.items() if len(runs) >= times}
+
+    def unbounded(self):
+        "SELECTs from a table without WHERE or LIMIT (counts aside): they read every row"
+        return [statement for statement, _, _ in self.statements
+                if TABLE_SELECT.match(statement.strip())
+                and not FILTERED.search(statement) and not AGGREGATE_ONLY.match(statement.strip())]
+
+    def report(self):
+        return '\n'.join('  {}. {}'.format(i, WHITESPACE.sub(' ', statement))
+                         for i, (statement, _, _) in enumerate(self.statements, 1))
+
+
+class query_budget(QueryCounter, ContextDecorator):
+    '''
+    Fails (AssertionError) if the block or decorated function runs more than
+    `max_queries` statements, repeats a statement with other parameters
+    (unless `allow_repeats`) or reads a whole table (unless `allow_unbounded`).
+    '''
+
+    def __init__(self, max_queries, engine=None, allow_repeats=False, allow_unbounded=False):
+        super().__init__(engine)
+        self.max_queries = max_queries
+        self.allow_repeats = allow_repeats
+        self.allow_unbounded = allow_unbounded
+
+    def __exit__(self, exc_type, *exc):
+        super().__exit__(exc_type, *exc)
+        if exc_type is not None:
+            return False
+        if self.count > self.max_queries:
+            raise AssertionError('{} statements, the budget is {}:\n{}'.format(
+                self.count, self.max_queries, self.report()))
+        repeated = self.repeated()
+        if repeated and not self.allow_repeats:
+            raise AssertionError('N+1: statements repeated with other parameters:\n' + '\n'.join(
+                '  {}x {}'.format(runs, statement) for statement, runs in repeated.items()))
+        unbounded = self.unbounded()
+        if unbounded and not self.allow_unbounded:
+            raise AssertionError('statements reading a whole table:\n' + '\n'.join(
+                '  ' + WHITESPACE.sub(' ', statement) for statement in unbounded))
+        return False
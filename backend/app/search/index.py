@@ -0,0 +1,171 @@
+'''
+Full-text search over actor names and movie titles.
+
+On Postgres each table has a `search_vector` tsvector column, kept up to date
+by a trigger and indexed with GIN (migration d5e9f3a4b6c7); matches are ranked
+with ts_rank. Other databases (the SQLite test config) get an in-process
+inverted index instead, rebuilt lazily after a committed write to its table
+(see app.table_writes).
+'''
+import heapq
+import re
+import threading
+from flask import current_app
+from sqlalchemy import event, DDL, func, literal_column
+
+from app import concurrency, db, table_writes
+from app.database import primary_reads
+from app.models import Actor, Movie
+
+## Searchable tables and their text column
+SEARCHABLE = {'actor': 'name', 'movie': 'title'}
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+## Postgres: create_all gets the column, trigger and index here, databases from the migration
+for table, column in ((Actor.__table__, 'name'), (Movie.__table__, 'title')):
+    for statement in (
+        f'ALTER TABLE {table.name} ADD COLUMN search_vector tsvector',
+        f'CREATE TRIGGER {table.name}_search_vector_update BEFORE INSERT OR UPDATE ON {table.name} '
+        f"FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.simple', {column})",
+        f'CREATE INDEX ix_{table.name}_search_vector ON {table.name} USING gin (search_vector)',
+    ):
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+class PostgresSearch(object):
+    "Matches through the GIN index on search_vector, best ts_rank first"
+
+    name = 'postgres'
+
+    def search(self, model, columns, text, limit):
+        query = func.plainto_tsquery('simple', text)
+        vector = literal_column(model.__tablename__ + '.search_vector')
+        rank = func.ts_rank(vector, query)
+        return db.session.query(*columns).filter(vector.op('@@')(query)) \
+            .order_by(rank.desc(), model.id).limit(limit).all()
+
+
+class InvertedIndex(object):
+    '''
+    term -> {id: occurrences} postings of each searchable table, built from
+    the database on the first search after the table changed. Every term of
+    the query must match; a row ranks higher the larger the share of its
+    terms that match, like ts_rank's length normalization.
+
+    Only the writes of this process invalidate the index.
+    '''
+
+    name = 'memory'
+
+    def __init__(self):
+        self._postings = {}
+        self._lengths = {}
+        self._stale = set(SEARCHABLE)
+        self._lock = threading.Lock()
+        # held while a table is rebuilt, so one request builds and the others wait for it
+        self._building = {table: concurrency.Lock() for table in SEARCHABLE}
+        self.builds = 0
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._stale = set(SEARCHABLE)
+
+    def invalidate(self, tables):
+        with self._lock:
+            self._stale.update(tables & SEARCHABLE.keys())
+
+    def build(self, model):
+        table = model.__tablename__
+        column = getattr(model, SEARCHABLE[table])
+        postings, lengths = {}, {}
+        # the index outlives the request, a lagging replica would keep it stale until the next write
+        with primary_reads():
+            for id, text in db.session.query(model.id, column).yield_per(1000):
+                terms = tokenize(text)
+                lengths[id] = len(terms)
+                for term in terms:
+                    counts = postings.setdefault(term, {})
+                    counts[id] = counts.get(id, 0) + 1
+        with self._lock:
+            self._postings[table] = postings
+            self._lengths[table] = lengths
+            self.builds += 1
+
+    def index(self, model):
+        '''
+        Postings and lengths of the table of `model`, rebuilt first if it
+        changed. A search never sees the table without postings, nor its
+        postings from before the change.
+        '''
+        table = model.__tablename__
+        with self._lock:
+            if table not in self._stale and table in self._postings:
+                return self._postings[table], self._lengths[table]
+
+        with self._building[table]:
+            with self._lock:
+                stale = table in self._stale or table not in self._postings
+                # a write during the build marks the table stale again
+                self._stale.discard(table)
+            if stale:
+                try:
+                    self.build(model)
+                except Exception:
+                    with self._lock:
+                        self._stale.add(table)
+                    raise
+            with self._lock:
+                return self._postings[table], self._lengths[table]
+
+    def search(self, model, columns, text, limit):
+        terms = set(tokenize(text))
+        postings, lengths = self.index(model)
+        matches = sorted((postings.get(term, {}) for term in terms), key=len)
+        if not matches or not matches[0]:
+            return []
+        if len(matches) == 1:
+            scored = ((-count / lengths[id], id) for id, count in matches[0].items())
+        else:
+            ids = matches[0].keys() & set.intersection(*(set(counts) for counts in matches[1:]))
+            scored = ((-sum(counts[id] for counts in matches) / lengths[id], id) for id in ids)
+        ranked = [id for _, id in heapq.nsmallest(limit, scored)]
+
+        rows = {row.id: row for row in db.session.query(*columns).filter(model.id.in_(ranked))}
+        return [rows[id] for id in ranked if id in rows]
+
+
+inverted_index = InvertedIndex()
+
+
+def get_backend(name, dialect):
+    "Backend for SEARCH_BACKEND: 'auto' (postgres on Postgres, else memory), 'postgres' or 'memory'"
+    if name == 'auto':
+        name = 'postgres' if dialect == 'postgresql' else 'memory'
+    if name == 'postgres':
+        return PostgresSearch()
+    if name == 'memory':
+        return inverted_index
+    raise RuntimeError(f'search backend {name!r} is not available')
+
+
+def init_app(app):
+    engine = db.get_engine(app)
+    backend = get_backend(app.config.get('SEARCH_BACKEND', 'auto'), engine.dialect.name)
+    if backend is inverted_index:
+        inverted_index.clear()
+        table_writes.listen(engine)
+        table_writes.subscribe(inverted_index.invalidate)
+    app.extensions['search'] = backend
+
+
+def search(model, columns, text, limit):
+    "Best `limit` rows (column tuples) of `model` matching every word of `text`"
+    return current_app.extensions['search'].search(model, columns, text, limit)
@@ -0,0 +1,35 @@
+import datetime
+from flask import abort, request, g
+
+from app.search import bp
+from app.search.index import search, tokenize
+from app.models import Actor, Movie, ACTOR_COLUMNS, MOVIE_COLUMNS, format_actor_row, format_movie_row
+from app.auth.auth import requires_auth, AnyOf
+from app.database import replica_reads
+from app.main.pagination import page_args
+from app.serialization import json_response
+
+
+## Search actor names and movie titles: ?q= (every word must match), ?limit= results per table
+## Only the tables the token may read are searched
+@bp.route('/search')
+@requires_auth(AnyOf('get:actors', 'get:movies'))
+@replica_reads
+def search_all():
+    text = request.args.get('q', '')
+    _, limit = page_args(request)
+    if not tokenize(text) or limit is None:
+        abort(422)
+
+    response = {
+        'success': True,
+        'query': text
+    }
+    if 'get:actors' in g.permissions:
+        today = datetime.date.today()
+        rows = search(Actor, ACTOR_COLUMNS, text, limit)
+        response['actors'] = [format_actor_row(row, today) for row in rows]
+    if 'get:movies' in g.permissions:
+        rows = search(Movie, MOVIE_COLUMNS, text, limit)
+        response['movies'] = [format_movie_row(row) for row in rows]
+    return json_response(response)
@@ -0,0 +1,75 @@
+'''
+JSON responses without Flask's jsonify: rows are formatted straight from
+column tuples (no ORM objects) and encoded by orjson when it is installed,
+else by the standard library. Both encoders produce JSON equivalent to
+jsonify's (sorted keys, compact separators, dates as HTTP dates, trailing
+newline). The standard library's is byte for byte jsonify's; orjson writes
+non-ASCII characters as UTF-8 where jsonify escapes them (\\u00e9).
+'''
+import datetime
+import json
+import time
+from flask import current_app
+
+from app.helpers import http_date_from_date
+from app.metrics import add_phase
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def default(value):
+    "Values neither encoder handles natively, the way Flask's JSONEncoder does"
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    if isinstance(value, datetime.date):
+        return http_date_from_date(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=default).encode('utf-8') + b'\n'
+
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_APPEND_NEWLINE
+
+    def orjson_dumps(obj):
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+else:
+    orjson_dumps = None
+
+
+BACKENDS = {
+    'stdlib': stdlib_dumps,
+    'orjson': orjson_dumps,
+}
+
+
+def get_dumps(name):
+    "Encoder for JSON_BACKEND: 'auto' (orjson if installed), 'orjson' or 'stdlib'"
+    if name == 'auto':
+        return orjson_dumps or stdlib_dumps
+    dumps = BACKENDS.get(name)
+    if dumps is None:
+        raise RuntimeError(f'JSON backend {name!r} is not available')
+    return dumps
+
+
+def init_app(app):
+    app.extensions['json_dumps'] = get_dumps(app.config.get('JSON_BACKEND', 'auto'))
+
+
+def dumps(obj):
+    started = time.perf_counter()
+    try:
+        return current_app.extensions['json_dumps'](obj)
+    finally:
+        add_phase('serialization', time.perf_counter() - started)
+
+
+def json_response(obj, status=200):
+    "Drop-in for jsonify(obj) on hot paths"
+    return current_app.response_class(dumps(obj), status=status, mimetype='application/json')
@@ -0,0 +1,42 @@
+'''
+Tables written to by each committed transaction, taken from the statements
+the engine executes, so ORM flushes, bulk inserts and Core statements are
+all seen. Subscribers are called with the set of table names after the
+commit; rolled back writes are dropped. Only writes of this process are seen.
+'''
+import re
+from sqlalchemy import event
+
+WRITE = re.compile(r'^\s*(?:INSERT(?: OR \w+)? INTO|UPDATE|DELETE FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+_subscribers = []
+
+
+def subscribe(callback):
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def listen(engine):
+    if event.contains(engine, 'after_cursor_execute', _written):
+        return
+    event.listen(engine, 'after_cursor_execute', _written)
+    event.listen(engine, 'commit', _committed)
+    event.listen(engine, 'rollback', _rolled_back)
+
+
+def _written(conn, cursor, statement, parameters, context, executemany):
+    match = WRITE.match(statement)
+    if match:
+        conn.info.setdefault('table_writes', set()).add(match.group(1).lower())
+
+
+def _committed(conn):
+    tables = conn.info.pop('table_writes', None)
+    if tables:
+        for callback in _subscribers:
+            callback(tables)
+
+
+def _rolled_back(conn):
+    conn.info.pop('table_writes', None)
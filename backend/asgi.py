@@ -0,0 +1,10 @@
+'''
+Async entry point: the routes of entrypoint.py on async database drivers,
+for uvicorn or gunicorn's uvicorn worker (see app.asgi):
+
+    uvicorn asgi:app --workers 4
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker -w 4
+'''
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
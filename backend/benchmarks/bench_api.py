@@ -0,0 +1,200 @@
+"""
+End-to-end benchmark of every route of app/main/routes.py, over HTTP against
+a gunicorn server. Tokens of the producer, director and assistant roles are
+signed with a local key, whose JWKS is served by a stub on localhost, so no
+Auth0 tenant is needed.
+
+    cd backend
+    python -m benchmarks.bench_api --actors 50000 --movies 10000 --concurrency 16 --json run.json
+    python -m benchmarks.bench_api --mode mixed --server gthread --compare run.json
+
+--mode each (default) loads one endpoint at a time, for --duration seconds
+each; --mode mixed sends all of them at once, reads ten times as often as
+writes. Reports req/s and p50/p95/p99 per endpoint; --compare prints the
+change against the JSON of an earlier run. DELETE requests use rows seeded
+for them (--deletable per table), and get 404s once those are used up.
+The database is dropped and reseeded.
+"""
+import argparse
+import itertools
+import json
+from datetime import date
+
+from app import db
+from app.models import Actor, Movie, Gender
+from benchmarks.common import bench_app, default_database_url, write_json
+from benchmarks.load import Request, Server, StubJWKS, free_port, mint_token, run_load, server_command, signing_key
+from benchmarks.seed import reset, seed, insert
+
+ASSISTANT = ['get:actors', 'get:movies']
+DIRECTOR = ASSISTANT + ['add:actors', 'delete:actors', 'patch:actors', 'patch:movies']
+PRODUCER = DIRECTOR + ['add:contracts', 'add:movies', 'delete:movies']
+ROLES = {'assistant': ASSISTANT, 'director': DIRECTOR, 'producer': PRODUCER}
+
+READ_WEIGHT = 10
+
+
+def seed_deletable(actors, movies, count):
+    "`count` more actors and movies, without contracts, for the DELETE requests"
+    insert(Actor.__table__, [{'name': f'Deletable {i}', 'birthdate': date(1990, 1, 1), 'gender': Gender.other}
+                             for i in range(count)])
+    insert(Movie.__table__, [{'title': f'Deletable {i}', 'release_date': date(2010, 1, 1)}
+                             for i in range(count)])
+    return itertools.count(actors + 1), itertools.count(movies + 1)
+
+
+def endpoints(tokens, actors, movies, deletable_actors, deletable_movies, bulk_size):
+    '''
+    (name, weight, request builder) of each route; a builder takes the
+    client's random generator and returns a Request with the token of the
+    least privileged role allowed to send it.
+    '''
+    def headers(role):
+        if role is None:
+            return {}
+        return {'Authorization': 'Bearer ' + tokens[role], 'Content-Type': 'application/json'}
+
+    def endpoint(name, role, method, path, body=None, weight=1):
+        def build(rng):
+            return Request(name, method, path(rng) if callable(path) else path, headers(role),
+                           body(rng) if callable(body) else body)
+        return name, weight, build
+
+    def actor_id(rng):
+        return rng.randint(1, actors)
+
+    def movie_id(rng):
+        return rng.randint(1, movies)
+
+    def new_actor(rng):
+        return {'name': f'Bench Actor {rng.randrange(10 ** 9)}', 'birthdate': '1985-05-05', 'gender': 'female'}
+
+    def new_movie(rng):
+        return {'title': f'Bench Movie {rng.randrange(10 ** 9)}', 'release_date': '2021-05-05'}
+
+    return [
+        endpoint('GET /', None, 'GET', '/', weight=READ_WEIGHT),
+        endpoint('GET /callback', None, 'GET', '/callback', weight=READ_WEIGHT),
+
+        endpoint('GET /actors', 'assistant', 'GET',
+                 lambda rng: f'/actors?page={rng.randint(1, 20)}&limit=20', weight=READ_WEIGHT),
+        endpoint('GET /actors?filters', 'assistant', 'GET',
+                 lambda rng: f'/actors?name={rng.choice("ABDEGHMRST")}&min_age={rng.randint(20, 60)}&sort=age',
+                 weight=READ_WEIGHT),
+        endpoint('GET /actors/{id}', 'assistant', 'GET',
+                 lambda rng: f'/actors/{actor_id(rng)}', weight=READ_WEIGHT),
+        endpoint('GET /actors/{id}/movies', 'assistant', 'GET',
+                 lambda rng: f'/actors/{actor_id(rng)}/movies', weight=READ_WEIGHT),
+        endpoint('POST /actors', 'director', 'POST', '/actors', new_actor),
+        endpoint('POST /actors/bulk', 'director', 'POST', '/actors/bulk',
+                 lambda rng: [new_actor(rng) for _ in range(bulk_size)]),
+        endpoint('PATCH /actors/{id}', 'director', 'PATCH',
+                 lambda rng: f'/actors/{actor_id(rng)}', lambda rng: {'name': f'Patched {rng.randrange(10 ** 9)}'}),
+        endpoint('DELETE /actors/{id}', 'director', 'DELETE',
+                 lambda rng: f'/actors/{next(deletable_actors)}'),
+
+        endpoint('GET /movies', 'assistant', 'GET',
+                 lambda rng: f'/movies?page={rng.randint(1, 20)}&limit=20', weight=READ_WEIGHT),
+        endpoint('GET /movies/{id}', 'assistant', 'GET',
+                 lambda rng: f'/movies/{movie_id(rng)}', weight=READ_WEIGHT),
+        endpoint('GET /movies/{id}/cast', 'assistant', 'GET',
+                 lambda rng: f'/movies/{movie_id(rng)}/cast', weight=READ_WEIGHT),
+        endpoint('POST /movies', 'producer', 'POST', '/movies', new_movie),
+        endpoint('POST /movies/bulk', 'producer', 'POST', '/movies/bulk',
+                 lambda rng: [new_movie(rng) for _ in range(bulk_size)]),
+        endpoint('PATCH /movies/{id}', 'director', 'PATCH',
+                 lambda rng: f'/movies/{movie_id(rng)}', lambda rng: {'title': f'Patched {rng.randrange(10 ** 9)}'}),
+        endpoint('DELETE /movies/{id}', 'producer', 'DELETE',
+                 lambda rng: f'/movies/{next(deletable_movies)}'),
+
+        # random pairs: mostly new bookings, some 409s for pairs already booked
+        endpoint('POST /contracts', 'producer', 'POST', '/contracts',
+                 lambda rng: {'actor_id': actor_id(rng), 'movie_id': movie_id(rng)}),
+        endpoint('POST /contracts/bulk', 'producer', 'POST', '/contracts/bulk',
+                 lambda rng: [{'actor_id': actor_id(rng), 'movie_id': movie_id(rng)} for _ in range(bulk_size)]),
+    ]
+
+
+def compare(previous, current):
+    "Print req/s and p99 of each endpoint against the results of an earlier run"
+    if previous['config'].get('mode') != current['config']['mode']:
+        print('\nnote: the earlier run used --mode {}, the req/s are not comparable'.format(
+            previous['config'].get('mode')))
+    print('\n{:<24} {:>21} {:>25}'.format('endpoint', 'req/s', 'p99 ms'))
+    for name, now in current['endpoints'].items():
+        before = previous['endpoints'].get(name)
+        if before is None:
+            continue
+        change = (now['requests_per_s'] / before['requests_per_s'] - 1) * 100 if before['requests_per_s'] else 0.0
+        print('{:<24} {:8.1f} -> {:8.1f} {:+6.1f}%  {:8.2f} -> {:8.2f}'.format(
+            name, before['requests_per_s'], now['requests_per_s'], change, before['p99_ms'], now['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--actors', type=int, default=10000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--contracts', type=int, default=20000)
+    parser.add_argument('--deletable', type=int, default=5000, help='extra actors and movies for DELETE')
+    parser.add_argument('--bulk-size', type=int, default=100, help='items per bulk request')
+    parser.add_argument('--server', default='sync', choices=['sync', 'gthread'])
+    parser.add_argument('--workers', type=int, default=2, help='server processes')
+    parser.add_argument('--threads', type=int, default=10, help='threads of each gthread worker')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=5, help='seconds per endpoint (each) or in total (mixed)')
+    parser.add_argument('--mode', default='each', choices=['each', 'mixed'])
+    parser.add_argument('--only', help='comma separated endpoint names, e.g. "GET /actors,POST /contracts"')
+    parser.add_argument('--response-cache', help='RESPONSE_CACHE_BACKEND of the server (default: its config)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='JSON of an earlier run to compare with')
+    args = parser.parse_args()
+
+    app = bench_app(args.database_url)
+    with app.app_context():
+        reset()
+        seed(args.actors, args.movies, args.contracts)
+        deletable_actors, deletable_movies = seed_deletable(args.actors, args.movies, args.deletable)
+        db.session.remove()
+
+    private_pem, public_jwk = signing_key()
+    tokens = {role: mint_token(private_pem, public_jwk['kid'], permissions) for role, permissions in ROLES.items()}
+    routes = endpoints(tokens, args.actors, args.movies, deletable_actors, deletable_movies, args.bulk_size)
+    if args.only:
+        names = set(args.only.split(','))
+        routes = [route for route in routes if route[0] in names]
+
+    results = {'endpoints': {}}
+    with StubJWKS(public_jwk) as jwks:
+        env = {'DATABASE_URL': args.database_url, 'JWKS_URL': jwks.url}
+        if args.response_cache:
+            env['RESPONSE_CACHE_BACKEND'] = args.response_cache
+        port = free_port()
+        with Server(server_command(args.server, port, args.workers, args.threads), port, env) as server:
+            if args.mode == 'mixed':
+                run = run_load(server.url, [build for _, _, build in routes], args.concurrency, args.duration,
+                               weights=[weight for _, weight, _ in routes])
+                results['overall'] = run['overall']
+                results['endpoints'] = run['endpoints']
+            else:
+                for name, _, build in routes:
+                    run = run_load(server.url, [build], args.concurrency, args.duration)
+                    results['endpoints'][name] = run['overall']
+
+        results['config'] = dict(vars(args), jwks_fetches=jwks.requests)
+
+    print('{:<24} {:>9} {:>9} {:>9} {:>9}  {}'.format('endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'statuses'))
+    for name, summary in results['endpoints'].items():
+        print('{:<24} {:9.1f} {:9.2f} {:9.2f} {:9.2f}  {}'.format(
+            name, summary['requests_per_s'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+            summary['statuses']))
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(json.load(previous_file), results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Round trips and throughput of booking contracts: the former add_contract
+(get_or_404 movie, get_or_404 actor, INSERT, COMMIT) against MovieCast.book
+(one INSERT ... SELECT ... ON CONFLICT DO NOTHING, COMMIT), with concurrent
+workers booking random, partly duplicate, actor/movie pairs.
+
+    cd backend
+    python -m benchmarks.bench_contracts --workers 8 --bookings 500
+    python -m benchmarks.bench_contracts --database-url postgresql://postgres@localhost/casting_bench
+
+The database is dropped and reseeded.
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Actor, Movie, MovieCast
+from benchmarks.common import bench_app, default_database_url, write_json
+from benchmarks.seed import reset, seed
+
+
+class RoundTrips(object):
+    "Counts statements and commits sent to the database"
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self.on_statement)
+        event.listen(engine, 'commit', self.on_commit)
+
+    def on_statement(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def on_commit(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def legacy_booking(actor_id, movie_id):
+    "The former add_contract: two lookups, then INSERT and COMMIT"
+    if Movie.query.get(movie_id) is None or Actor.query.get(actor_id) is None:
+        return 404
+    try:
+        db.session.add(MovieCast(actor_id=actor_id, movie_id=movie_id))
+        db.session.commit()
+        return 200
+    except IntegrityError:
+        db.session.rollback()
+        return 409
+    finally:
+        db.session.close()
+
+
+def single_statement_booking(actor_id, movie_id):
+    try:
+        contract_id = MovieCast.book(actor_id, movie_id)
+        if contract_id is not None:
+            db.session.commit()
+            return 200
+        return MovieCast.booking_failure(actor_id, movie_id)
+    except IntegrityError:
+        db.session.rollback()
+        return 409
+    finally:
+        db.session.close()
+
+
+def run(app, book, pairs, workers):
+    def worker(chunk):
+        statuses = []
+        with app.app_context():
+            for actor_id, movie_id in chunk:
+                statuses.append(book(actor_id, movie_id))
+            db.session.remove()
+        return statuses
+
+    chunks = [pairs[i::workers] for i in range(workers)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        statuses = [status for result in pool.map(worker, chunks) for status in result]
+    return time.perf_counter() - started, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--actors', type=int, default=2000)
+    parser.add_argument('--movies', type=int, default=500)
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    # a few ids past the seeded range give 404s, a small id space gives duplicates (409)
+    pairs = [(rng.randint(1, args.actors + 10), rng.randint(1, args.movies // 10 or 1))
+             for _ in range(args.bookings)]
+
+    app = bench_app(args.database_url, SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}}
+                    if args.database_url.startswith('sqlite') else {})
+    results = {}
+    with app.app_context():
+        for name, book in (('legacy', legacy_booking), ('single statement', single_statement_booking)):
+            reset()
+            seed(args.actors, args.movies, contracts=0)
+            round_trips = RoundTrips(db.engine)
+            elapsed, statuses = run(app, book, pairs, args.workers)
+            results[name] = {
+                'bookings': len(statuses),
+                'seconds': elapsed,
+                'bookings_per_second': len(statuses) / elapsed,
+                'round_trips_per_booking': round_trips.count / len(statuses),
+                'statuses': {str(s): statuses.count(s) for s in sorted(set(statuses))},
+            }
+            event.remove(db.engine, 'before_cursor_execute', round_trips.on_statement)
+            event.remove(db.engine, 'commit', round_trips.on_commit)
+            print('{:<17} {:8.1f} bookings/s  {:5.2f} round trips/booking  {}'.format(
+                name, results[name]['bookings_per_second'],
+                results[name]['round_trips_per_booking'], results[name]['statuses']))
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
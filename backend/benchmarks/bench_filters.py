@@ -0,0 +1,89 @@
+"""
+Query plans and latency of the /actors and /movies filters and sort orders,
+over a seeded million-row actor table. The queries are built by the same
+code as the endpoints, from the query string of each case.
+
+    cd backend
+    python -m benchmarks.bench_filters
+    python -m benchmarks.bench_filters --database-url postgresql://postgres@localhost/casting_bench
+
+The prefix and substring cases only use an index on Postgres (text_pattern_ops
+and pg_trgm indexes); on SQLite they scan. The database is dropped and reseeded.
+"""
+import argparse
+import datetime
+
+from app import db
+from app.models import Actor, Movie, ACTOR_COLUMNS, MOVIE_COLUMNS
+from app.main.filters import (filter_actors, filter_movies, sort_args, order_by_keyset,
+                              ACTOR_SORTS, MOVIE_SORTS)
+from benchmarks.common import bench_app, default_database_url, explain, measure, write_json
+from benchmarks.seed import reset, seed
+
+PAGE_SIZE = 7
+
+CASES = [
+    ('actors', 'name=sandra%20bull'),
+    ('actors', 'name_contains=hanks%2042'),
+    ('actors', 'gender=female'),
+    ('actors', 'birthdate_from=1970-01-01&birthdate_to=1970-01-31'),
+    ('actors', 'min_age=30&max_age=30'),
+    ('actors', 'sort=age'),
+    ('actors', 'gender=other&sort=-name'),
+    ('movies', 'title=harry%20potter'),
+    ('movies', 'title_contains=club%2012'),
+    ('movies', 'release_date_from=2000-01-01&release_date_to=2000-12-31&sort=-release_date'),
+]
+
+
+def build_query(app, resource, query_string):
+    "The first page query of GET /<resource>?<query_string>, without permissions and formatting"
+    with app.test_request_context('/{}?{}'.format(resource, query_string)):
+        if resource == 'actors':
+            keyset, descending = sort_args(ACTOR_SORTS, 'name')
+            query = filter_actors(db.session.query(*ACTOR_COLUMNS), datetime.date.today())
+        else:
+            keyset, descending = sort_args(MOVIE_SORTS, 'title')
+            query = filter_movies(db.session.query(*MOVIE_COLUMNS))
+        return order_by_keyset(query, keyset, descending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--actors', type=int, default=1000000)
+    parser.add_argument('--movies', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    app = bench_app(args.database_url)
+    with app.app_context():
+        reset()
+        seed(args.actors, args.movies, 0)
+        db.session.execute('ANALYZE')
+        db.session.commit()
+
+        results = {}
+        for resource, query_string in CASES:
+            query = build_query(app, resource, query_string)
+            label = '{}?{}'.format(resource, query_string)
+            plan = explain(query.limit(PAGE_SIZE))
+            page = measure(query.limit(PAGE_SIZE).all, repeat=args.repeat)
+            total = measure(query.order_by(None).count, repeat=args.repeat)
+            results[label] = {'plan': plan, 'page': page, 'count': total}
+            print('{:<80} page p50 {:8.3f} ms  count p50 {:8.3f} ms'.format(
+                label, page['p50_ms'], total['p50_ms']))
+            for line in plan:
+                print('    ' + line)
+
+        if args.json:
+            write_json(args.json, {
+                'database': db.engine.dialect.name,
+                'rows': {'actors': args.actors, 'movies': args.movies},
+                'cases': results,
+            })
+
+
+if __name__ == '__main__':
+    main()
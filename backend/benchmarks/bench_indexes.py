@@ -0,0 +1,97 @@
+"""
+Query plans and latency of the list and cast queries without and with the
+indexes of migration 3f1c2a9d8b7e (sort indexes on actor/movie, movie_cast
+foreign key and unique booking indexes).
+
+    cd backend
+    python -m benchmarks.bench_indexes --actors 200000 --movies 50000 --contracts 400000
+    python -m benchmarks.bench_indexes --database-url postgresql://postgres@localhost/casting_bench
+
+The database is dropped and reseeded.
+"""
+import argparse
+
+from sqlalchemy import tuple_
+
+from app import db
+from app.models import Actor, Movie, MovieCast
+from benchmarks.common import bench_app, default_database_url, explain, measure, write_json
+from benchmarks.seed import reset, seed
+
+NEW_INDEXES = (
+    'ix_actor_name_id', 'ix_movie_title_id',
+    'uq_movie_cast_actor_id_movie_id', 'ix_movie_cast_movie_id',
+)
+
+
+def new_indexes():
+    return [index
+            for table in db.metadata.sorted_tables
+            for index in table.indexes
+            if index.name in NEW_INDEXES]
+
+
+def queries(actors, movies):
+    "The statements behind GET /actors, /movies and cast lookups"
+    middle = Actor.query.order_by(Actor.name, Actor.id).offset(actors // 2).first()
+    return {
+        'actors first page': Actor.query.order_by(Actor.name, Actor.id).limit(7),
+        'actors deep offset page': Actor.query.order_by(Actor.name, Actor.id).offset(actors - 7).limit(7),
+        'actors keyset page': Actor.query.order_by(Actor.name, Actor.id)
+            .filter(tuple_(Actor.name, Actor.id) > tuple_(middle.name, middle.id)).limit(7),
+        'movies first page': Movie.query.order_by(Movie.title, Movie.id).limit(7),
+        'cast of a movie': MovieCast.query.filter(MovieCast.movie_id == movies // 2),
+        'movies of an actor': MovieCast.query.filter(MovieCast.actor_id == actors // 2),
+    }
+
+
+def run_phase(name, named_queries, repeat):
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    results = {}
+    print('\n== {} indexes'.format(name))
+    for label, query in named_queries.items():
+        plan = explain(query)
+        timing = measure(query.all, repeat=repeat)
+        results[label] = {'plan': plan, 'latency': timing}
+        print('{:<26} p50 {:8.3f} ms  p95 {:8.3f} ms'.format(label, timing['p50_ms'], timing['p95_ms']))
+        for line in plan:
+            print('    ' + line)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--actors', type=int, default=100000)
+    parser.add_argument('--movies', type=int, default=20000)
+    parser.add_argument('--contracts', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    app = bench_app(args.database_url)
+    with app.app_context():
+        reset()
+        seed(args.actors, args.movies, args.contracts)
+        named_queries = queries(args.actors, args.movies)
+
+        for index in new_indexes():
+            index.drop(bind=db.engine)
+        without = run_phase('without', named_queries, args.repeat)
+
+        for index in new_indexes():
+            index.create(bind=db.engine)
+        with_indexes = run_phase('with', named_queries, args.repeat)
+
+        if args.json:
+            write_json(args.json, {
+                'database': db.engine.dialect.name,
+                'rows': {'actors': args.actors, 'movies': args.movies, 'contracts': args.contracts},
+                'without_indexes': without,
+                'with_indexes': with_indexes,
+            })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Latency of GET /search over a seeded million-row actor table: the tsvector
+and GIN index on Postgres, the in-process inverted index elsewhere (whose
+build, on the first search after a write, is reported separately).
+
+    cd backend
+    python -m benchmarks.bench_search
+    python -m benchmarks.bench_search --database-url postgresql://postgres@localhost/casting_bench
+
+The target is a p95 under 20 ms per query. The database is dropped and reseeded.
+"""
+import argparse
+import time
+
+from flask import current_app
+
+from app import db
+from app.models import Actor, Movie, ACTOR_COLUMNS, MOVIE_COLUMNS
+from app.search.index import inverted_index
+from benchmarks.common import bench_app, default_database_url, measure, write_json
+from benchmarks.seed import reset, seed
+
+QUERIES = ['sandra', 'tom hanks', 'emma watson 4242', 'harry potter', 'nobody']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--actors', type=int, default=1000000)
+    parser.add_argument('--movies', type=int, default=200000)
+    parser.add_argument('--limit', type=int, default=7)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    app = bench_app(args.database_url)
+    with app.app_context():
+        reset()
+        seed(args.actors, args.movies, 0)
+        db.session.execute('ANALYZE')
+        db.session.commit()
+        backend = current_app.extensions['search']
+
+        results = {'backend': backend.name, 'queries': {}}
+        if backend is inverted_index:
+            started = time.perf_counter()
+            inverted_index.build(Actor)
+            inverted_index.build(Movie)
+            results['build_ms'] = (time.perf_counter() - started) * 1000
+            print('index build {:10.1f} ms'.format(results['build_ms']))
+
+        for text in QUERIES:
+            def search():
+                backend.search(Actor, ACTOR_COLUMNS, text, args.limit)
+                backend.search(Movie, MOVIE_COLUMNS, text, args.limit)
+            timing = measure(search, repeat=args.repeat)
+            results['queries'][text] = timing
+            print('{:<20} p50 {:8.3f} ms  p95 {:8.3f} ms'.format(text, timing['p50_ms'], timing['p95_ms']))
+
+        if args.json:
+            results['rows'] = {'actors': args.actors, 'movies': args.movies}
+            write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
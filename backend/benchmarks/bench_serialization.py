@@ -0,0 +1,70 @@
+"""
+Cost of building a 10k row list response: ORM objects + format() + jsonify
+(the former list endpoints) against column tuples + format_*_row + the
+stdlib and orjson encoders of app.serialization.
+
+    cd backend
+    python -m benchmarks.bench_serialization --rows 10000
+
+The database is dropped and reseeded.
+"""
+import argparse
+
+from flask import jsonify
+
+from app import db
+from app.models import Actor, Movie, ACTOR_COLUMNS, MOVIE_COLUMNS, format_actor_row, format_movie_row
+from app.serialization import get_dumps, orjson
+from benchmarks.common import bench_app, default_database_url, measure, write_json
+from benchmarks.seed import reset, seed
+
+
+def orm_jsonify(model, order_by, key):
+    def run():
+        rows = model.query.order_by(*order_by).all()
+        return jsonify({'success': True, key: [row.format() for row in rows], 'total': len(rows)}).data
+    return run
+
+
+def column_tuples(columns, order_by, format_row, key, dumps):
+    def run():
+        rows = db.session.query(*columns).order_by(*order_by).all()
+        return dumps({'success': True, key: [format_row(row) for row in rows], 'total': len(rows)})
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    app = bench_app(args.database_url)
+    results = {}
+    with app.test_request_context():
+        reset()
+        seed(actors=args.rows, movies=args.rows, contracts=0)
+
+        backends = ['stdlib'] + (['orjson'] if orjson is not None else [])
+        for key, model, columns, order_by, format_row in (
+                ('actors', Actor, ACTOR_COLUMNS, (Actor.name, Actor.id), format_actor_row),
+                ('movies', Movie, MOVIE_COLUMNS, (Movie.title, Movie.id), format_movie_row)):
+            paths = {'orm + format() + jsonify': orm_jsonify(model, order_by, key)}
+            for backend in backends:
+                paths['column tuples + ' + backend] = column_tuples(
+                    columns, order_by, format_row, key, get_dumps(backend))
+
+            for name, run in paths.items():
+                timing = measure(run, repeat=args.repeat)
+                results['{}: {}'.format(key, name)] = timing
+                print('{:<8} {:<28} p50 {:8.2f} ms  p95 {:8.2f} ms'.format(
+                    key, name, timing['p50_ms'], timing['p95_ms']))
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
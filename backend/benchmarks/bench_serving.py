@@ -0,0 +1,92 @@
+"""
+Throughput and latency of gunicorn's sync workers on entrypoint:app (the
+Procfile), its gthread workers, and the async entry point asgi:app on the
+uvicorn worker, with the same number of processes and concurrent keep-alive
+clients reading lists, single rows and search results.
+
+    cd backend
+    python -m benchmarks.bench_serving --workers 2 --threads 8 --concurrency 32 --duration 20
+    python -m benchmarks.bench_serving --database-url postgresql://postgres@localhost/casting_bench
+
+Needs gunicorn, and uvicorn, greenlet and aiosqlite for asgi. Tokens are
+signed with a local key, served to the servers as a JWKS file. The database
+is dropped and reseeded.
+"""
+import argparse
+import os
+import tempfile
+from urllib.parse import quote
+
+from benchmarks.common import bench_app, default_database_url, write_json
+from benchmarks.load import (Request, Server, free_port, mint_token, run_load, server_command,
+                             signing_key, write_jwks)
+from benchmarks.seed import reset, seed
+
+PERMISSIONS = ['get:actors', 'get:movies']
+
+
+def load(actors, movies, headers):
+    "Random reads over the seeded rows"
+    return [
+        lambda rng: Request('GET /actors', 'GET', '/actors?page={}&limit=20'.format(rng.randint(1, 20)), headers),
+        lambda rng: Request('GET /movies', 'GET', '/movies?page={}&limit=20'.format(rng.randint(1, 20)), headers),
+        lambda rng: Request('GET /actors/{id}', 'GET', '/actors/{}'.format(rng.randint(1, actors)), headers),
+        lambda rng: Request('GET /movies/{id}/cast', 'GET',
+                            '/movies/{}/cast'.format(rng.randint(1, movies)), headers),
+        lambda rng: Request('GET /search', 'GET', '/search?q=' + quote(rng.choice(['tom', 'harry potter', 'stone'])),
+                            headers),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--actors', type=int, default=10000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--contracts', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=2, help='server processes')
+    parser.add_argument('--threads', type=int, default=10, help='threads of each gthread worker')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--modes', default='sync,gthread,asgi')
+    parser.add_argument('--response-cache', default='none',
+                        help='RESPONSE_CACHE_BACKEND of the servers; none measures the serving, not the cache')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    app = bench_app(args.database_url)
+    with app.app_context():
+        reset()
+        seed(args.actors, args.movies, args.contracts)
+
+    private_pem, public_jwk = signing_key()
+    handle, jwks_path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    write_jwks(jwks_path, public_jwk)
+    headers = {'Authorization': 'Bearer ' + mint_token(private_pem, public_jwk['kid'], PERMISSIONS)}
+    env = {
+        'DATABASE_URL': args.database_url,
+        'JWKS_URL': 'file://' + jwks_path,
+        'RESPONSE_CACHE_BACKEND': args.response_cache,
+    }
+
+    results = {}
+    try:
+        for mode in args.modes.split(','):
+            port = free_port()
+            with Server(server_command(mode, port, args.workers, args.threads), port, env) as server:
+                results[mode] = run_load(server.url, load(args.actors, args.movies, headers),
+                                         concurrency=args.concurrency, duration=args.duration)
+            overall = results[mode]['overall']
+            print('{:<7} {:8.1f} req/s  p50 {:7.2f} ms  p99 {:7.2f} ms  statuses {}  errors {}'.format(
+                mode, overall['requests_per_s'], overall['p50_ms'], overall['p99_ms'],
+                overall['statuses'], overall['errors']))
+    finally:
+        os.remove(jwks_path)
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
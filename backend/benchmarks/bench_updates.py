@@ -0,0 +1,120 @@
+"""
+Round trips and throughput of PATCH /actors/<id>: the former update_actor
+(get_or_404, UPDATE, COMMIT, then a second SELECT to format the response)
+against update_row (UPDATE ... RETURNING, COMMIT), with concurrent workers
+renaming random actors, a few of them missing (404).
+
+    cd backend
+    python -m benchmarks.bench_updates --workers 8 --updates 2000
+    python -m benchmarks.bench_updates --database-url postgresql://postgres@localhost/casting_bench
+
+Without RETURNING (SQLite), update_row selects the row after the UPDATE, so
+the saving there is one round trip instead of two. The database is dropped
+and reseeded.
+"""
+import argparse
+import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+from app.models import Actor, format_actor_row, update_row, update_failure
+from benchmarks.bench_contracts import RoundTrips
+from benchmarks.common import bench_app, default_database_url, write_json
+from benchmarks.seed import reset, seed
+
+
+def legacy_update(actor_id, name):
+    "The former update_actor: load, update, commit, load again to format"
+    today = datetime.date.today()
+    actor = Actor.query.get(actor_id)
+    if actor is None:
+        return 404
+    actor.name = name
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return 412
+    finally:
+        db.session.close()
+    Actor.query.get(actor_id).format(today)
+    db.session.close()
+    return 200
+
+
+def single_statement_update(actor_id, name):
+    today = datetime.date.today()
+    try:
+        row = update_row(Actor, actor_id, {'name': name})
+        if row is None:
+            return update_failure(Actor, actor_id, None)
+        db.session.commit()
+        format_actor_row(row, today)
+        return 200
+    finally:
+        db.session.close()
+
+
+def run(app, update, targets, workers):
+    def worker(chunk):
+        statuses = []
+        with app.app_context():
+            for actor_id, name in chunk:
+                statuses.append(update(actor_id, name))
+            db.session.remove()
+        return statuses
+
+    chunks = [targets[i::workers] for i in range(workers)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        statuses = [status for result in pool.map(worker, chunks) for status in result]
+    return time.perf_counter() - started, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=default_database_url())
+    parser.add_argument('--actors', type=int, default=2000)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    # a few ids past the seeded range give 404s
+    targets = [(rng.randint(1, args.actors + 10), 'Actor {}'.format(i)) for i in range(args.updates)]
+
+    app = bench_app(args.database_url, SQLALCHEMY_ENGINE_OPTIONS={'connect_args': {'timeout': 30}}
+                    if args.database_url.startswith('sqlite') else {})
+    results = {}
+    with app.app_context():
+        for name, update in (('legacy', legacy_update), ('single statement', single_statement_update)):
+            reset()
+            seed(args.actors, movies=10, contracts=0)
+            round_trips = RoundTrips(db.engine)
+            elapsed, statuses = run(app, update, targets, args.workers)
+            results[name] = {
+                'updates': len(statuses),
+                'seconds': elapsed,
+                'updates_per_second': len(statuses) / elapsed,
+                'round_trips_per_update': round_trips.count / len(statuses),
+                'statuses': {str(s): statuses.count(s) for s in sorted(set(statuses))},
+            }
+            event.remove(db.engine, 'before_cursor_execute', round_trips.on_statement)
+            event.remove(db.engine, 'commit', round_trips.on_commit)
+            print('{:<17} {:8.1f} updates/s  {:5.2f} round trips/update  {}'.format(
+                name, results[name]['updates_per_second'],
+                results[name]['round_trips_per_update'], results[name]['statuses']))
+        results['dialect'] = db.engine.dialect.name
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from app import create_app, db
+from config import Config
+
+
+def default_database_url():
+    "A throwaway SQLite file; pass --database-url to benchmark Postgres"
+    return 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'casting_bench.db')
+
+
+def bench_app(database_url, **settings):
+    '''
+    App bound to `database_url`. The benchmarks drop and recreate its tables,
+    so never point them at a database that holds real data.
+    '''
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+
+    for key, value in settings.items():
+        setattr(BenchConfig, key, value)
+    return create_app(BenchConfig)
+
+
+def measure(fn, repeat=50, warmup=3):
+    "Run `fn` repeatedly; latency percentiles in milliseconds"
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'runs': repeat,
+        'mean_ms': statistics.mean(timings),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': timings[-1],
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def write_json(path, results):
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True, default=str)
+
+
+def explain(query):
+    "Query plan of an ORM query, as the database reports it"
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'postgresql':
+        rows = db.session.execute('EXPLAIN ANALYZE ' + sql).fetchall()
+        return [row[0] for row in rows]
+    rows = db.session.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    return [row[-1] for row in rows]
@@ -0,0 +1,253 @@
+"""
+Load generation against a real server process: a local signing key and a
+JWKS (file or HTTP stub) standing in for Auth0, tokens signed with it, a
+server started as a subprocess, and concurrent keep-alive clients.
+"""
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+from benchmarks.common import percentile
+from config import Config
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def b64_int(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def signing_key(kid='bench'):
+    "New RSA keypair; returns the private PEM and the public JWK"
+    key = RSA.generate(2048)
+    public_jwk = {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'alg': 'RS256',
+                  'n': b64_int(key.n), 'e': b64_int(key.e)}
+    return key.export_key().decode('ascii'), public_jwk
+
+
+def write_jwks(path, *jwks):
+    "Key set file for JWKS_URL=file://`path`"
+    with open(path, 'w') as jwks_file:
+        json.dump({'keys': list(jwks)}, jwks_file)
+
+
+class StubJWKS(object):
+    "Serves a key set over HTTP on localhost, like the IdP's /.well-known/jwks.json"
+
+    def __init__(self, *jwks, max_age=600):
+        body = json.dumps({'keys': list(jwks)}).encode()
+        stub = self
+        self.requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Cache-Control', f'public, max-age={max_age}')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(self.server.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def mint_token(private_pem, kid, permissions, expires_in=24 * 3600):
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{Config.AUTH0_DOMAIN}/',
+        'sub': 'auth0|bench',
+        'aud': Config.API_AUDIENCE,
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': list(permissions),
+    }
+    return jwt.encode(claims, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server(object):
+    "A server command run from the backend directory, for the duration of a with block"
+
+    def __init__(self, command, port, env=None, startup_timeout=30):
+        self.command = command
+        self.port = port
+        self.env = dict(os.environ, **(env or {}))
+        self.startup_timeout = startup_timeout
+        self.url = f'http://127.0.0.1:{port}'
+
+    def __enter__(self):
+        # a file rather than a pipe: a server logging to a full pipe would block
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(self.command, cwd=BACKEND_DIR, env=self.env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError('server exited: ' + self.log.read().decode(errors='replace'))
+            # ready once a worker answers, not when the socket is bound
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+            try:
+                connection.request('GET', '/')
+                connection.getresponse().read()
+                return self
+            except (OSError, http.client.HTTPException):
+                time.sleep(0.1)
+            finally:
+                connection.close()
+        self.__exit__()
+        raise RuntimeError(f'server did not listen on port {self.port} within {self.startup_timeout}s')
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+def server_command(kind, port, workers, threads=10):
+    '''
+    gunicorn on entrypoint:app with its sync workers (the Procfile), or with
+    `threads` threads per worker (gthread), or on the async entry point
+    asgi:app with the uvicorn worker (asgi)
+    '''
+    bind = f'127.0.0.1:{port}'
+    if kind == 'sync':
+        return ['gunicorn', 'entrypoint:app', '-w', str(workers), '-b', bind]
+    if kind == 'gthread':
+        return ['gunicorn', 'entrypoint:app', '-k', 'gthread', '--threads', str(threads),
+                '-w', str(workers), '-b', bind]
+    if kind == 'asgi':
+        return ['gunicorn', 'asgi:app', '-k', 'uvicorn.workers.UvicornWorker', '-w', str(workers), '-b', bind]
+    raise ValueError(f'unknown server {kind!r}')
+
+
+class Request(object):
+    "One kind of request of the load: `name` groups its latencies in the report"
+
+    def __init__(self, name, method, path, headers=None, body=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.headers = headers or {}
+        self.body = json.dumps(body).encode() if body is not None else None
+
+    def send(self, connection):
+        "Send on a keep-alive connection; returns the status"
+        connection.request(self.method, self.path, body=self.body, headers=self.headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+
+def run_load(base_url, requests, concurrency=16, duration=10, warmup=1, random_seed=42, weights=None):
+    '''
+    Each of `concurrency` clients sends randomly picked `requests` (a list of
+    Request, or callables returning one; optionally `weights`ed) back to back
+    over its own keep-alive connection, for `duration` seconds after `warmup`
+    seconds.
+    Returns the throughput and latency percentiles, overall and per request name.
+    '''
+    address = urlsplit(base_url)
+    timings = defaultdict(list)
+    statuses = defaultdict(Counter)
+    errors = Counter()
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        connection = http.client.HTTPConnection(address.hostname, address.port, timeout=30)
+        own_timings, own_statuses = defaultdict(list), defaultdict(Counter)
+        own_errors = Counter()
+        while True:
+            request = rng.choices(requests, weights)[0]
+            if callable(request):
+                request = request(rng)
+            sent_at = time.perf_counter()
+            if sent_at >= stop_at:
+                break
+            try:
+                status = request.send(connection)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                connection = http.client.HTTPConnection(address.hostname, address.port, timeout=30)
+                if sent_at >= measure_from:
+                    own_errors[request.name + ': ' + type(e).__name__] += 1
+                continue
+            if sent_at >= measure_from:
+                own_timings[request.name].append((time.perf_counter() - sent_at) * 1000)
+                own_statuses[request.name][status] += 1
+        connection.close()
+        with lock:
+            for name, values in own_timings.items():
+                timings[name].extend(values)
+            for name, counts in own_statuses.items():
+                statuses[name].update(counts)
+            errors.update(own_errors)
+
+    clients = [threading.Thread(target=client, args=(random_seed + i,)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    def summary(values, counts):
+        values.sort()
+        return {
+            'requests': len(values),
+            'requests_per_s': len(values) / duration,
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+            'max_ms': values[-1] if values else 0.0,
+            'statuses': {str(status): n for status, n in sorted(counts.items())},
+        }
+
+    everything = [value for values in timings.values() for value in values]
+    overall = summary(everything, sum(statuses.values(), Counter()))
+    overall['errors'] = dict(errors)
+    overall['concurrency'] = concurrency
+    overall['duration_s'] = duration
+    return {
+        'overall': overall,
+        'endpoints': {name: summary(timings[name], statuses[name]) for name in sorted(timings)},
+    }
+
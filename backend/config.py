@@ -6,8 +6,87 @@ postgres_user = "postgres"
 host = "localhost"
 port = "5432"
 database_path = f"postgresql://{postgres_user}@{host}:{port}/{database_name}"
+replica_urls = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
 
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess-me'
     SQLALCHEMY_TRACK_MODIFICATIONS = False 
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or database_path
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or database_path
+
+    # Database: connection pool of each process (e.g. gunicorn worker), ignored for SQLite.
+    # DB_STATEMENT_TIMEOUT is in milliseconds (0: none). DB_PGBOUNCER leaves pooling to PgBouncer
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') not in ('0', 'false', 'False')
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', '0') not in ('0', 'false', 'False')
+    # Database drivers waiting on the event loop (aiosqlite, green psycopg2): only for the async
+    # entry point (asgi.py), which turns it on
+    DB_ASYNC = False
+
+    # Read replicas (comma separated DATABASE_REPLICA_URLS) for read-only GET handlers:
+    # picked round_robin or least_latency, an unreachable one is retried after REPLICA_RETRY_INTERVAL seconds
+    SQLALCHEMY_BINDS = {f'replica_{i}': url for i, url in enumerate(replica_urls)}
+    REPLICA_SELECTION = os.environ.get('REPLICA_SELECTION', 'round_robin')
+    REPLICA_RETRY_INTERVAL = int(os.environ.get('REPLICA_RETRY_INTERVAL', 30))
+
+    # Auth: the Auth0 tenant issuing the tokens, and the accepted audience and algorithms
+    AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN', 'dev-c.eu.auth0.com')
+    API_AUDIENCE = os.environ.get('API_AUDIENCE', 'casting-agency')
+    ALGORITHMS = [a.strip(' "\'') for a in os.environ.get('ALGORITHMS', 'RS256').strip('[]').split(',')]
+
+    # Auth: pinned signing keys (JWKS / JWK JSON, {kid: PEM} JSON, or PEM), inline or in a file.
+    # When set, the JWKS is never fetched
+    AUTH_PUBLIC_KEYS = os.environ.get('AUTH_PUBLIC_KEYS')
+    AUTH_PUBLIC_KEYS_FILE = os.environ.get('AUTH_PUBLIC_KEYS_FILE')
+
+    # Auth: JWKS cache (unset JWKS_URL means the key set of AUTH0_DOMAIN, file:// urls work too)
+    JWKS_URL = os.environ.get('JWKS_URL')
+    JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 600))
+    JWKS_CACHE_MIN_TTL = int(os.environ.get('JWKS_CACHE_MIN_TTL', 30))
+    JWKS_REFRESH_AHEAD = int(os.environ.get('JWKS_REFRESH_AHEAD', 60))
+    JWKS_MIN_REFETCH_INTERVAL = int(os.environ.get('JWKS_MIN_REFETCH_INTERVAL', 30))
+    JWKS_FETCH_TIMEOUT = float(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+
+    # Auth: cache of verified tokens, each entry expires with its token
+    AUTH_TOKEN_CACHE_ENABLED = os.environ.get('AUTH_TOKEN_CACHE_ENABLED', '1') not in ('0', 'false', 'False')
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024))
+
+    # Pagination: seconds a filtered list total (SQL COUNT) is reused, 0 counts on every request;
+    # at most PAGINATE_COUNT_CACHE_SIZE totals are kept, the least recently used go first
+    PAGINATE_COUNT_CACHE_TTL = int(os.environ.get('PAGINATE_COUNT_CACHE_TTL', 0))
+    PAGINATE_COUNT_CACHE_SIZE = int(os.environ.get('PAGINATE_COUNT_CACHE_SIZE', 1024))
+
+    # Table counts: memory (per process) or redis (COUNTER_REDIS_URL), checked against COUNT every interval
+    COUNTER_BACKEND = os.environ.get('COUNTER_BACKEND', 'memory')
+    COUNTER_REDIS_URL = os.environ.get('COUNTER_REDIS_URL')
+    COUNTER_RECONCILE_INTERVAL = int(os.environ.get('COUNTER_RECONCILE_INTERVAL', 300))
+
+    # Response cache of the list endpoints: memory (LRU per process), redis (RESPONSE_CACHE_REDIS_URL) or none
+    # with memory, other workers' writes go unseen for up to RESPONSE_CACHE_TTL seconds: use redis or none
+    # for more than one worker
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL')
+
+    # Export: rows fetched per round trip of the server-side cursor
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+    # Bulk create: items per transaction, and per request
+    BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+    BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 50000))
+
+    # JSON encoder of the list endpoints: auto (orjson if installed), orjson or stdlib
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+    # Metrics at /metrics. With METRICS_DIR, each process writes its metrics there every
+    # METRICS_FLUSH_INTERVAL seconds and /metrics reports the sum of all the processes (gunicorn workers)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') not in ('0', 'false', 'False')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+    # Search: auto (tsvector on Postgres, else an in-process index), postgres or memory
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
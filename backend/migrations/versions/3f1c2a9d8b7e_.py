@@ -0,0 +1,35 @@
+"""add sort indexes, movie_cast foreign key indexes and unique booking
+
+Revision ID: 3f1c2a9d8b7e
+Revises: 8027abfcfdf9
+Create Date: 2026-10-18 10:12:41.532087
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8b7e'
+down_revision = '8027abfcfdf9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the first booking of duplicated (actor, movie) pairs, so the unique index can be built
+    op.execute(
+        'DELETE FROM movie_cast WHERE id NOT IN '
+        '(SELECT MIN(id) FROM movie_cast GROUP BY actor_id, movie_id)'
+    )
+    op.create_index('ix_actor_name_id', 'actor', ['name', 'id'], unique=False)
+    op.create_index('ix_movie_title_id', 'movie', ['title', 'id'], unique=False)
+    op.create_index('uq_movie_cast_actor_id_movie_id', 'movie_cast', ['actor_id', 'movie_id'], unique=True)
+    op.create_index('ix_movie_cast_movie_id', 'movie_cast', ['movie_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_movie_cast_movie_id', table_name='movie_cast')
+    op.drop_index('uq_movie_cast_actor_id_movie_id', table_name='movie_cast')
+    op.drop_index('ix_movie_title_id', table_name='movie')
+    op.drop_index('ix_actor_name_id', table_name='actor')
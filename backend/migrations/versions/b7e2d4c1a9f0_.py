@@ -0,0 +1,24 @@
+"""add actor birthdate index for age filters
+
+Revision ID: b7e2d4c1a9f0
+Revises: 3f1c2a9d8b7e
+Create Date: 2026-10-18 14:03:27.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4c1a9f0'
+down_revision = '3f1c2a9d8b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actor_birthdate', 'actor', ['birthdate'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_actor_birthdate', table_name='actor')
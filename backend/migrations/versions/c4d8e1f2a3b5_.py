@@ -0,0 +1,44 @@
+"""add indexes for the actor and movie list filters
+
+Revision ID: c4d8e1f2a3b5
+Revises: b7e2d4c1a9f0
+Create Date: 2026-10-18 15:21:09.664810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e1f2a3b5'
+down_revision = 'b7e2d4c1a9f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_actor_birthdate', table_name='actor')
+    op.create_index('ix_actor_birthdate_id', 'actor', ['birthdate', 'id'], unique=False)
+    op.create_index('ix_actor_gender_name_id', 'actor', ['gender', 'name', 'id'], unique=False)
+    op.create_index('ix_movie_release_date_id', 'movie', ['release_date', 'id'], unique=False)
+
+    # name/title prefix and substring filters; these index types only exist on Postgres
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_actor_name_lower_pattern ON actor (lower(name) text_pattern_ops)')
+        op.execute('CREATE INDEX ix_actor_name_trgm ON actor USING gin (name gin_trgm_ops)')
+        op.execute('CREATE INDEX ix_movie_title_lower_pattern ON movie (lower(title) text_pattern_ops)')
+        op.execute('CREATE INDEX ix_movie_title_trgm ON movie USING gin (title gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_context().dialect.name == 'postgresql':
+        op.drop_index('ix_movie_title_trgm', table_name='movie')
+        op.drop_index('ix_movie_title_lower_pattern', table_name='movie')
+        op.drop_index('ix_actor_name_trgm', table_name='actor')
+        op.drop_index('ix_actor_name_lower_pattern', table_name='actor')
+
+    op.drop_index('ix_movie_release_date_id', table_name='movie')
+    op.drop_index('ix_actor_gender_name_id', table_name='actor')
+    op.drop_index('ix_actor_birthdate_id', table_name='actor')
+    op.create_index('ix_actor_birthdate', 'actor', ['birthdate'], unique=False)
@@ -0,0 +1,44 @@
+"""add full-text search vectors to actor and movie
+
+Revision ID: d5e9f3a4b6c7
+Revises: c4d8e1f2a3b5
+Create Date: 2026-10-18 16:40:52.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e9f3a4b6c7'
+down_revision = 'c4d8e1f2a3b5'
+branch_labels = None
+depends_on = None
+
+SEARCHABLE = (('actor', 'name'), ('movie', 'title'))
+
+
+def upgrade():
+    # other databases search with an in-process index
+    if op.get_context().dialect.name != 'postgresql':
+        return
+
+    for table, column in SEARCHABLE:
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute(f"UPDATE {table} SET search_vector = to_tsvector('pg_catalog.simple', coalesce({column}, ''))")
+        op.execute(
+            f'CREATE TRIGGER {table}_search_vector_update BEFORE INSERT OR UPDATE ON {table} '
+            f"FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, 'pg_catalog.simple', {column})"
+        )
+        op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+
+    for table, column in reversed(SEARCHABLE):
+        op.drop_index(f'ix_{table}_search_vector', table_name=table)
+        op.execute(f'DROP TRIGGER {table}_search_vector_update ON {table}')
+        op.drop_column(table, 'search_vector')
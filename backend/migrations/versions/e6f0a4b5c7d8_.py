@@ -0,0 +1,31 @@
+"""add version and updated_at to actor and movie
+
+Revision ID: e6f0a4b5c7d8
+Revises: d5e9f3a4b6c7
+Create Date: 2026-10-18 18:02:36.914205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f0a4b5c7d8'
+down_revision = 'd5e9f3a4b6c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can't ALTER TABLE ... ADD a column whose default isn't a constant, so it copies the table
+    recreate = 'always' if op.get_context().dialect.name == 'sqlite' else 'auto'
+    for table in ('actor', 'movie'):
+        with op.batch_alter_table(table, recreate=recreate) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+
+
+def downgrade():
+    for table in ('movie', 'actor'):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
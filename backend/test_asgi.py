@@ -0,0 +1,262 @@
+import unittest
+import asyncio
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from sqlalchemy.util.queue import Empty
+
+from app.asgi import create_asgi_app
+from app.auth.auth import jwks_store
+from app.auth.jwks import JWKSStore
+from app.concurrency import AsyncQueue, Lock, await_only, greenlet_spawn
+from app.database import AsyncQueuePool, pool_stats
+from app.models import Actor
+from config import Config
+from test_auth import FIRST_JWK, StubJWKSServer
+from test_listing import LocalAuthTestCase
+
+
+class ASGITestCase(LocalAuthTestCase):
+    "The async entry point against the sync app, on one seeded SQLite file"
+
+    def setUp(self):
+        # a file both apps connect to; cached responses would hide the async app's queries
+        handle, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.database_uri = 'sqlite:///' + self.db_path
+        with mock.patch.object(Config, 'RESPONSE_CACHE_BACKEND', 'none'):
+            super().setUp()
+        self.asgi = self.create_asgi_app()
+
+    def tearDown(self):
+        super().tearDown()
+        os.remove(self.db_path)
+
+    def create_asgi_app(self, **settings):
+        "The async app on the test config (and database) of the sync app"
+        settings = dict(self.app.config, **settings)
+        # derived from DB_* by the sync app, they would replace the async engine options
+        del settings['SQLALCHEMY_ENGINE_OPTIONS']
+        return create_asgi_app(type('AsyncTestConfig', (Config,), settings))
+
+    def serve(self, *requests, asgi=None, lifespan=True):
+        '''
+        Run the lifespan startup, then `requests` ((method, path, body)
+        concurrently, then the shutdown, on one event loop. Returns the
+        status, headers, body and number of body messages of each response.
+        '''
+        asgi = asgi or self.asgi
+        headers = [(k.lower().encode(), v.encode()) for k, v in self.producer_headers.items()]
+
+        async def request(method, path, body=b''):
+            path, _, query = path.partition('?')
+            scope = {
+                'type': 'http', 'method': method, 'path': path, 'root_path': '',
+                'query_string': query.encode(), 'http_version': '1.1', 'scheme': 'http',
+                'server': ('testserver', 80), 'client': ('127.0.0.1', 5000), 'headers': headers,
+            }
+            # the body arrives in two parts
+            incoming = [
+                {'type': 'http.request', 'body': body[:5], 'more_body': True},
+                {'type': 'http.request', 'body': body[5:], 'more_body': False},
+            ]
+            sent = []
+
+            async def receive():
+                return incoming.pop(0)
+
+            async def send(message):
+                sent.append(message)
+
+            await asgi(scope, receive, send)
+            start, chunks = sent[0], sent[1:]
+            self.assertEqual(start['type'], 'http.response.start')
+            self.assertFalse(chunks[-1].get('more_body'))
+            return (start['status'], dict(start['headers']),
+                    b''.join(c['body'] for c in chunks), len(chunks))
+
+        async def main():
+            started, stopping = asyncio.Event(), asyncio.Event()
+            pending = ['lifespan.startup']
+
+            async def receive():
+                if pending:
+                    return {'type': pending.pop()}
+                await stopping.wait()
+                return {'type': 'lifespan.shutdown'}
+
+            async def send(message):
+                if message['type'] == 'lifespan.startup.complete':
+                    started.set()
+
+            if lifespan:
+                task = asyncio.get_running_loop().create_task(asgi({'type': 'lifespan'}, receive, send))
+                await started.wait()
+            try:
+                return await asyncio.gather(*(request(*r) for r in requests))
+            finally:
+                if lifespan:
+                    stopping.set()
+                    await task
+                else:
+                    await greenlet_spawn(asgi.shutdown)
+
+        return asyncio.run(main())
+
+    def test_same_responses_as_the_sync_app(self):
+        paths = ['/actors?limit=3&sort=-name', '/movies?page=2&limit=4', '/actors/3',
+                 '/movies/2/cast', '/search?q=actor']
+        responses = self.serve(*(('GET', path) for path in paths))
+
+        for path, (status, headers, body, _) in zip(paths, responses):
+            expected = self.client().get(path, headers=self.producer_headers)
+            self.assertEqual(status, 200, path)
+            self.assertEqual(json.loads(body), json.loads(expected.data), path)
+            self.assertEqual(headers[b'content-type'], b'application/json')
+
+    def test_writes_are_committed(self):
+        body = json.dumps({'name': 'Sandra Bullock', 'birthdate': '1964-07-26', 'gender': 'female'})
+        (status, headers, data, _), = self.serve(('POST', '/actors', body.encode()))
+
+        self.assertEqual(status, 200)
+        added = json.loads(data)['added_actor']
+        self.assertEqual(Actor.query.get(added['id']).name, 'Sandra Bullock')
+
+    def test_error_status(self):
+        (status, _, body, _), = self.serve(('GET', '/actors/999'))
+        self.assertEqual(status, 404)
+        self.assertFalse(json.loads(body)['success'])
+
+    def test_streamed_export_is_sent_in_chunks(self):
+        asgi = self.create_asgi_app(EXPORT_BATCH_SIZE=3)
+        (status, _, body, messages), = self.serve(('GET', '/export/actors'), asgi=asgi)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body.splitlines()), 10)
+        self.assertGreater(messages, 3)
+
+    def test_requests_wait_for_a_pooled_connection_on_the_loop(self):
+        asgi = self.create_asgi_app(DB_POOL_SIZE=1, DB_MAX_OVERFLOW=0)
+        responses = self.serve(*[('GET', '/actors/{}'.format(i % 10 + 1)) for i in range(20)], asgi=asgi)
+
+        self.assertEqual([status for status, _, _, _ in responses], [200] * 20)
+        engine = asgi.app.extensions['sqlalchemy'].db.get_engine(asgi.app)
+        self.assertIsInstance(engine.pool, AsyncQueuePool)
+        stats = pool_stats(engine)
+        self.assertEqual(stats['checkout_timeouts'], 0)
+        self.assertGreater(stats['checkout_max_wait_seconds'], 0)
+
+    def test_first_requests_connect_concurrently(self):
+        # without the lifespan startup, the first connection is made under the requests
+        responses = self.serve(*[('GET', '/actors?limit=2')] * 10, lifespan=False)
+        self.assertEqual([status for status, _, _, _ in responses], [200] * 10)
+
+    def test_jwks_is_fetched_once_on_the_loop(self):
+        stub = StubJWKSServer([FIRST_JWK])
+        try:
+            asgi = self.create_asgi_app(JWKS_URL=stub.url)
+            jwks_store.clear()
+            # the blocking fetch would hold up the loop
+            with mock.patch.object(JWKSStore, 'fetch_blocking', side_effect=AssertionError):
+                responses = self.serve(*[('GET', '/movies/1')] * 10, asgi=asgi, lifespan=False)
+        finally:
+            stub.stop()
+
+        self.assertEqual([status for status, _, _, _ in responses], [200] * 10)
+        self.assertEqual(stub.requests, 1)
+
+    def test_startup_fetches_the_jwks(self):
+        jwks_store.clear()
+        refreshes = jwks_store.refreshes
+        self.serve()
+
+        self.assertEqual(jwks_store.refreshes, refreshes + 1)
+
+
+class ConcurrencyTestCase(unittest.TestCase):
+
+    def run_greenlets(self, *functions):
+        async def main():
+            return await asyncio.gather(*(greenlet_spawn(f) for f in functions))
+        return asyncio.run(main())
+
+    def test_lock_waits_on_the_loop(self):
+        lock = Lock()
+        events = []
+
+        def holder():
+            with lock:
+                events.append('held')
+                # the loop runs the waiter meanwhile, so this can't deadlock
+                await_only(asyncio.sleep(0.05))
+                events.append('released')
+
+        def waiter():
+            await_only(asyncio.sleep(0.01))
+            events.append('waiting')
+            with lock:
+                events.append('acquired')
+
+        self.run_greenlets(holder, waiter)
+        self.assertEqual(events, ['held', 'waiting', 'released', 'acquired'])
+
+    def test_lock_outside_the_loop(self):
+        lock = Lock()
+        self.assertTrue(lock.acquire())
+        self.assertFalse(lock.acquire(False))
+        self.assertFalse(lock.acquire(timeout=0.01))
+        lock.release()
+        self.assertFalse(lock.locked())
+
+    def test_queue_get_waits_for_a_put(self):
+        queue = AsyncQueue(1)
+
+        def consumer():
+            return queue.get(True, 1)
+
+        def producer():
+            await_only(asyncio.sleep(0.02))
+            queue.put('connection')
+
+        self.assertEqual(self.run_greenlets(consumer, producer)[0], 'connection')
+
+    def test_queue_hands_a_put_to_the_waiter(self):
+        queue = AsyncQueue(1)
+
+        def waiter():
+            return queue.get(True, 1)
+
+        def producer():
+            await_only(asyncio.sleep(0.02))
+            queue.put('connection')
+            # a request arriving now doesn't get it
+            with self.assertRaises(Empty):
+                queue.get(False)
+
+        self.assertEqual(self.run_greenlets(waiter, producer)[0], 'connection')
+
+    def test_queue_get_times_out(self):
+        queue = AsyncQueue(1)
+
+        def consumer():
+            started = time.perf_counter()
+            with self.assertRaises(Empty):
+                queue.get(True, 0.05)
+            return time.perf_counter() - started
+
+        self.assertGreaterEqual(self.run_greenlets(consumer)[0], 0.04)
+
+    def test_queue_never_waits_outside_the_loop(self):
+        queue = AsyncQueue(1)
+        with self.assertRaises(Empty):
+            queue.get(True, 10)
+        queue.put('connection')
+        self.assertEqual(queue.get(), 'connection')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,407 @@
+import unittest
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+from app import create_app, db
+from app.auth.auth import (jwks_store, token_cache, verify_decode_jwt, check_permissions,
+                           AuthError, AllOf, AnyOf)
+from app.auth.jwks import JWKSStore, max_age_from_headers
+from app.auth.token_cache import TokenCache
+from config import Config
+
+
+def b64_int(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def make_key(kid):
+    "Generate an RSA keypair; returns the private PEM and the public JWK"
+    key = RSA.generate(2048)
+    public_jwk = {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'alg': 'RS256',
+        'n': b64_int(key.n),
+        'e': b64_int(key.e),
+    }
+    return key.export_key().decode('ascii'), public_jwk
+
+
+def make_token(private_pem, kid, permissions=(), expires_in=3600):
+    now = int(time.time())
+    claims = {
+        'iss': f'https://{Config.AUTH0_DOMAIN}/',
+        'sub': 'auth0|test',
+        'aud': Config.API_AUDIENCE,
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': list(permissions),
+    }
+    return jwt.encode(claims, private_pem, algorithm='RS256', headers={'kid': kid})
+
+
+FIRST_PEM, FIRST_JWK = make_key('first')
+SECOND_PEM, SECOND_JWK = make_key('second')
+
+
+class StubJWKSServer(object):
+    "Serves a mutable key set over HTTP on localhost and counts the requests"
+
+    def __init__(self, keys, cache_control=None):
+        self.keys = keys
+        self.cache_control = cache_control
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                body = json.dumps({'keys': stub.keys}).encode()
+                # give concurrent callers time to pile up behind the fetch
+                time.sleep(0.05)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                if stub.cache_control:
+                    self.send_header('Cache-Control', stub.cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/.well-known/jwks.json'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JWKSStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.write_keys([FIRST_JWK])
+        self.store = JWKSStore('file://' + self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write_keys(self, keys):
+        with open(self.path, 'w') as jwks_file:
+            json.dump({'keys': keys}, jwks_file)
+
+    def test_keys_are_fetched_once(self):
+        for _ in range(5):
+            self.assertIsNotNone(self.store.get_key('first'))
+
+        stats = self.store.stats()
+        self.assertEqual(stats['refreshes'], 1)
+        self.assertEqual(stats['hits'], 5)
+        self.assertEqual(stats['misses'], 0)
+
+    def test_unknown_kid_refetches_after_rotation(self):
+        self.store.min_refetch_interval = 0
+        self.store.get_key('first')
+        self.write_keys([FIRST_JWK, SECOND_JWK])
+
+        self.assertIsNotNone(self.store.get_key('second'))
+        self.assertEqual(self.store.stats()['refreshes'], 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.store.min_refetch_interval = 60
+        self.store.get_key('first')
+
+        self.assertIsNone(self.store.get_key('unknown'))
+        self.assertIsNone(self.store.get_key('unknown'))
+        stats = self.store.stats()
+        self.assertEqual(stats['refreshes'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_max_age_from_headers(self):
+        self.assertEqual(max_age_from_headers({'Cache-Control': 'public, max-age=15'}), 15)
+        self.assertEqual(max_age_from_headers({'Cache-Control': 'no-store'}), 0)
+        self.assertIsNone(max_age_from_headers({}))
+
+
+class JWKSStoreHTTPTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubJWKSServer([FIRST_JWK], cache_control='public, max-age=120')
+        self.store = JWKSStore(self.stub.url, min_ttl=0, min_refetch_interval=0)
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_cache_control_sets_ttl(self):
+        self.store.get_key('first')
+        expires_in = self.store.stats()['expires_in']
+        self.assertTrue(110 < expires_in <= 120)
+
+    def test_concurrent_first_lookups_fetch_once(self):
+        threads = [threading.Thread(target=self.store.get_key, args=('first',)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(self.store.stats()['hits'], 10)
+
+    def test_stale_keys_are_served_when_idp_is_down(self):
+        self.store.get_key('first')
+        self.stub.stop()
+        self.store._expires_at = 0
+
+        self.assertIsNotNone(self.store.get_key('first'))
+        deadline = time.time() + 5
+        while self.store.stats()['refresh_errors'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        stats = self.store.stats()
+        self.assertEqual(stats['refresh_errors'], 1)
+        self.assertEqual(stats['stale_serves'], 1)
+        self.assertIsNotNone(self.store.get_key('first'))
+
+
+class VerifyDecodeJWTTestCase(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as jwks_file:
+            json.dump({'keys': [FIRST_JWK]}, jwks_file)
+
+        class TestConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = 'sqlite://'
+            JWKS_URL = 'file://' + self.path
+
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+        os.remove(self.path)
+
+    def test_verify_with_cached_key(self):
+        token = make_token(FIRST_PEM, 'first', ['get:actors'])
+        payload = verify_decode_jwt(token)
+        self.assertEqual(payload['permissions'], ['get:actors'])
+        self.assertEqual(jwks_store.url, 'file://' + self.path)
+
+    def test_url_defaults_to_the_configured_domain(self):
+        self.app.config.update(JWKS_URL=None, AUTH0_DOMAIN='tenant.example.com')
+        store = JWKSStore()
+        store.init_app(self.app)
+        self.assertEqual(store.url, 'https://tenant.example.com/.well-known/jwks.json')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TokenCache(maxsize=2)
+        exp = time.time() + 60
+        for token in ('a', 'b', 'c'):
+            cache.put(token, {'exp': exp}, frozenset())
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), ({'exp': exp}, frozenset()))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entry_expires_with_token(self):
+        cache = TokenCache()
+        cache.put('expired', {'exp': time.time() - 1}, frozenset())
+        cache.put('no-exp', {}, frozenset())
+
+        self.assertIsNone(cache.get('expired'))
+        self.assertIsNone(cache.get('no-exp'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_disabled_cache(self):
+        cache = TokenCache(enabled=False)
+        cache.put('a', {'exp': time.time() + 60}, frozenset())
+        self.assertIsNone(cache.get('a'))
+
+
+class CachedAuthTestCase(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as jwks_file:
+            json.dump({'keys': [FIRST_JWK]}, jwks_file)
+
+        class TestConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = 'sqlite://'
+            JWKS_URL = 'file://' + self.path
+            AUTH_TOKEN_CACHE_ENABLED = self.cache_enabled
+
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client
+        token_cache.reset_stats()
+
+        self.headers = {
+            "Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', ['get:movies']))
+        }
+
+    cache_enabled = True
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        os.remove(self.path)
+
+    def test_repeated_token_is_verified_once(self):
+        for _ in range(3):
+            res = self.client().get('/movies', headers=self.headers)
+            self.assertEqual(res.status_code, 404)
+
+        stats = token_cache.stats()
+        self.assertEqual(stats['verifications'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_cached_payload_is_still_permission_checked(self):
+        self.client().get('/movies', headers=self.headers)
+        res = self.client().get('/actors', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data.get('success'), False)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+
+
+class UncachedAuthTestCase(CachedAuthTestCase):
+
+    cache_enabled = False
+
+    def test_repeated_token_is_verified_once(self):
+        for _ in range(3):
+            self.client().get('/movies', headers=self.headers)
+
+        stats = token_cache.stats()
+        self.assertEqual(stats['verifications'], 3)
+        self.assertEqual(stats['hits'], 0)
+
+    def test_cached_payload_is_still_permission_checked(self):
+        res = self.client().get('/actors', headers=self.headers)
+        self.assertEqual(res.status_code, 403)
+
+
+class StaticKeysTestCase(unittest.TestCase):
+    "Pinned keys; JWKS_URL points nowhere, so any fetch would fail"
+
+    def create_app(self, **settings):
+        class TestConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = 'sqlite://'
+            JWKS_URL = 'file:///nonexistent/jwks.json'
+
+        for key, value in settings.items():
+            setattr(TestConfig, key, value)
+        app = create_app(TestConfig)
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.addCleanup(self.app_context.pop)
+        jwks_store.reset_stats()
+        return app
+
+    def public_pem(self, private_pem):
+        return RSA.import_key(private_pem).publickey().export_key().decode('ascii')
+
+    def assertVerifies(self, private_pem, kid):
+        payload = verify_decode_jwt(make_token(private_pem, kid, ['get:actors']))
+        self.assertEqual(payload['permissions'], ['get:actors'])
+
+    def test_jwks_json(self):
+        self.create_app(AUTH_PUBLIC_KEYS=json.dumps({'keys': [FIRST_JWK, SECOND_JWK]}))
+        self.assertVerifies(FIRST_PEM, 'first')
+        self.assertVerifies(SECOND_PEM, 'second')
+        self.assertEqual(jwks_store.stats()['refreshes'] + jwks_store.stats()['refresh_errors'], 0)
+
+    def test_pem_file_is_tried_for_any_kid(self):
+        handle, path = tempfile.mkstemp(suffix='.pem')
+        with os.fdopen(handle, 'w') as pem_file:
+            pem_file.write(self.public_pem(SECOND_PEM) + '\n' + self.public_pem(FIRST_PEM))
+        self.addCleanup(os.remove, path)
+        self.create_app(AUTH_PUBLIC_KEYS_FILE=path)
+
+        self.assertVerifies(FIRST_PEM, 'rotated')
+        self.assertVerifies(SECOND_PEM, 'second')
+
+    def test_unknown_kid_of_kid_mapping(self):
+        self.create_app(AUTH_PUBLIC_KEYS=json.dumps({'first': self.public_pem(FIRST_PEM)}))
+        self.assertVerifies(FIRST_PEM, 'first')
+        with self.assertRaises(AuthError) as raised:
+            verify_decode_jwt(make_token(SECOND_PEM, 'second'))
+        self.assertEqual(raised.exception.status_code, 400)
+
+    def test_signature_of_another_key(self):
+        self.create_app(AUTH_PUBLIC_KEYS=self.public_pem(FIRST_PEM))
+        with self.assertRaises(AuthError):
+            verify_decode_jwt(make_token(SECOND_PEM, 'first'))
+
+    def test_audience_comes_from_config(self):
+        self.create_app(AUTH_PUBLIC_KEYS=json.dumps(FIRST_JWK), API_AUDIENCE='another-api')
+        with self.assertRaises(AuthError) as raised:
+            verify_decode_jwt(make_token(FIRST_PEM, 'first'))
+        self.assertEqual(raised.exception.error['status'], 'invalid_claims')
+
+    def test_malformed_keys_fail_at_startup(self):
+        for keys in ('-----BEGIN PUBLIC KEY-----\nnot a key\n-----END PUBLIC KEY-----', '{"keys": []}'):
+            with self.assertRaises(RuntimeError):
+                self.create_app(AUTH_PUBLIC_KEYS=keys)
+
+
+class PermissionRequirementTestCase(unittest.TestCase):
+
+    payload = {'permissions': ['get:actors', 'get:movies', 'patch:actors']}
+
+    def assertForbidden(self, requirement):
+        with self.assertRaises(AuthError) as context:
+            check_permissions(self.payload, requirement)
+        self.assertEqual(context.exception.status_code, 403)
+
+    def test_single_permission(self):
+        self.assertTrue(check_permissions(self.payload, 'get:actors'))
+        self.assertForbidden('delete:actors')
+
+    def test_list_requires_all(self):
+        self.assertTrue(check_permissions(self.payload, ['get:actors', 'get:movies']))
+        self.assertForbidden(['get:actors', 'add:movies'])
+
+    def test_any_of(self):
+        self.assertTrue(check_permissions(self.payload, AnyOf('add:movies', 'patch:actors')))
+        self.assertForbidden(AnyOf('add:movies', 'delete:movies'))
+
+    def test_nested_requirements(self):
+        requirement = AllOf('get:actors', AnyOf('add:movies', 'get:movies'))
+        self.assertTrue(check_permissions(self.payload, requirement))
+        self.assertForbidden(AnyOf('add:movies', AllOf('get:actors', 'delete:actors')))
+
+    def test_missing_permissions_claim(self):
+        with self.assertRaises(AuthError) as context:
+            check_permissions({}, 'get:actors')
+        self.assertEqual(context.exception.status_code, 400)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
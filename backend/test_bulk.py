@@ -0,0 +1,85 @@
+import unittest
+import json
+
+from app.models import Actor, Movie, MovieCast
+from test_auth import FIRST_PEM, make_token
+from test_listing import LocalAuthTestCase
+
+
+class BulkCreateTestCase(LocalAuthTestCase):
+
+    def post(self, url, body):
+        res = self.client().post(url, json=body, headers=self.producer_headers)
+        return res, json.loads(res.data)
+
+    def test_bulk_add_actors(self):
+        actors = [{'name': 'Bulk {}'.format(i), 'birthdate': '1990-01-01', 'gender': 'other'}
+                  for i in range(5)]
+        res, data = self.post('/actors/bulk', actors)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_added'], 5)
+        self.assertEqual([a['index'] for a in data['added_actors']], list(range(5)))
+        self.assertEqual(Actor.query.count(), 15)
+
+    def test_invalid_items_are_reported(self):
+        movies = [
+            {'title': 'Good', 'release_date': '2001-01-01'},
+            {'title': 'Bad date', 'release_date': '01.01.2001'},
+            {'release_date': '2001-01-01'},
+        ]
+        res, data = self.post('/movies/bulk', {'movies': movies})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['total_added'], 1)
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2])
+        self.assertEqual(Movie.query.count(), 11)
+
+    def test_atomic_chunks(self):
+        self.app.config['BULK_CHUNK_SIZE'] = 2
+        movies = [
+            {'title': 'A', 'release_date': '2001-01-01'},
+            {'title': 'B', 'release_date': 'never'},
+            {'title': 'C', 'release_date': '2001-01-01'},
+            {'title': 'D', 'release_date': '2001-01-01'},
+        ]
+        res, data = self.post('/movies/bulk?atomic=true', movies)
+
+        # first chunk is rejected as a whole, second one goes in
+        self.assertEqual([a['index'] for a in data['added_movies']], [2, 3])
+        self.assertEqual([e['index'] for e in data['errors']], [0, 1])
+        self.assertEqual(Movie.query.count(), 12)
+
+    def test_bulk_add_contracts(self):
+        contracts = [
+            {'actor_id': 1, 'movie_id': 1},
+            {'actor_id': 1, 'movie_id': 1},
+            {'actor_id': 2, 'movie_id': 1000},
+            {'actor_id': 3, 'movie_id': 2},
+        ]
+        res, data = self.post('/contracts/bulk', contracts)
+
+        self.assertEqual(data['total_added'], 2)
+        self.assertEqual(data['errors'], [
+            {'index': 1, 'description': 'actor is already booked for this movie'},
+            {'index': 2, 'description': 'movie not found'},
+        ])
+        self.assertEqual(MovieCast.query.count(), 2)
+
+    def test_422_if_body_is_not_a_list(self):
+        res, data = self.post('/actors/bulk', {'name': 'Sandra'})
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_403_without_permission(self):
+        headers = {"Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', ['add:actors']))}
+        res = self.client().post('/movies/bulk', json=[{'title': 'A', 'release_date': '2001-01-01'}],
+                                 headers=headers)
+        self.assertEqual(res.status_code, 403)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
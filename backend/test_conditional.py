@@ -0,0 +1,104 @@
+import unittest
+import json
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+from app.models import Actor, Movie
+from test_listing import LocalAuthTestCase
+
+
+class ConditionalRequestTestCase(LocalAuthTestCase):
+
+    def request(self, method, url, body=None, **headers):
+        headers.update(self.producer_headers)
+        return self.client().open(url, method=method, json=body, headers=headers)
+
+    def test_get_actor(self):
+        res = self.request('GET', '/actors/3')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actor'], Actor.query.get(3).format())
+        self.assertTrue(res.headers['ETag'])
+        self.assertIn('Last-Modified', res.headers)
+
+    def test_get_movie_404(self):
+        res = self.request('GET', '/movies/1000')
+        self.assertEqual(res.status_code, 404)
+
+    def test_304_until_modified(self):
+        etag = self.request('GET', '/movies/2').headers['ETag']
+        res = self.request('GET', '/movies/2', **{'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        self.request('PATCH', '/movies/2', {'title': 'Speed'})
+        res = self.request('GET', '/movies/2', **{'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_patch_with_matching_if_match(self):
+        etag = self.request('GET', '/actors/2').headers['ETag']
+        res = self.request('PATCH', '/actors/2', {'name': 'Sandra'}, **{'If-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['ETag'], self.request('GET', '/actors/2').headers['ETag'])
+        self.assertEqual(Actor.query.get(2).version, 2)
+
+    def test_412_for_stale_if_match(self):
+        etag = self.request('GET', '/movies/4').headers['ETag']
+        self.request('PATCH', '/movies/4', {'title': 'First'})
+        res = self.request('PATCH', '/movies/4', {'title': 'Second'}, **{'If-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 412)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(Movie.query.get(4).title, 'First')
+
+    def test_patch_response_is_the_updated_row(self):
+        before = Movie.query.get(3).updated_at
+        db.session.remove()
+        res = self.request('PATCH', '/movies/3', {'release_date': '2001-02-03'})
+        data = json.loads(res.data)
+        movie = Movie.query.get(3)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated_movie'], {
+            'id': 3, 'title': movie.title, 'release_date': 'Sat, 03 Feb 2001 00:00:00 GMT'})
+        self.assertEqual(movie.version, 2)
+        self.assertEqual(res.headers['ETag'], '"movie-3-2"')
+        self.assertGreaterEqual(movie.updated_at, before)
+
+    def test_if_match_any_version(self):
+        res = self.request('PATCH', '/actors/6', {'gender': 'other'}, **{'If-Match': '*'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated_actor']['gender'], 'other')
+
+    def test_if_match_for_a_missing_row_is_404(self):
+        res = self.request('PATCH', '/actors/1000', {'name': 'Nobody'}, **{'If-Match': '"actor-1000-1-20200101"'})
+        self.assertEqual(res.status_code, 404)
+
+    def test_invalid_patch_status_order(self):
+        # the row is checked before the body: 404, then 412, then 422
+        self.assertEqual(self.request('PATCH', '/actors/1000', {}).status_code, 404)
+        self.assertEqual(self.request('PATCH', '/movies/1000').status_code, 404)
+        self.assertEqual(self.request('PATCH', '/movies/5', {}, **{'If-Match': '"movie-5-7"'}).status_code, 412)
+        self.assertEqual(self.request('PATCH', '/movies/5', {'title': ''}).status_code, 422)
+        self.assertEqual(self.request('PATCH', '/actors/5', {}, **{'If-Match': '*'}).status_code, 422)
+
+    def test_concurrent_update_is_detected(self):
+        actor = Actor.query.get(5)
+        # another writer updates the row after it was read
+        db.session.execute(Actor.__table__.update().where(Actor.id == 5).values(version=Actor.version + 1))
+        actor.name = 'Lost update'
+        with self.assertRaises(StaleDataError):
+            db.session.commit()
+        db.session.rollback()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import json
+
+from app.models import MovieCast
+from test_listing import LocalAuthTestCase
+
+
+class ContractBookingTestCase(LocalAuthTestCase):
+
+    def book(self, actor_id, movie_id):
+        res = self.client().post('/contracts', json={'actor_id': actor_id, 'movie_id': movie_id},
+                                 headers=self.producer_headers)
+        return res, json.loads(res.data)
+
+    def test_add_contract(self):
+        res, data = self.book(2, 3)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['added_contract']['actor_id'], 2)
+        self.assertEqual(data['added_contract']['movie_id'], 3)
+        contract = MovieCast.query.get(data['added_contract']['id'])
+        self.assertEqual((contract.actor_id, contract.movie_id), (2, 3))
+
+    def test_409_if_already_booked(self):
+        self.book(2, 3)
+        res, data = self.book(2, 3)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(MovieCast.query.count(), 1)
+
+    def test_404_if_actor_or_movie_missing(self):
+        res, data = self.book(1000, 1)
+        self.assertEqual(res.status_code, 404)
+        res, data = self.book(1, 1000)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(MovieCast.query.count(), 0)
+
+    def test_422_if_ids_are_not_numbers(self):
+        res, data = self.book('one', 1)
+        self.assertEqual(res.status_code, 422)
+
+    def test_422_if_ids_are_not_integers(self):
+        for actor_id in (2.5, True, '2'):
+            res, data = self.book(actor_id, 3)
+            self.assertEqual(res.status_code, 422)
+        self.assertEqual(MovieCast.query.count(), 0)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import json
+import os
+from datetime import date
+
+from app import db
+from app.counters import counters, get_store
+from app.models import Actor, Movie, Gender
+from test_listing import LocalAuthTestCase
+from test_metrics import sample
+
+
+class CountersTestCase(LocalAuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        counters.reset_stats()
+        # the first read counts, later ones come from the counter
+        self.assertEqual(counters.total(Actor), 10)
+        self.assertEqual(counters.total(Movie), 10)
+
+    def test_delete_reads_the_counter(self):
+        res = self.client().delete('/actors/1', headers=self.producer_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['total_actors'], 9)
+        self.assertEqual(counters.reconciliations, 2)
+
+    def test_inserts_are_counted(self):
+        self.client().post('/movies', json={'title': 'Gravity', 'release_date': '2013-10-04'},
+                           headers=self.producer_headers)
+        self.client().post('/movies/bulk', json=[{'title': 'Speed', 'release_date': '1994-06-10'}] * 3,
+                           headers=self.producer_headers)
+
+        res = self.client().get('/movies', headers=self.producer_headers)
+        self.assertEqual(json.loads(res.data)['total_movies'], 14)
+        self.assertEqual(counters.reconciliations, 2)
+
+    def test_rolled_back_writes_are_not_counted(self):
+        db.session.add(Actor(name='Ghost', birthdate=date(1990, 1, 1), gender=Gender.other))
+        db.session.delete(Movie.query.get(1))
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertEqual(counters.total(Actor), 10)
+        self.assertEqual(counters.total(Movie), 10)
+
+    def test_drift_is_reconciled_and_reported(self):
+        # raw SQL bypasses the session events
+        db.session.execute(Movie.__table__.delete().where(Movie.id > 7))
+        db.session.commit()
+        self.assertEqual(counters.total(Movie), 10)
+
+        counters.reconcile_interval = 0
+        self.assertEqual(counters.total(Movie), 7)
+        report = counters.report()['tables']['movie']
+        self.assertEqual(report['last_drift'], 3)
+        self.assertEqual(report['max_abs_drift'], 3)
+        self.assertEqual(report['count'], 7)
+
+        text = self.client().get('/metrics').data.decode()
+        labels = {'pid': str(os.getpid()), 'table': 'movie'}
+        self.assertEqual(sample(text, 'table_count_last_drift', **labels), 3)
+        self.assertEqual(sample(text, 'table_count_mean_abs_drift', **labels), 3)
+        self.assertIsNone(sample(text, 'table_count_last_drift', pid=labels['pid'], table='actor'))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(RuntimeError):
+            get_store('memcached')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
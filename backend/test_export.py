@@ -0,0 +1,42 @@
+import unittest
+import csv
+import io
+import json
+
+from test_auth import FIRST_PEM, make_token
+from test_listing import LocalAuthTestCase
+
+
+class ExportTestCase(LocalAuthTestCase):
+
+    def test_export_actors_ndjson(self):
+        res = self.client().get('/export/actors', headers=self.producer_headers)
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0], {'id': 1, 'name': 'Actor 9', 'birthdate': '1980-01-01', 'gender': 'male'})
+
+    def test_export_movies_csv_in_small_batches(self):
+        self.app.config['EXPORT_BATCH_SIZE'] = 3
+        res = self.client().get('/export/movies?format=csv', headers=self.producer_headers)
+        rows = list(csv.DictReader(io.StringIO(res.data.decode())))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[-1], {'id': '10', 'title': 'Movie 0', 'release_date': '2009-06-01'})
+
+    def test_422_unknown_format(self):
+        res = self.client().get('/export/movies?format=xml', headers=self.producer_headers)
+        self.assertEqual(res.status_code, 422)
+
+    def test_403_without_permission(self):
+        headers = {"Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', ['get:movies']))}
+        res = self.client().get('/export/actors', headers=headers)
+        self.assertEqual(res.status_code, 403)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
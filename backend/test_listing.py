@@ -0,0 +1,332 @@
+import unittest
+import json
+import os
+import tempfile
+from unittest import mock
+from urllib.parse import quote
+from datetime import date
+
+from app import create_app, db
+from app.models import Actor, Movie, MovieCast, Gender, age_bounds, calculate_age
+from app.main.pagination import clear_count_cache, encode_cursor, _count_cache
+from app.main.response_cache import response_cache
+from app.serialization import get_dumps, orjson
+from flask import jsonify
+from config import Config
+from test_auth import FIRST_PEM, FIRST_JWK, make_token
+
+PRODUCER_PERMISSIONS = [
+    'add:actors', 'add:contracts', 'add:movies', 'delete:actors', 'delete:movies',
+    'get:actors', 'get:movies', 'patch:actors', 'patch:movies',
+]
+
+
+class LocalAuthTestCase(unittest.TestCase):
+    "Seeded database, authenticated with tokens signed by a local key"
+
+    database_uri = 'sqlite://'
+
+    def setUp(self):
+        handle, self.jwks_path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as jwks_file:
+            json.dump({'keys': [FIRST_JWK]}, jwks_file)
+
+        class TestConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = self.database_uri
+            JWKS_URL = 'file://' + self.jwks_path
+
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client
+
+        self.producer_headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', PRODUCER_PERMISSIONS))
+        }
+
+        # insert mock data to test on; names sort in reverse insertion order
+        for i in range(10):
+            db.session.add(Actor(name='Actor {}'.format(9 - i), birthdate=date(1980 + i, 1, 1),
+                                 gender=Gender.female if i % 2 else Gender.male))
+            db.session.add(Movie(title='Movie {}'.format(9 - i), release_date=date(2000 + i, 6, 1)))
+        db.session.commit()
+
+    def tearDown(self):
+        clear_count_cache()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        os.remove(self.jwks_path)
+
+    def get(self, url):
+        res = self.client().get(url, headers=self.producer_headers)
+        return res, json.loads(res.data)
+
+
+class ListingTestCase(LocalAuthTestCase):
+
+
+############# Offset pagination
+
+    def test_pages_are_sliced_by_the_database(self):
+        res, data = self.get('/actors?page=2&limit=4')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([a['name'] for a in data['actors']],
+                         ['Actor 4', 'Actor 5', 'Actor 6', 'Actor 7'])
+        self.assertEqual(data['total_actors'], 10)
+
+    def test_last_partial_page(self):
+        res, data = self.get('/movies?page=2&limit=7')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['movies']), 3)
+        self.assertEqual(data['total_movies'], 10)
+
+    def test_404_beyond_last_page(self):
+        res, data = self.get('/movies?page=3&limit=7')
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_404_for_invalid_page(self):
+        res, data = self.get('/actors?page=0')
+        self.assertEqual(res.status_code, 404)
+
+    @mock.patch.object(response_cache, 'backend', None)
+    def test_cached_filtered_total(self):
+        self.app.config['PAGINATE_COUNT_CACHE_TTL'] = 60
+        self.get('/movies?title=movie')
+        db.session.add(Movie(title='Movie 10', release_date=date(2020, 1, 1)))
+        db.session.commit()
+
+        res, data = self.get('/movies?title=movie')
+        self.assertEqual(data['total_movies'], 10)
+        clear_count_cache()
+        res, data = self.get('/movies?title=movie')
+        self.assertEqual(data['total_movies'], 11)
+
+    @mock.patch.object(response_cache, 'backend', None)
+    def test_count_cache_is_bounded(self):
+        self.app.config['PAGINATE_COUNT_CACHE_TTL'] = 60
+        self.app.config['PAGINATE_COUNT_CACHE_SIZE'] = 3
+        for title in ('movie 1', 'movie 2', 'movie 3', 'movie 4'):
+            self.get('/movies?title=' + quote(title))
+        self.assertEqual(len(_count_cache), 3)
+
+        # the oldest total was evicted, so it is counted again
+        db.session.add(Movie(title='Movie 10', release_date=date(2020, 1, 1)))
+        db.session.commit()
+        res, data = self.get('/movies?title=' + quote('movie 1'))
+        self.assertEqual(data['total_movies'], 2)
+
+    def test_json_backends_match_jsonify(self):
+        expected = jsonify({
+            'success': True,
+            'movies': [m.format() for m in Movie.query.order_by(Movie.title, Movie.id).limit(7)],
+            'total_movies': 10
+        }).data
+        backends = ['stdlib', 'orjson'] if orjson is not None else ['stdlib']
+        for backend in backends:
+            self.app.extensions['json_dumps'] = get_dumps(backend)
+            res = self.client().get('/movies', headers=self.producer_headers)
+            self.assertEqual(res.data, expected, backend)
+
+    @mock.patch.object(response_cache, 'backend', None)
+    def test_json_backends_with_non_ascii_names(self):
+        db.session.add(Actor(name='Zoë Ångström', birthdate=date(1990, 1, 1), gender=Gender.female))
+        db.session.commit()
+        url = '/actors?name=Zo%C3%AB'
+        self.app.extensions['json_dumps'] = get_dumps('stdlib')
+        stdlib = self.client().get(url, headers=self.producer_headers).data
+        self.assertIn(b'Zo\\u00eb \\u00c5ngstr\\u00f6m', stdlib)
+
+        if orjson is not None:
+            self.app.extensions['json_dumps'] = get_dumps('orjson')
+            res = self.client().get(url, headers=self.producer_headers)
+            self.assertIn('Zoë Ångström'.encode('utf-8'), res.data)
+            self.assertEqual(json.loads(res.data), json.loads(stdlib))
+
+
+############# Age
+
+    def test_age_range_filter(self):
+        today = date.today()
+        for name, age in (('Young', 20), ('Old', 70)):
+            born = date(today.year - age, today.month, min(today.day, 28))
+            db.session.add(Actor(name=name, birthdate=born, gender=Gender.other))
+        db.session.commit()
+
+        res, data = self.get('/actors?min_age=19&max_age=20')
+        self.assertEqual([(a['name'], a['age']) for a in data['actors']], [('Young', 20)])
+        self.assertEqual(data['total_actors'], 1)
+        res, data = self.get('/actors?min_age=70')
+        self.assertEqual([a['name'] for a in data['actors']], ['Old'])
+
+    def test_422_malformed_age(self):
+        res, data = self.get('/actors?min_age=old')
+        self.assertEqual(res.status_code, 422)
+
+    def test_age_bounds_match_calculate_age(self):
+        today = date(2024, 2, 29)
+        births = [date(2000, 2, 28), date(2000, 2, 29), date(2000, 3, 1), date(2003, 2, 28),
+                  date(2004, 3, 1), date(2023, 2, 28), date(2023, 3, 1)]
+        for min_age, max_age in ((0, 0), (1, 1), (20, 23), (24, 24), (None, 20), (21, None)):
+            earliest, latest = age_bounds(min_age, max_age, today)
+            for born in births:
+                age = calculate_age(born, today)
+                expected = (min_age is None or age >= min_age) and (max_age is None or age <= max_age)
+                in_range = (latest is None or born <= latest) and (earliest is None or born > earliest)
+                self.assertEqual(in_range, expected, (born, min_age, max_age))
+
+
+############# Filters and sort order
+
+    def names(self, url):
+        res, data = self.get(url)
+        self.assertEqual(res.status_code, 200, url)
+        return [a['name'] for a in data['actors']]
+
+    def test_name_prefix_and_substring(self):
+        for name in ('Sandra Bullock', 'Sandy 100%', 'Tom Hanks'):
+            db.session.add(Actor(name=name, birthdate=date(1970, 1, 1), gender=Gender.other))
+        db.session.commit()
+
+        self.assertEqual(self.names('/actors?name=sand'), ['Sandra Bullock', 'Sandy 100%'])
+        self.assertEqual(self.names('/actors?name_contains=BULL'), ['Sandra Bullock'])
+        # wildcards in the value are matched literally
+        self.assertEqual(self.names('/actors?name_contains=0%25'), ['Sandy 100%'])
+        res, data = self.get('/actors?name=_')
+        self.assertEqual(res.status_code, 404)
+
+    def test_gender_and_birthdate_range(self):
+        res, data = self.get('/actors?gender=female&limit=10')
+        self.assertEqual(data['total_actors'], 5)
+        self.assertEqual({a['gender'] for a in data['actors']}, {'female'})
+
+        # ids 3, 4 and 5 are born in 1982, 1983 and 1984
+        self.assertEqual(self.names('/actors?birthdate_from=1982-01-01&birthdate_to=1984-01-01'),
+                         ['Actor 5', 'Actor 6', 'Actor 7'])
+
+    def test_release_date_range_and_title(self):
+        res, data = self.get('/movies?release_date_from=2008-01-01&title=movie')
+        self.assertEqual([m['title'] for m in data['movies']], ['Movie 0', 'Movie 1'])
+
+    def test_422_for_invalid_filters(self):
+        for url in ('/actors?gender=robot', '/actors?birthdate_from=yesterday',
+                    '/actors?sort=height', '/movies?sort=-name'):
+            res, data = self.get(url)
+            self.assertEqual(res.status_code, 422, url)
+
+    def test_sort_orders(self):
+        self.assertEqual(self.names('/actors?sort=-name&limit=2'), ['Actor 9', 'Actor 8'])
+        # 'Actor 0' is born last
+        self.assertEqual(self.names('/actors?sort=age&limit=2'), ['Actor 0', 'Actor 1'])
+        self.assertEqual(self.names('/actors?sort=-age&limit=2'), ['Actor 9', 'Actor 8'])
+
+    def test_cursor_with_descending_date_sort(self):
+        titles = []
+        res, data = self.get('/movies?sort=-release_date&cursor=&limit=4')
+        while True:
+            titles += [m['title'] for m in data['movies']]
+            if not data['next_cursor']:
+                break
+            res, data = self.get('/movies?sort=-release_date&limit=4&cursor=' + data['next_cursor'])
+
+        self.assertEqual(titles, ['Movie {}'.format(i) for i in range(10)])
+
+
+############# Keyset pagination
+
+    def test_cursor_walks_all_rows(self):
+        names = []
+        res, data = self.get('/actors?cursor=&limit=4')
+        while True:
+            self.assertEqual(res.status_code, 200)
+            names += [a['name'] for a in data['actors']]
+            if not data['next_cursor']:
+                break
+            res, data = self.get('/actors?limit=4&cursor=' + data['next_cursor'])
+
+        self.assertEqual(names, ['Actor {}'.format(i) for i in range(10)])
+        self.assertEqual(data['total_actors'], 10)
+
+    def test_cursor_matches_page(self):
+        res, first = self.get('/movies?cursor=&limit=3')
+        res, second = self.get('/movies?limit=3&cursor=' + first['next_cursor'])
+        res, page = self.get('/movies?page=2&limit=3')
+
+        self.assertEqual(second['movies'], page['movies'])
+        self.assertNotIn('next_cursor', page)
+
+    def test_422_for_invalid_cursor(self):
+        res, data = self.get('/movies?cursor=not-a-cursor')
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_422_for_cursor_values_of_the_wrong_type(self):
+        for url, values in (('/movies?sort=release_date&cursor=', [20200101, 3]),
+                            ('/movies?cursor=', ['Movie 1', '3']),
+                            ('/movies?cursor=', [['Movie 1'], 3]),
+                            ('/actors?sort=age&cursor=', ['1990-01-01', True]),
+                            ('/actors?cursor=', [None, 3])):
+            res, data = self.get(url + encode_cursor(values))
+            self.assertEqual(res.status_code, 422, values)
+
+
+############# Cast and filmography
+
+    def book(self, *pairs):
+        for actor_id, movie_id in pairs:
+            db.session.add(MovieCast(actor_id=actor_id, movie_id=movie_id))
+        db.session.commit()
+
+    def test_get_movie_cast(self):
+        # actor 10 is 'Actor 0', actor 1 is 'Actor 9'
+        self.book((1, 5), (10, 5), (3, 6))
+        res, data = self.get('/movies/5/cast')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([a['name'] for a in data['cast']], ['Actor 0', 'Actor 9'])
+        self.assertEqual(data['total_cast'], 2)
+        self.assertEqual(data['movie']['id'], 5)
+
+    def test_get_actor_movies(self):
+        self.book((2, 3), (2, 1), (4, 1))
+        res, data = self.get('/actors/2/movies?limit=1&page=2')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([m['id'] for m in data['movies']], [3])
+        self.assertEqual(data['total_movies'], 2)
+
+    def test_cast_of_unknown_movie(self):
+        res, data = self.get('/movies/1000/cast')
+        self.assertEqual(res.status_code, 404)
+
+    def test_include_cast(self):
+        self.book((1, 10), (10, 10))
+        res, data = self.get('/movies?limit=2&include=cast')
+
+        # 'Movie 0' (id 10) sorts first
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([a['id'] for a in data['movies'][0]['cast']], [10, 1])
+        self.assertEqual(data['movies'][1]['cast'], [])
+
+    def test_include_movies(self):
+        self.book((10, 2))
+        res, data = self.get('/actors?cursor=&limit=1&include=movies')
+        self.assertEqual([m['id'] for m in data['actors'][0]['movies']], [2])
+
+    def test_include_needs_permission(self):
+        headers = {"Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', ['get:movies']))}
+        res = self.client().get('/movies?include=cast', headers=headers)
+        self.assertEqual(res.status_code, 403)
+        res = self.client().get('/movies', headers=headers)
+        self.assertEqual(res.status_code, 200)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import unittest
+import os
+import re
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from app.auth.auth import jwks_store, token_cache
+from app.metrics import Metrics, metrics
+from test_listing import LocalAuthTestCase
+
+
+def sample(text, name, **labels):
+    "Value of the sample `name` with exactly `labels`, or None"
+    wanted = ','.join('{}="{}"'.format(key, value) for key, value in labels.items())
+    match = re.search(r'^{}\{{{}\}} (\S+)$'.format(re.escape(name), re.escape(wanted)), text, re.M)
+    return float(match.group(1)) if match else None
+
+
+class MetricsTestCase(LocalAuthTestCase):
+
+    def scrape(self):
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return res.data.decode()
+
+    def test_latency_and_status_per_endpoint(self):
+        for _ in range(3):
+            self.get('/actors')
+        self.get('/actors/1000')
+        text = self.scrape()
+
+        self.assertEqual(sample(text, 'http_request_duration_seconds_count',
+                                endpoint='main.get_all_actors', method='GET'), 3)
+        self.assertEqual(sample(text, 'http_request_duration_seconds_bucket',
+                                endpoint='main.get_all_actors', method='GET', le='+Inf'), 3)
+        self.assertEqual(sample(text, 'http_requests_total',
+                                endpoint='main.get_actor', method='GET', status='404'), 1)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+
+    def test_phases_and_queries(self):
+        self.get('/movies?title=movie')
+        text = self.scrape()
+        endpoint = 'main.get_all_movies'
+
+        for phase in ('auth', 'db', 'serialization'):
+            self.assertEqual(sample(text, 'http_request_phase_seconds_count', endpoint=endpoint, phase=phase), 1)
+            self.assertGreater(sample(text, 'http_request_phase_seconds_sum', endpoint=endpoint, phase=phase), 0)
+        # the page and the COUNT of the filtered total
+        self.assertEqual(sample(text, 'http_request_db_queries_sum', endpoint=endpoint), 2)
+
+    def test_jwks_fetch_duration(self):
+        jwks_store.clear()
+        self.get('/movies')
+        self.assertEqual(sample(self.scrape(), 'jwks_fetch_duration_seconds_count', result='ok'), 1)
+
+    def test_jwks_store_per_process(self):
+        jwks_store.clear()
+        jwks_store.reset_stats()
+        token_cache.clear()
+        self.get('/movies')
+        text = self.scrape()
+        pid = str(os.getpid())
+
+        self.assertEqual(sample(text, 'jwks_key_lookups_total', pid=pid, result='hit'), 1)
+        self.assertEqual(sample(text, 'jwks_refreshes_total', pid=pid, result='ok'), 1)
+        self.assertEqual(sample(text, 'jwks_keys', pid=pid), 1)
+        self.assertGreater(sample(text, 'jwks_expires_in_seconds', pid=pid), 0)
+
+    def test_token_cache_per_process(self):
+        token_cache.clear()
+        token_cache.reset_stats()
+        for _ in range(3):
+            self.get('/movies')
+        text = self.scrape()
+        pid = str(os.getpid())
+
+        self.assertEqual(sample(text, 'auth_token_cache_lookups_total', pid=pid, result='hit'), 2)
+        self.assertEqual(sample(text, 'auth_token_verifications_total', pid=pid), 1)
+        self.assertGreater(sample(text, 'auth_token_cache_saved_seconds', pid=pid), 0)
+
+    def test_unmatched_urls_share_a_label(self):
+        self.client().get('/nowhere')
+        self.client().get('/elsewhere')
+        self.assertEqual(sample(self.scrape(), 'http_requests_total',
+                                endpoint='unmatched', method='GET', status='404'), 2)
+
+
+class MultiprocessMetricsTestCase(LocalAuthTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        super().setUp()
+        metrics.directory = self.directory
+        metrics.reset()
+
+    def tearDown(self):
+        super().tearDown()
+        metrics.directory = None
+        shutil.rmtree(self.directory)
+
+    def other_process(self, pid, requests):
+        "The metrics file of another worker, which answered `requests` GET /movies"
+        with mock.patch('os.getpid', return_value=pid):
+            other = Metrics(self.directory)
+        labels = (('endpoint', 'main.get_all_movies'), ('method', 'GET'))
+        for _ in range(requests):
+            other.observe('http_request_duration_seconds', labels, 20.0)
+            other.inc('http_requests_total', labels + (('status', '200'),))
+        other.flush()
+
+    def test_scrape_sums_all_processes(self):
+        self.other_process(1, 2)
+        self.other_process(2, 5)
+        self.get('/movies')
+        text = self.client().get('/metrics').data.decode()
+
+        self.assertEqual(sample(text, 'http_requests_total',
+                                endpoint='main.get_all_movies', method='GET', status='200'), 8)
+        self.assertEqual(sample(text, 'http_request_duration_seconds_bucket',
+                                endpoint='main.get_all_movies', method='GET', le='10.0'), 1)
+
+    def test_restarted_pid_continues_from_its_file(self):
+        self.get('/movies')
+        metrics.flush()
+        metrics.reset()
+        self.get('/movies')
+        text = self.client().get('/metrics').data.decode()
+
+        self.assertEqual(sample(text, 'http_requests_total',
+                                endpoint='main.get_all_movies', method='GET', status='200'), 2)
+
+    def test_concurrent_flushes(self):
+        metrics.flush_interval = 0
+        self.addCleanup(setattr, metrics, 'flush_interval', self.app.config['METRICS_FLUSH_INTERVAL'])
+        errors = []
+
+        def flush():
+            for _ in range(100):
+                try:
+                    metrics.maybe_flush()
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=flush) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.directory), ['metrics-{}.json'.format(os.getpid())])
+
+    def test_write_errors_dont_fail_the_request(self):
+        metrics.flush_interval = 0
+        self.addCleanup(setattr, metrics, 'flush_interval', self.app.config['METRICS_FLUSH_INTERVAL'])
+        metrics.directory = os.path.join(self.directory, 'missing')
+        with self.assertLogs('app.metrics', 'WARNING'):
+            res, _ = self.get('/movies')
+        self.assertEqual(res.status_code, 200)
+
+    def test_forked_worker_drops_the_parents_values(self):
+        self.get('/movies')
+        with mock.patch('app.metrics.os.getpid', return_value=99999):
+            self.get('/movies')
+            values = metrics.collect()
+
+        key = ('http_requests_total', (('endpoint', 'main.get_all_movies'), ('method', 'GET'), ('status', '200')))
+        # the parent's file has 1 (flushed on its first request), the child 1 of its own
+        self.assertEqual(values[key], 2)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import datetime
+import unittest
+from unittest import mock
+
+from app import db
+from app.counters import counters
+from app.helpers import supports_returning
+from app.main.response_cache import response_cache
+from app.models import Actor, Movie, MovieCast
+from app.query_budget import QueryCounter, query_budget, normalize
+from test_listing import LocalAuthTestCase
+
+
+class QueryCounterTestCase(LocalAuthTestCase):
+
+    def test_counts_statements(self):
+        with QueryCounter() as queries:
+            Actor.query.filter(Actor.id == 1).first()
+            db.session.query(Movie.id).filter(Movie.id.in_([1, 2, 3])).all()
+        self.assertEqual(queries.count, 2)
+
+    def test_lazy_load_in_a_loop_is_repeated(self):
+        with QueryCounter() as queries:
+            for actor in Actor.query.order_by(Actor.id).limit(3):
+                actor.movies
+        repeated = queries.repeated()
+        self.assertEqual(list(repeated.values()), [3])
+
+    def test_in_lists_of_any_length_are_alike(self):
+        self.assertEqual(normalize('SELECT a FROM t WHERE id IN (?, ?)'),
+                         normalize('SELECT a\n  FROM t WHERE id IN (?, ?, ?)'))
+
+    def test_whole_table_read(self):
+        with QueryCounter() as queries:
+            Actor.query.all()
+            db.session.query(db.func.count(Actor.id)).scalar()
+            Actor.query.limit(5).all()
+        self.assertEqual(len(queries.unbounded()), 1)
+
+    def test_budget_as_decorator(self):
+        @query_budget(1)
+        def two_queries():
+            Actor.query.get(1)
+            Movie.query.get(1)
+
+        with self.assertRaises(AssertionError) as raised:
+            two_queries()
+        self.assertIn('2 statements, the budget is 1', str(raised.exception))
+
+    def test_budget_flags_n_plus_one(self):
+        with self.assertRaises(AssertionError) as raised:
+            with query_budget(10):
+                for movie in Movie.query.order_by(Movie.id).limit(2):
+                    movie.cast
+        self.assertIn('N+1', str(raised.exception))
+
+
+@mock.patch.object(response_cache, 'backend', None)
+class RouteBudgetTestCase(LocalAuthTestCase):
+    '''
+    Statements per request of every route of app/main/routes.py, with the
+    table counts already known (counters) and the response cache off.
+    Authentication doesn't query the database.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        for actor_id, movie_id in ((1, 1), (2, 1), (3, 1), (1, 2), (2, 3)):
+            db.session.add(MovieCast(actor_id=actor_id, movie_id=movie_id))
+        db.session.commit()
+        counters.total(Actor)
+        counters.total(Movie)
+        db.session.remove()
+
+    def request(self, budget, method, url, status=200, allow_repeats=False, **headers):
+        json = headers.pop('json', None)
+        headers.update(self.producer_headers)
+        with query_budget(budget, allow_repeats=allow_repeats):
+            res = self.client().open(url, method=method, json=json, headers=headers)
+        self.assertEqual(res.status_code, status, url)
+        return res
+
+    def bulk_insert(self, rows):
+        "Statements and repeats of inserting `rows` rows: a single INSERT with RETURNING, else one per row"
+        if supports_returning(db.engine.dialect):
+            return 1, False
+        return rows, True
+
+    def update(self):
+        "Statements of a PATCH: UPDATE ... RETURNING, else the UPDATE and a SELECT of the row"
+        return 1 if supports_returning(db.engine.dialect) else 2
+
+    def test_index(self):
+        self.request(0, 'GET', '/')
+        self.request(0, 'GET', '/callback')
+
+    def test_get_actors(self):
+        self.request(1, 'GET', '/actors')
+        self.request(1, 'GET', '/actors?cursor=&limit=3&sort=-age')
+        # the filtered total is a COUNT
+        self.request(2, 'GET', '/actors?name=actor&min_age=30')
+        # the movies of the whole page in one query
+        self.request(2, 'GET', '/actors?include=movies')
+
+    def test_get_actor(self):
+        self.request(1, 'GET', '/actors/1')
+        self.request(1, 'GET', '/actors/1000', status=404)
+
+    def test_get_actor_movies(self):
+        self.request(3, 'GET', '/actors/1/movies')
+
+    def test_add_actor(self):
+        self.request(2, 'POST', '/actors', json={'name': 'New', 'birthdate': '1990-01-01', 'gender': 'male'})
+
+    def test_add_actors_bulk(self):
+        items = [{'name': f'New {i}', 'birthdate': '1990-01-01', 'gender': 'male'} for i in range(20)]
+        inserts, repeats = self.bulk_insert(len(items))
+        self.request(inserts, 'POST', '/actors/bulk', json=items, allow_repeats=repeats)
+
+    def test_update_actor(self):
+        self.request(self.update(), 'PATCH', '/actors/1', json={'name': 'Renamed'})
+        # nothing updated, then: does the actor exist?
+        stale = '"actor-1-1-{}"'.format(datetime.date.today().strftime('%Y%m%d'))
+        self.request(2, 'PATCH', '/actors/1', json={'name': 'Again'}, status=412, **{'If-Match': stale})
+
+    def test_delete_actor(self):
+        self.request(3, 'DELETE', '/actors/10')
+
+    def test_get_movies(self):
+        self.request(1, 'GET', '/movies')
+        self.request(2, 'GET', '/movies?title=movie&release_date_from=2001-01-01')
+        self.request(2, 'GET', '/movies?include=cast')
+
+    def test_get_movie(self):
+        self.request(1, 'GET', '/movies/1')
+
+    def test_get_movie_cast(self):
+        self.request(3, 'GET', '/movies/1/cast')
+
+    def test_add_movie(self):
+        self.request(2, 'POST', '/movies', json={'title': 'New', 'release_date': '2021-01-01'})
+
+    def test_add_movies_bulk(self):
+        items = [{'title': f'New {i}', 'release_date': '2021-01-01'} for i in range(20)]
+        inserts, repeats = self.bulk_insert(len(items))
+        self.request(inserts, 'POST', '/movies/bulk', json=items, allow_repeats=repeats)
+
+    def test_update_movie(self):
+        self.request(self.update(), 'PATCH', '/movies/1', json={'title': 'Renamed'})
+        self.request(1, 'PATCH', '/movies/1000', json={'title': 'Renamed'}, status=404)
+
+    def test_delete_movie(self):
+        self.request(3, 'DELETE', '/movies/10')
+
+    def test_add_contract(self):
+        self.request(1, 'POST', '/contracts', json={'actor_id': 5, 'movie_id': 5})
+        # the failed booking is explained by one more query
+        self.request(2, 'POST', '/contracts', json={'actor_id': 5, 'movie_id': 5}, status=409)
+
+    def test_add_contracts_bulk(self):
+        items = [{'actor_id': actor_id, 'movie_id': 4} for actor_id in range(1, 11)]
+        # existing actors, movies and bookings of the chunk, then the INSERT
+        inserts, repeats = self.bulk_insert(len(items))
+        self.request(3 + inserts, 'POST', '/contracts/bulk', json=items, allow_repeats=repeats)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import json
+import os
+import tempfile
+from datetime import date
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+from app import create_app, db
+from app.database import replica_router, replica_reads
+from app.main.response_cache import response_cache, LRUBackend
+from app.models import Actor, Gender
+from config import Config
+from test_auth import FIRST_PEM, FIRST_JWK, make_token
+from test_listing import PRODUCER_PERMISSIONS
+
+
+class ReplicaTestCase(unittest.TestCase):
+    "A primary and two replicas in separate SQLite files; replication is left out"
+
+    selection = 'round_robin'
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        jwks_path = os.path.join(self.tempdir.name, 'jwks.json')
+        with open(jwks_path, 'w') as jwks_file:
+            json.dump({'keys': [FIRST_JWK]}, jwks_file)
+        self.urls = ['sqlite:///' + os.path.join(self.tempdir.name, name + '.db')
+                     for name in ('primary', 'replica_0', 'replica_1')]
+
+        class TestConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = self.urls[0]
+            SQLALCHEMY_BINDS = {'replica_0': self.urls[1], 'replica_1': self.urls[2]}
+            REPLICA_SELECTION = self.selection
+            JWKS_URL = 'file://' + jwks_path
+            RESPONSE_CACHE_BACKEND = 'none'
+
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', PRODUCER_PERMISSIONS))
+        }
+
+        # the same actor id under a different name in each database
+        self.engines = [db.get_engine(self.app)] + replica_router.engines
+        for engine, name in zip(self.engines, ('Primary', 'Replica 0', 'Replica 1')):
+            db.metadata.create_all(bind=engine)
+            engine.execute(Actor.__table__.insert(), name=name, birthdate=date(1980, 1, 1), gender=Gender.other)
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in self.engines:
+            engine.dispose()
+        self.app_context.pop()
+        self.tempdir.cleanup()
+
+    def actor_name(self):
+        res = self.client().get('/actors/1', headers=self.headers)
+        return json.loads(res.data)['actor']['name']
+
+    def test_reads_rotate_over_replicas(self):
+        names = [self.actor_name() for _ in range(4)]
+        self.assertEqual(names, ['Replica 0', 'Replica 1', 'Replica 0', 'Replica 1'])
+
+    def test_writes_go_to_the_primary(self):
+        res = self.client().patch('/actors/1', json={'name': 'Updated'}, headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        names = [row.name for row in self.engines[0].execute('SELECT name FROM actor')]
+        self.assertEqual(names, ['Updated'])
+
+    def test_read_after_write_stays_on_primary(self):
+        @replica_reads
+        def handler():
+            before = db.session.query(Actor.name).scalar()
+            db.session.add(Actor(name='New', birthdate=date(1990, 1, 1), gender=Gender.other))
+            db.session.flush()
+            after = db.session.query(Actor.name).filter(Actor.id == 1).scalar()
+            db.session.rollback()
+            return before, after
+
+        with self.app.test_request_context('/'):
+            self.assertEqual(handler(), ('Replica 0', 'Primary'))
+
+    def unreachable(self):
+        return create_engine('sqlite:///' + os.path.join(self.tempdir.name, 'missing', 'replica.db'))
+
+    def test_unreachable_replica_is_skipped(self):
+        replica_router.engines[0] = self.unreachable()
+        names = {self.actor_name() for _ in range(4)}
+        self.assertEqual(names, {'Replica 1'})
+
+    def test_unreachable_replicas_fall_back_to_primary(self):
+        replica_router.engines = [self.unreachable(), self.unreachable()]
+        self.assertEqual(self.actor_name(), 'Primary')
+
+    def test_cached_responses_are_read_from_the_primary(self):
+        with mock.patch.object(response_cache, 'backend', LRUBackend()):
+            for _ in range(2):
+                res = self.client().get('/actors', headers=self.headers)
+                self.assertEqual([actor['name'] for actor in json.loads(res.data)['actors']], ['Primary'])
+        # uncached, the replicas answer
+        self.assertEqual(self.actor_name(), 'Replica 0')
+
+    def test_search_index_is_built_from_the_primary(self):
+        res = self.client().get('/search?q=primary', headers=self.headers)
+        self.assertEqual([actor['id'] for actor in json.loads(res.data)['actors']], [1])
+        res = self.client().get('/search?q=replica', headers=self.headers)
+        self.assertEqual(json.loads(res.data)['actors'], [])
+
+    def test_handlers_without_replica_reads_use_the_primary(self):
+        with self.app.test_request_context('/'):
+            self.assertEqual(db.session.query(Actor.name).scalar(), 'Primary')
+
+
+class LeastLatencyReplicaTestCase(ReplicaTestCase):
+
+    selection = 'least_latency'
+
+    def setUp(self):
+        super().setUp()
+        # forget the latencies of the seeding, so the inherited tests start from Replica 0
+        replica_router._latency.clear()
+
+    def test_reads_rotate_over_replicas(self):
+        replica_router._latency.update({self.engines[1]: 0.5, self.engines[2]: 0.001})
+        self.assertEqual(self.actor_name(), 'Replica 1')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import json
+from datetime import date
+
+from app import db
+from app.models import Actor, Gender
+from app.main.response_cache import response_cache, get_backend
+from test_auth import FIRST_PEM, make_token
+from test_listing import LocalAuthTestCase
+
+
+class ResponseCacheTestCase(LocalAuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        response_cache.reset_stats()
+
+    def request(self, url, **headers):
+        headers.update(self.producer_headers)
+        return self.client().get(url, headers=headers)
+
+    def test_identical_requests_are_served_from_cache(self):
+        first = self.request('/actors?limit=3&page=1')
+        second = self.request('/actors?page=1&limit=3')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        # defaults are keyed as if given
+        self.request('/actors?limit=7')
+        self.request('/actors')
+        self.assertEqual((response_cache.hits, response_cache.misses), (2, 2))
+
+    def test_writes_invalidate_dependent_lists(self):
+        self.request('/actors')
+        self.request('/movies')
+        res = self.client().patch('/actors/10', json={'name': 'Actor A'}, headers=self.producer_headers)
+        self.assertEqual(res.status_code, 200)
+
+        data = json.loads(self.request('/actors').data)
+        self.assertEqual(data['actors'][0]['name'], 'Actor 1')
+        self.request('/movies')
+        self.assertEqual((response_cache.hits, response_cache.misses), (1, 3))
+
+    def test_contracts_invalidate_embedded_lists(self):
+        self.request('/movies?include=cast')
+        self.client().post('/contracts', json={'actor_id': 1, 'movie_id': 10}, headers=self.producer_headers)
+
+        data = json.loads(self.request('/movies?include=cast').data)
+        self.assertEqual([a['id'] for a in data['movies'][0]['cast']], [1])
+
+    def test_304_for_matching_etag(self):
+        etag = self.request('/movies').headers['ETag']
+        res = self.request('/movies', **{'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        db.session.add(Actor(name='Actor X', birthdate=date(1990, 1, 1), gender=Gender.other))
+        db.session.commit()
+        self.assertEqual(self.request('/movies', **{'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.request('/actors', **{'If-None-Match': etag}).status_code, 200)
+
+    def test_errors_are_not_cached(self):
+        self.request('/actors?page=5')
+        res = self.request('/actors?page=5')
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(response_cache.hits, 0)
+
+    def test_token_is_checked_on_cache_hits(self):
+        self.request('/actors')
+        headers = {"Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', ['get:movies']))}
+        res = self.client().get('/actors', headers=headers)
+        self.assertEqual(res.status_code, 403)
+
+    def test_include_permissions_are_checked_on_cache_hits(self):
+        for url, permission in (('/actors?include=movies', 'get:actors'), ('/movies?include=cast', 'get:movies')):
+            self.assertEqual(self.request(url).status_code, 200)
+            headers = {"Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', [permission]))}
+            res = self.client().get(url, headers=headers)
+            self.assertEqual(res.status_code, 403, url)
+        self.assertEqual(response_cache.hits, 0)
+
+    def test_lru_eviction(self):
+        backend = get_backend('memory', maxsize=2)
+        for key in ('a', 'b', 'c'):
+            backend.set(key, (b'{}', key), ttl=60)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('c'), (b'{}', 'c'))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import json
+import threading
+import time
+from datetime import date
+from unittest import mock
+
+from app import db
+from app.models import Actor, Movie, Gender
+from app.search.index import inverted_index, tokenize
+from test_auth import FIRST_PEM, make_token
+from test_listing import LocalAuthTestCase
+
+
+class SearchTestCase(LocalAuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for name in ('Sandra Bullock', 'Sandra Oh', 'Tom Hanks', 'Tom Hanks Jr Hanks'):
+            db.session.add(Actor(name=name, birthdate=date(1964, 7, 26), gender=Gender.other))
+        db.session.add(Movie(title='Gravity', release_date=date(2013, 10, 4)))
+        db.session.commit()
+
+    def search(self, query, headers=None):
+        res = self.client().get('/search?q=' + query, headers=headers or self.producer_headers)
+        return res, json.loads(res.data)
+
+    def test_every_word_must_match(self):
+        res, data = self.search('sandra%20BULLOCK')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([a['name'] for a in data['actors']], ['Sandra Bullock'])
+        self.assertEqual(data['movies'], [])
+
+    def test_ranked_by_share_of_matching_words(self):
+        res, data = self.search('hanks')
+        self.assertEqual([a['name'] for a in data['actors']], ['Tom Hanks', 'Tom Hanks Jr Hanks'])
+        res, data = self.search('sandra&limit=1')
+        self.assertEqual(len(data['actors']), 1)
+
+    def test_index_follows_committed_writes(self):
+        res, data = self.search('gravity')
+        self.assertEqual([m['title'] for m in data['movies']], ['Gravity'])
+
+        res = self.client().patch('/movies/11', json={'title': 'Speed'}, headers=self.producer_headers)
+        self.assertEqual(res.status_code, 200)
+        res, data = self.search('gravity')
+        self.assertEqual(data['movies'], [])
+        res, data = self.search('speed')
+        self.assertEqual([m['id'] for m in data['movies']], [11])
+
+    def test_rolled_back_writes_keep_the_index(self):
+        self.search('gravity')
+        builds = inverted_index.builds
+        db.session.add(Movie(title='Gravity 2', release_date=date(2030, 1, 1)))
+        db.session.flush()
+        db.session.rollback()
+
+        res, data = self.search('gravity')
+        self.assertEqual(len(data['movies']), 1)
+        self.assertEqual(inverted_index.builds, builds)
+
+    def test_concurrent_searches_wait_for_the_build(self):
+        inverted_index.clear()
+        built = []
+
+        def slow_build(model):
+            time.sleep(0.05)
+            built.append(model)
+            with inverted_index._lock:
+                inverted_index._postings['movie'] = {'gravity': {11: 1}}
+                inverted_index._lengths['movie'] = {11: 1}
+
+        results, errors = [], []
+
+        def index():
+            try:
+                results.append(inverted_index.index(Movie))
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(inverted_index, 'build', slow_build):
+            threads = [threading.Thread(target=index) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(built, [Movie])
+        self.assertEqual([postings for postings, _ in results], [{'gravity': {11: 1}}] * 8)
+
+    def test_only_readable_tables_are_searched(self):
+        headers = {"Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', ['get:movies']))}
+        res, data = self.search('gravity', headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('actors', data)
+
+        headers = {"Authorization": "Bearer {}".format(make_token(FIRST_PEM, 'first', ['add:movies']))}
+        res, data = self.search('gravity', headers)
+        self.assertEqual(res.status_code, 403)
+
+    def test_422_without_words(self):
+        res, data = self.search('%20-')
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("Harry Potter: the Chamber-of-Secrets"),
+                         ['harry', 'potter', 'the', 'chamber', 'of', 'secrets'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()